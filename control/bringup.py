@@ -0,0 +1,74 @@
+"""Opens several devices at once and times each of them.
+
+Connecting to the Xbee, the i2c data server and the Pixhawk one after the
+other makes the boot time the sum of the three. bring_up() opens them on
+their own threads, so it only takes as long as the slowest, and records how
+long each one took for the startup report.
+"""
+import logging
+import threading
+import time
+
+
+_logger = logging.getLogger(__name__)
+
+
+class DeviceStartup(object):
+    """The result of opening one device: the object returned by its open
+    function (None if it failed), the exception raised (None if it did not)
+    and the seconds it took."""
+    __slots__ = ('name', 'device', 'error', 'seconds')
+
+    def __init__(self, name, device=None, error=None, seconds=None):
+        self.name = name
+        self.device = device
+        self.error = error
+        self.seconds = seconds
+
+    def __repr__(self):
+        """Returns representation of the startup"""
+        return '{}({}, {}, {}, {})'.format(self.__class__.__name__, self.name,
+                                           self.device, self.error, self.seconds)
+
+
+def bring_up(devices):
+    """Opens every device concurrently and waits for all of them.
+
+    Args:
+        devices (list): (name, open function) tuples, each function returns
+                        the opened device or raises an exception.
+
+    :returns: dict -- DeviceStartup by device name.
+    """
+    startups = dict((name, DeviceStartup(name)) for name, _ in devices)
+
+    def _open(startup, function):
+        start = time.time()
+        try:
+            startup.device = function()
+        except Exception as err:
+            _logger.exception('Could not open {}'.format(startup.name))
+            startup.error = err
+        startup.seconds = time.time() - start
+
+    threads = [threading.Thread(target=_open, args=(startups[name], function),
+                                name='bring-up-{}'.format(name))
+               for name, function in devices]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return startups
+
+
+def startup_report(startups, total=None):
+    """Returns a line summarizing the time each device took to open (and the
+    total time, if given)."""
+    parts = ['{} {}'.format(startup.name, 'failed after {:.2f} s'.format(startup.seconds)
+                            if startup.error else '{:.2f} s'.format(startup.seconds))
+             for startup in sorted(startups.values(), key=lambda startup: startup.name)]
+    line = 'Startup: ' + ', '.join(parts)
+    if total is not None:
+        line += ' (total {:.2f} s)'.format(total)
+    return line
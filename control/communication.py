@@ -1,30 +1,170 @@
 """Abstracts communication using the Xbee."""
+import collections
 import logging
 import json
-import serial
+import threading
+import time
+from lazy import LazyModule
+from protocol import SYNC, PROTOCOL_VERSION, FrameDecoder, encode_message, encode_telemetry_batch
+
+
+# Sent by either side to ask for binary framing. The other side answers with
+# BINARY_ACCEPT. The offering side switches to binary framing once it has
+# the answer, the answering side once it receives the first binary frame.
+# Both sides decode JSON and binary frames meanwhile, so a lost message only
+# delays the switch.
+BINARY_OFFER = {u'protocol': u'binary', u'version': PROTOCOL_VERSION}
+BINARY_ACCEPT = {u'protocol': u'binary', u'version': PROTOCOL_VERSION, u'accepted': True}
+
+# Priority classes of outgoing messages (lower is more important)
+CRITICAL = 0
+TELEMETRY = 1
+DEBUG = 2
+
+# Received messages no subscriber handled kept for receive() at most
+INBOX_SIZE = 1024
+
+serial = LazyModule('serial')  # Imported when the port is opened (see lazy.py)
 
 
 class Communication:
-    """Class abstracting communication using the Xbee via serial."""
-    def __init__(self, port, time_out):
+    """Class abstracting communication using the Xbee via serial.
+
+    Messages are sent as newline terminated json by default. With binary
+    framing (see protocol.py) telemetry and waypoints take a fraction of the
+    bytes. Binary framing is used when binary=True or once it has been
+    negotiated with negotiate_binary().
+
+    Telemetry given to send_telemetry() is batched: up to batch_size samples
+    or batch_interval seconds worth are written together (delta compressed
+    with binary framing). Every other send() flushes the batch first, so
+    messages keep their order and alerts go out immediately. When
+    asynchronous, the writer thread also flushes a batch as soon as its
+    first sample is batch_interval seconds old.
+
+    With asynchronous=True sending never blocks: messages are put on one of
+    three queues (CRITICAL, TELEMETRY, DEBUG) and written by a background
+    thread, most important first. The TELEMETRY and DEBUG queues hold at most
+    queue_size messages, the oldest is dropped when they are full, and a DEBUG
+    message identical to the last one queued is coalesced with it. CRITICAL
+    messages are never dropped. See queue_depth(), dropped and coalesced.
+
+    After start_receiving() a reader thread receives messages as soon as they
+    arrive. They are passed to the callbacks registered with subscribe() and,
+    unless a callback handles them, kept for receive() and messages() (at
+    most inbox_size, the oldest is dropped with a warning, see
+    inbox_dropped).
+    """
+    def __init__(self, port, time_out, binary=False, batch_size=1, batch_interval=None,
+                 asynchronous=False, queue_size=64, inbox_size=INBOX_SIZE):
         self.logger = logging.getLogger(__name__)
         self.ser = serial.Serial(port, timeout=time_out)
+        self.time_out = time_out
+        self.binary = binary
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue_size = queue_size
+        self.dropped = [0, 0, 0]  # Messages dropped per priority class
+        self.coalesced = 0  # Duplicate DEBUG messages merged
+        self.inbox_dropped = 0  # Received messages dropped from a full inbox
+        self.__batch = []
+        self.__batch_started = 0.0
+        self.__batch_lock = threading.Lock()
+        self.__decoder = FrameDecoder(json_lines=True)
+        self.__messages = collections.deque()
+        self.__queues = [collections.deque() for _ in (CRITICAL, TELEMETRY, DEBUG)]
+        self.__queue_condition = threading.Condition()
+        self.__writer = None
+        self.__closing = False
+        self.__reader = None
+        self.__inbox = collections.deque(maxlen=inbox_size)
+        self.__inbox_condition = threading.Condition()
+        self.__subscribers = []
+        if asynchronous:
+            self.__writer = threading.Thread(target=self.__write_queued, name='com-writer')
+            self.__writer.daemon = True
+            self.__writer.start()
 
-    def send(self, data):
+    def send(self, data, priority=TELEMETRY):
         """Send data via the communication module.
 
         This functions sends the data via serial. It is important that the data
         be "jsonnable" or else this will fail miserably.
 
         :param data: The data to send (must be able to be jsonned).
+        :param priority: CRITICAL, TELEMETRY or DEBUG (only used when
+                         asynchronous). DEBUG messages may be coalesced.
+        :returns: bool -- False if data is too large for a binary frame (it
+                  is not sent, use reliable.ReliableLink for large data).
 
         """
-        # json data given by user and string encode it
-        jsoned = json.dumps(data)
-        byte_data = str.encode(jsoned)
-        # send data
-        self.ser.write(byte_data)
-        self.ser.write(b'\n')
+        self.flush()
+        try:
+            byte_data = self.__encode(data)
+        except ValueError as err:
+            self.logger.error('Not sent: {}'.format(err))
+            return False
+        self.__write(byte_data, priority)
+        return True
+
+    def queue_depth(self, priority=None):
+        """Returns the number of messages waiting to be written (for one
+        priority class or all of them)."""
+        with self.__queue_condition:
+            if priority is not None:
+                return len(self.__queues[priority])
+            return sum(len(queue) for queue in self.__queues)
+
+    def close(self):
+        """Write everything still queued, stop the writer and reader threads
+        and close the serial port."""
+        self.flush()
+        self.__closing = True
+        if self.__reader:
+            self.__reader.join()
+            self.__reader = None
+        if self.__writer:
+            with self.__queue_condition:
+                self.__queue_condition.notify()
+            self.__writer.join()
+            self.__writer = None
+        self.ser.close()
+
+    def send_telemetry(self, sample):
+        """Queue a telemetry sample (see protocol.TELEMETRY_FIELDS) for sending.
+
+        The batch is written once it holds batch_size samples or its first
+        sample is batch_interval seconds old (checked by the writer thread
+        when asynchronous, otherwise when the next sample is given).
+
+        :param sample: The telemetry dictionary to send.
+
+        """
+        with self.__batch_lock:
+            started = not self.__batch
+            if started:
+                self.__batch_started = time.time()
+            self.__batch.append(sample)
+            full = (len(self.__batch) >= self.batch_size or
+                    (self.batch_interval is not None and
+                     time.time() - self.__batch_started >= self.batch_interval))
+        if full:
+            self.flush()
+        elif started and self.__writer and self.batch_interval is not None:
+            with self.__queue_condition:
+                self.__queue_condition.notify()  # Flush the batch when it is due
+
+    def flush(self):
+        """Write any batched telemetry samples in a single write."""
+        with self.__batch_lock:
+            if not self.__batch:
+                return
+            if self.binary:
+                byte_data = encode_telemetry_batch(self.__batch)
+            else:
+                byte_data = b''.join(self.__encode(sample) for sample in self.__batch)
+            self.__batch = []
+        self.__write(byte_data, TELEMETRY)
 
     def receive(self):
         """Receive data from the communcation module.
@@ -33,6 +173,13 @@ class Communication:
         type of data returned should be the same as the type that was sent by
         the other device.
 
+        A binary framing offer from the other device is answered (this side
+        switches to binary framing when the first binary frame arrives), it
+        is not returned.
+
+        When the reader thread is running this returns the oldest message it
+        received that no subscriber handled.
+
         :returns:
         None -- if the time_out time is exceeded
 
@@ -41,9 +188,173 @@ class Communication:
                                    it accordingly.
 
         """
+        if not self.__reader:
+            return self.__read_message()
+        with self.__inbox_condition:
+            if not self.__inbox:
+                self.__inbox_condition.wait(self.time_out)
+            if self.__inbox:
+                return self.__inbox.popleft()
+        return None
+
+    def start_receiving(self):
+        """Start a reader thread that receives messages as they arrive.
+
+        Messages are handed to the subscribe() callbacks from the reader
+        thread, so callbacks must not block. Do not call negotiate_binary()
+        once the reader thread is running.
+        """
+        if self.__reader:
+            return
+        self.__reader = threading.Thread(target=self.__read_messages, name='com-reader')
+        self.__reader.daemon = True
+        self.__reader.start()
+
+    def subscribe(self, callback):
+        """Register callback(message) to be called for every received message.
+
+        If the callback returns True the message is considered handled and is
+        not kept for receive(). Only used with start_receiving().
+        """
+        self.__subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove a callback registered with subscribe()."""
+        self.__subscribers.remove(callback)
+
+    def messages(self):
+        """Generator yielding received messages as they arrive (blocks
+        while there are none)."""
+        while True:
+            message = self.receive()
+            if message is not None:
+                yield message
+
+    def negotiate_binary(self, tries=3):
+        """Offer binary framing to the other device.
+
+        The offer is sent up to tries times, each time waiting up to time_out
+        for the answer (BINARY_ACCEPT). Anything else received meanwhile is
+        discarded.
+
+        :returns: bool -- True if binary framing is now in use.
+
+        """
+        if self.binary:
+            return True
+        for _ in range(tries):
+            self.send(BINARY_OFFER, priority=CRITICAL)
+            if self.__receive_json() == BINARY_ACCEPT:
+                self.logger.debug('Binary framing accepted')
+                self.binary = True
+                return True
+        self.logger.warn('Binary framing not accepted, staying with json')
+        return False
+
+    def __write(self, byte_data, priority):
+        """Writes byte_data now, or queues it when asynchronous."""
+        if not self.__writer:
+            self.ser.write(byte_data)
+            return
+        with self.__queue_condition:
+            queue = self.__queues[priority]
+            if priority == DEBUG and queue and queue[-1] == byte_data:
+                self.coalesced += 1
+                return
+            if priority != CRITICAL and len(queue) >= self.queue_size:
+                queue.popleft()
+                self.dropped[priority] += 1
+            queue.append(byte_data)
+            self.__queue_condition.notify()
+
+    def __batch_wait(self):
+        """Returns the seconds until the telemetry batch must be flushed
+        (None if there is no batch or no batch_interval)."""
+        if not self.__batch or self.batch_interval is None:
+            return None
+        return max(self.__batch_started + self.batch_interval - time.time(), 0)
+
+    def __write_queued(self):
+        """Writer thread body, writes queued messages most important first
+        and flushes the telemetry batch when it is due."""
+        while True:
+            with self.__queue_condition:
+                while not self.__closing and not any(self.__queues):
+                    wait = self.__batch_wait()
+                    if wait == 0:
+                        break
+                    self.__queue_condition.wait(wait)
+                queue = next((queue for queue in self.__queues if queue), None)
+                if queue is None and self.__closing:
+                    return  # Closing and everything has been written
+                byte_data = queue.popleft() if queue is not None else None
+            try:
+                if byte_data is None:
+                    self.flush()  # Queues the batch for the next iteration
+                else:
+                    self.ser.write(byte_data)
+            except serial.SerialException as err:
+                self.logger.error('SerialException: {}'.format(err))
+            except Exception:
+                # Keep writing, the CRITICAL queue is never dropped
+                self.logger.exception('Error in the writer thread')
+
+    def __read_messages(self):
+        """Reader thread body, dispatches every received message."""
+        while not self.__closing:
+            try:
+                message = self.__read_message()
+            except serial.SerialException as err:
+                self.logger.error('SerialException: {}'.format(err))
+                time.sleep(self.time_out)
+                continue
+            if message is None:
+                continue
+            handled = False
+            for callback in list(self.__subscribers):
+                try:
+                    handled = callback(message) or handled
+                except Exception:
+                    self.logger.exception('Error in message callback')
+            if not handled:
+                with self.__inbox_condition:
+                    if len(self.__inbox) == self.__inbox.maxlen:
+                        self.inbox_dropped += 1
+                        self.logger.warning('Inbox full, dropped the oldest received message: '
+                                            '%s', self.__inbox[0])
+                    self.__inbox.append(message)
+                    self.__inbox_condition.notify()
+
+    def __read_message(self):
+        """Reads the next message from the serial port (None on time_out)."""
+        message = self.__receive_frame() if self.binary else self.__receive_json()
+        if message == BINARY_OFFER:
+            self.logger.debug('Accepting binary framing')
+            self.send(BINARY_ACCEPT, priority=CRITICAL)
+            return None
+        if message == BINARY_ACCEPT:
+            return None  # Another answer to an offer already accepted
+        return message
+
+    def __encode(self, data):
+        """Returns the bytes sent for data with the current framing."""
+        if self.binary:
+            return encode_message(data)
+        # json data given by user and string encode it
+        jsoned = json.dumps(data)
+        return str.encode(jsoned) + b'\n'
+
+    def __receive_json(self):
+        """Returns the next json message (None on time_out or corruption)."""
         jsoned_data = self.ser.readline()
         if not jsoned_data:
             return None
+        if SYNC in jsoned_data:
+            # The other side has switched to binary framing after our answer
+            self.logger.debug('Switching to binary framing')
+            self.binary = True
+            self.__messages.extend(self.__decoder.feed(jsoned_data))
+            return self.__receive_frame()
         try:
             unjsoned_data = json.loads(jsoned_data)
             return unjsoned_data
@@ -51,3 +362,13 @@ class Communication:
             self.logger.warn('ValueError: {}'.format(err))
             self.logger.warn('received: {}'.format(jsoned_data))
             return None
+
+    def __receive_frame(self):
+        """Returns the next binary framed message (None on time_out)."""
+        while not self.__messages:
+            waiting = self.ser.in_waiting
+            data = self.ser.read(waiting if waiting else 1)
+            if not data:
+                return None
+            self.__messages.extend(self.__decoder.feed(data))
+        return self.__messages.popleft()
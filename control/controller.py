@@ -3,150 +3,525 @@
 The main motivation behind putting this into its own class is that ability
 to unit test this with the dronekit sitl and to make our main logic somewhat
 easier to decouple from the dronekit library if the time ever comes.
+
+Blocking calls wait on dronekit attribute listeners (see Controller.wait_for)
+instead of sleeping, so they return as soon as the vehicle reports the change.
+
+A list of points can be flown as a mission (see upload_mission and
+start_mission): the flight controller flies it in AUTO mode on its own and
+reports its progress with MISSION_CURRENT and MISSION_ITEM_REACHED messages.
+It can also be followed in GUIDED mode (see start_path), steering towards a
+target ahead on the path on every location update, optionally with
+SET_POSITION_TARGET_GLOBAL_INT velocity commands.
+
+Controller.state is a VehicleState snapshot rebuilt on every update, so the
+decisions of one loop iteration all see the same values.
 """
 import logging
+import threading
 import time
-import dronekit
-from gps import get_distance
+import numpy
+from communication import CRITICAL, DEBUG
+from geofence import CylinderGeofence, GeofenceMonitor, ZonedGeofence
+from gps import LocalFrame, get_distance, get_location_offset
 from helper import location_global_relative_to_gps_reading
+from lazy import LazyModule
+from path import PathFollower
+from state import VehicleState
+
+
+# Vehicle attributes that wake up Controller.wait_for()
+WAKE_ATTRIBUTES = ('location.global_relative_frame', 'armed', 'mode',
+                   'gps_0', 'ekf_ok', 'system_status')
+
+# Seconds to wait for the parameters and attributes to be downloaded
+READY_TIMEOUT = 300
+
+# Modes in which the vehicle is flying our commands (a user takeover changes it)
+AUTONOMOUS_MODES = ('GUIDED', 'AUTO')
+
+# SET_POSITION_TARGET_GLOBAL_INT type_mask using the position and velocity
+# (ignoring acceleration, yaw and yaw rate)
+POSITION_VELOCITY_MASK = 0b0000110111000000
+
+# Imported when the first Controller connects (see lazy.py)
+dronekit = LazyModule('dronekit')
+mavutil = LazyModule('pymavlink.mavutil')
 
 
 class Controller:
     """This class acts as a wrapper for dronekit and controls the vehicle."""
-    def __init__(self, connection_string, baud=None, com=None):
+    def __init__(self, connection_string, baud=None, com=None, wait_ready=True):
         """Open a connection to the vehicle.
 
         Args:
             connection_string (str): Location of the drone.
             baud (int): Baudrate of serial connection (if applicable).
+            com (Communication): Where messages for the GCS are sent (see set_com).
+            wait_ready (bool): Wait for the parameters and attributes to be
+                               downloaded. If False only the first heartbeat
+                               is waited for, the rest is downloaded in the
+                               background and waited for by wait_ready(), at
+                               the latest when arming.
         """
         self.logger = logging.getLogger(__name__)
         self.connection_string = connection_string
         self.vehicle = None
+        self.ready = False
         self.__com = com
+        self.__com_lock = threading.Lock()
+        self.__unsent = []  # Bring-up messages sent before there was a com
+        self.__ready_thread = None
+        self.__ready_error = None
         if baud:
             self.logger.debug('Attempting connection to %s at baud %s',
                               connection_string, baud)
-            if self.__com:
-                self.__com.send(u"Attempting connection to {} at baud {}".format(
-                                connection_string, baud))
+            self.__send(u"Attempting connection to {} at baud {}".format(
+                        connection_string, baud))
             self.vehicle = dronekit.connect(self.connection_string,
-                                            wait_ready=True, baud=baud)
+                                            wait_ready=wait_ready, baud=baud)
         else:
             self.logger.debug('Attempting connection to %s',
                               connection_string)
-            if self.__com:
-                self.__com.send(u"Attempting connection to {}".format(
-                                connection_string))
+            self.__send(u"Attempting connection to {}".format(
+                        connection_string))
             self.vehicle = dronekit.connect(self.connection_string,
-                                            wait_ready=True)
+                                            wait_ready=wait_ready)
+        self.ready = wait_ready
         self.logger.debug('Connected.')
-        if self.__com:
-            self.__com.send(u"Connected.")
+        self.__send(u"Connected.")
 
         def _vehicle_state_callback(vehicle, attribute, value):
-            """Logs vehicle state changes."""
-            self.logger.debug("Attribute {}: {}".format(attribute, value))
+            """Logs vehicle state changes (only called when the value changes,
+            so not rate limited)."""
+            self.logger.debug("Attribute %s: %s", attribute, value)
             if self.__com:
-                self.__com.send(u"Attribute {}: {}".format(attribute, value))
+                self.__com.send(u"Attribute {}: {}".format(attribute, value), priority=DEBUG)
         self.vehicle.add_attribute_listener('armed',
                                             _vehicle_state_callback)
         self.vehicle.add_attribute_listener('mode',
                                             _vehicle_state_callback)
         self.home = None  # Set right after arming (GPS can be trusted then)
+        self.geofence_monitor = None
+        self.mission_length = 0  # Waypoints of the uploaded mission
+        self.mission_current = 0  # Mission item being flown to (1 is the first waypoint)
+        self.mission_reached = 0  # Last mission item reached
+        self.__path = None  # (LocalFrame, PathFollower, speed) of start_path()
+        self.__mission_points = []
+        self.__home_frame = None  # LocalFrame around home
+        self.__target_frame = None  # LocalFrame around the GpsReading being flown to
+
+        # Take a new snapshot and wake up anything in wait_for() whenever these
+        # attributes update
+        self.__updated = threading.Condition()
+        self.__updates = 0
+        self.__state = self.__snapshot()
+
+        def _vehicle_update_callback(vehicle, attribute, value):
+            """Notifies waiting threads of a vehicle update."""
+            self.__update_state()
+        for attribute in WAKE_ATTRIBUTES:
+            self.vehicle.add_attribute_listener(attribute, _vehicle_update_callback)
+
+        def _mission_current_callback(vehicle, name, message):
+            """Reports the mission item being flown to when it changes."""
+            if message.seq == self.mission_current:
+                return
+            self.mission_current = message.seq
+            if 0 < message.seq <= len(self.__mission_points):
+                point = self.__mission_points[message.seq - 1]
+                self.__target_frame = LocalFrame(location_global_relative_to_gps_reading(point))
+            if self.mission_length:
+                self.logger.debug("Flying to mission item %d of %d", message.seq,
+                                  self.mission_length)
+                if self.__com:
+                    self.__com.send(u"Flying to mission item {} of {}".format(
+                                    message.seq, self.mission_length), priority=DEBUG)
+            _vehicle_update_callback(vehicle, name, message.seq)
+
+        def _mission_item_reached_callback(vehicle, name, message):
+            """Records the mission items reached."""
+            self.mission_reached = message.seq
+            self.logger.debug("Reached mission item %d", message.seq)
+            _vehicle_update_callback(vehicle, name, message.seq)
+        self.vehicle.add_message_listener('MISSION_CURRENT', _mission_current_callback)
+        self.vehicle.add_message_listener('MISSION_ITEM_REACHED',
+                                          _mission_item_reached_callback)
+        if not wait_ready:
+            self.start_wait_ready()
+
+    def __send(self, message):
+        """Sends a bring-up message to the GCS (as DEBUG), or keeps it for
+        set_com() if there is no com yet."""
+        with self.__com_lock:
+            if self.__com:
+                self.__com.send(message, priority=DEBUG)
+            else:
+                self.__unsent.append(message)
+
+    def set_com(self, com):
+        """Sends messages for the GCS with com from now on (for a Communication
+        opened after, or at the same time as, the Controller). The bring-up
+        messages sent before are sent first."""
+        with self.__com_lock:
+            self.__com = com
+            unsent, self.__unsent = self.__unsent, []
+            for message in unsent:
+                com.send(message, priority=DEBUG)
+
+    def start_wait_ready(self, timeout=READY_TIMEOUT):
+        """Starts downloading the parameters and the attributes needed to fly
+        in the background (once), wait_ready() waits for the download to end."""
+        if self.ready or self.__ready_thread:
+            return
+        self.logger.debug('Waiting for vehicle parameters and attributes...')
+        self.__send(u"Waiting for vehicle parameters and attributes...")
+        self.__ready_thread = threading.Thread(target=self.__wait_ready, args=(timeout,),
+                                               name='vehicle-ready')
+        self.__ready_thread.daemon = True
+        self.__ready_thread.start()
+
+    def __wait_ready(self, timeout):
+        """Ready thread body."""
+        start = time.time()
+        try:
+            self.vehicle.wait_ready(True, timeout=timeout)
+        except Exception as err:
+            self.logger.exception('Vehicle not ready')
+            self.__ready_error = err
+            return
+        self.ready = True
+        seconds = time.time() - start
+        self.logger.debug('Vehicle ready after {:.2f} s'.format(seconds))
+        self.__send(u"Vehicle ready after {:.2f} s".format(seconds))
+
+    def wait_ready(self, timeout=READY_TIMEOUT):
+        """Blocks until the parameters and the attributes needed to fly have
+        been downloaded, starting the download if start_wait_ready() did not.
+        Returns the seconds waited, raises the error of the download if it
+        failed."""
+        start = time.time()
+        self.start_wait_ready(timeout)
+        if self.__ready_thread:
+            self.__ready_thread.join()
+        error = self.__ready_error
+        if error:
+            # Downloaded again by the next call
+            self.__ready_thread, self.__ready_error = None, None
+            raise error
+        return time.time() - start
+
+    @property
+    def state(self):
+        """The VehicleState snapshot of the latest update."""
+        return self.__state
+
+    def __snapshot(self):
+        """Returns a VehicleState of the vehicle's current attributes."""
+        vehicle = self.vehicle
+        mode = vehicle.mode.name if vehicle.mode else None  # None until the first heartbeat
+        return VehicleState(self.__updates, vehicle.location.global_relative_frame,
+                            mode, vehicle.armed, vehicle.velocity,
+                            vehicle.groundspeed, vehicle.airspeed, self.__home_frame,
+                            self.__target_frame)
+
+    def __update_state(self):
+        """Takes a new snapshot and notifies the threads in wait_for()."""
+        with self.__updated:
+            self.__updates += 1
+            self.__state = self.__snapshot()
+            self.__updated.notify_all()
+
+    def wait_for(self, predicate, timeout, on_update=None):
+        """Blocks until predicate() is True or timeout seconds have passed.
+
+        predicate is checked again every time the vehicle location, armed
+        state, mode or readiness updates. on_update() is called after each
+        update (before predicate is checked again).
+
+        :returns: bool -- The last result of predicate().
+        """
+        deadline = time.time() + timeout
+        with self.__updated:
+            seen = self.__updates
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            with self.__updated:
+                if self.__updates == seen:
+                    self.__updated.wait(remaining)
+                seen = self.__updates
+            if on_update:
+                on_update()
+        return True
 
     def arm(self):
         """Sets the mode to guided and arms the copter for flight."""
+        self.wait_ready()
         while not self.vehicle.is_armable:
             self.logger.debug('Waiting for vehicle to initialise...')
             if self.__com:
-                self.__com.send(u"Waiting for vehicle to initialise...")
-            time.sleep(5)
+                self.__com.send(u"Waiting for vehicle to initialise...", priority=DEBUG)
+            self.wait_for(lambda: self.vehicle.is_armable, 5)
         # Arm the copter
         self.vehicle.mode = dronekit.VehicleMode("GUIDED")
         while not self.vehicle.armed:
             self.logger.debug('Trying to arm...')
             if self.__com:
-                self.__com.send(u"Trying to arm...")
+                self.__com.send(u"Trying to arm...", priority=DEBUG)
             self.vehicle.armed = True
-            time.sleep(1)
+            self.wait_for(lambda: self.vehicle.armed, 1)
         self.home = self.vehicle.location.global_relative_frame
+        self.__home_frame = LocalFrame(location_global_relative_to_gps_reading(self.home))
+        self.__update_state()
 
     def takeoff(self, target_altitude):
         """Takes off the copter (must be armed first) to the target altitude.
         This function blocks until the height has been reached or takeoff
-        has been cancelled by the user.
+        has been cancelled by the user. A geofence (10 m around home, 10 m
+        above the target altitude) is checked on every location update from
+        here on (see enable_geofence).
         """
         self.logger.debug("Attempting simple takeoff to {} m...".format(target_altitude))
         if self.__com:
-            self.__com.send(u"Attempting simple takeoff to {} m...".format(target_altitude))
+            self.__com.send(u"Attempting simple takeoff to {} m...".format(target_altitude),
+                            priority=DEBUG)
+        self.enable_geofence(10, target_altitude + 10)
         self.vehicle.simple_takeoff(target_altitude)
-        start_takeoff_time = time.time()
+
+        def _reached():
+            return self.state.altitude >= target_altitude * 0.95
+
+        def _done():
+            return _reached() or self.state.mode != "GUIDED"
+
+        def _on_update():
+            if time.time() - last_log[0] >= 3:
+                last_log[0] = time.time()
+                self.log_flight_info()
+        last_log = [time.time()]
 
         # Wait till target altitude reached
-        while True:
-            time.sleep(3)
-            time_since_takeoff = time.time() - start_takeoff_time
-            self.log_flight_info()
-            self.check_geofence(10, target_altitude + 10)
-            if self.vehicle.location.global_relative_frame.alt >= target_altitude * 0.95:
-                self.logger.debug("Reached target altitude")
-                if self.__com:
-                    self.__com.send(u"Reached target altitude")
-                break
-            elif time_since_takeoff > 30:
-                self.logger.debug("Time limit reached for takeoff. Takeoff finished")
-                if self.__com:
-                    self.__com.send(u"Time limit reach for takeoff. Takeoff finished")
-                break
-            elif self.vehicle.mode.name != "GUIDED":
-                self.logger.debug("No longer guided. Autopilot did not reach target altitude.")
-                if self.__com:
-                    self.__com.send(u"No longer guided. Autopilot did not reach target altitude.")
-                # User took over control or geofence triggered
-                break
+        self.wait_for(_done, 30, on_update=_on_update)
+        self.log_flight_info()
+        if _reached():
+            self.logger.debug("Reached target altitude")
+            if self.__com:
+                self.__com.send(u"Reached target altitude", priority=DEBUG)
+        elif self.state.mode != "GUIDED":
+            self.logger.debug("No longer guided. Autopilot did not reach target altitude.")
+            if self.__com:
+                self.__com.send(u"No longer guided. Autopilot did not reach target altitude.",
+                                priority=CRITICAL)
+            # User took over control or geofence triggered
+        else:
+            self.logger.debug("Time limit reached for takeoff. Takeoff finished")
+            if self.__com:
+                self.__com.send(u"Time limit reach for takeoff. Takeoff finished", priority=DEBUG)
         self.home.alt = target_altitude  # This way home isn't 0 meters high when calling goto
         return
 
-    def log_flight_info(self, destination=None):
-        """Logs some info from the vehicle."""
-        current_location = self.vehicle.location.global_relative_frame
-        self.logger.debug("{}".format(current_location))
-        self.logger.debug("Velocity: {}".format(self.vehicle.velocity))
-        self.logger.debug("Groundspeed: {}".format(self.vehicle.groundspeed))
-        self.logger.debug("Airspeed: {}".format(self.vehicle.airspeed))
+    def log_flight_info(self, destination=None, state=None):
+        """Logs some info from the vehicle (from the state snapshot, the
+        latest one by default)."""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        state = state or self.state
+        # Logged on every update, keyed so a fast loop is rate limited (see logqueue)
+        self.logger.debug("%s", state.location, extra={'key': 'location'})
+        self.logger.debug("Velocity: %s", state.velocity, extra={'key': 'velocity'})
+        self.logger.debug("Groundspeed: %s", state.groundspeed, extra={'key': 'groundspeed'})
+        self.logger.debug("Airspeed: %s", state.airspeed, extra={'key': 'airspeed'})
+        if state.reading is None:
+            return  # No fix yet, so no distance
         if destination:
-            current_reading = location_global_relative_to_gps_reading(current_location)
             destination_reading = location_global_relative_to_gps_reading(destination)
-            distance = get_distance(destination_reading, current_reading)
-            self.logger.debug("Distance from destination: {}".format(distance))
+            distance = get_distance(destination_reading, state.reading)
+            self.logger.debug("Distance from destination: %s", distance,
+                              extra={'key': 'distance'})
+        elif state.target:
+            self.logger.debug("Distance from destination: %s", state.distance_to_target,
+                              extra={'key': 'distance'})
 
-    def check_geofence(self, max_distance, max_altitude):
+    def check_geofence(self, max_distance, max_altitude, state=None):
         """Ensures the vehicle stays within our geofence (basically a cyclinder
-        around the takeoff location)."""
-        current = location_global_relative_to_gps_reading(
-                    self.vehicle.location.global_relative_frame)
-        home = location_global_relative_to_gps_reading(self.home)
-        distance = get_distance(home, current)
+        around the takeoff location), from the state snapshot (the latest one
+        by default). Nothing is checked while the position is unknown (no fix,
+        or not armed yet so there is no home)."""
+        state = state or self.state
+        distance = state.distance_to_home
+        if distance is None or state.altitude is None:
+            # None > max_distance is False in Python 2, so say it instead
+            self.logger.warning("Position unknown, geofence not checked")
+            return
         if distance > max_distance:
             self.logger.critical("Exceeded distance limit")
             self.logger.critical("Max Distance: {}".format(max_distance))
             self.logger.critical("Current Distance: {}".format(distance))
-            if self.vehicle.mode.name == "GUIDED":
+            if state.mode == "GUIDED":
                 self.logger.critical("LANDING...")
                 if self.__com:
-                    self.__com.send(u"GEOFENCE DISTANCE EXCEEDED. LANDING...")
+                    self.__com.send(u"GEOFENCE DISTANCE EXCEEDED. LANDING...", priority=CRITICAL)
                 self.land()
-        elif current.altitude > max_altitude:
+        elif state.altitude > max_altitude:
             self.logger.critical("Exceeded altitude limit")
             self.logger.critical("Max Altitude: {}".format(max_altitude))
-            self.logger.critical("Current Altitude: {}".format(current.altitude))
-            if self.vehicle.mode.name == "GUIDED":
+            self.logger.critical("Current Altitude: {}".format(state.altitude))
+            if state.mode == "GUIDED":
                 self.logger.critical("LANDING...")
                 if self.__com:
-                    self.__com.send(u"GEOFENCE ALTITUDE EXCEEDED. LANDING...")
+                    self.__com.send(u"GEOFENCE ALTITUDE EXCEEDED. LANDING...", priority=CRITICAL)
                 self.land()
 
+    def enable_geofence(self, max_distance, max_altitude, zones=None):
+        """Checks a cylinder geofence around home (and the PolygonZones of
+        zones, in meters from home, if given) on every location update
+        (replacing any previous one). The first breach while in GUIDED or AUTO
+        mode switches to LAND (once, without blocking)."""
+        self.disable_geofence()
+        home = location_global_relative_to_gps_reading(self.home)
+        if zones:
+            geofence = ZonedGeofence(home, zones, max_distance, max_altitude)
+        else:
+            geofence = CylinderGeofence(home, max_distance, max_altitude)
+        self.geofence_monitor = GeofenceMonitor(geofence, self.__on_geofence_breach)
+        self.geofence_monitor.attach(self.vehicle)
+
+    def disable_geofence(self):
+        """Stops the geofence checks started with enable_geofence()."""
+        if self.geofence_monitor:
+            self.geofence_monitor.detach()
+            self.geofence_monitor = None
+
+    def __on_geofence_breach(self, description):
+        """Lands the vehicle when the geofence monitor detects a breach.
+        Returns True if it did."""
+        if self.vehicle.mode.name not in AUTONOMOUS_MODES:
+            return False  # User took over (or already landing), leave them be
+        self.logger.critical("LANDING...")
+        if self.__com:
+            self.__com.send(u"GEOFENCE: {}. LANDING...".format(description), priority=CRITICAL)
+        self.abort()
+        return True
+
+    def upload_mission(self, points, acceptance_radius=0):
+        """Replaces the vehicle's mission with a waypoint for every point (a
+        LocationGlobalRelative) and blocks until it is uploaded. Fly it with
+        start_mission().
+
+        acceptance_radius (meters) is sent with every waypoint, flight
+        controllers that ignore it use their own waypoint radius.
+        """
+        self.logger.debug("Uploading mission of {} waypoints...".format(len(points)))
+        commands = self.vehicle.commands
+        commands.download()
+        commands.wait_ready()  # clear() keeps the home location downloaded
+        commands.clear()
+        for point in points:
+            commands.add(dronekit.Command(0, 0, 0, mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
+                                          mavutil.mavlink.MAV_CMD_NAV_WAYPOINT, 0, 0,
+                                          0, acceptance_radius, 0, 0,
+                                          point.lat, point.lon, point.alt))
+        commands.upload()
+        self.__mission_points = list(points)
+        self.mission_length = len(points)
+        self.mission_current = 0
+        self.mission_reached = 0
+        self.logger.debug("Mission uploaded")
+        if self.__com:
+            self.__com.send(u"Mission of {} waypoints uploaded".format(len(points)),
+                            priority=DEBUG)
+
+    def start_mission(self, timeout=5):
+        """Starts flying the uploaded mission from its first waypoint in AUTO
+        mode (the vehicle must be flying already).
+
+        :returns: bool -- True if the vehicle switched to AUTO within timeout
+                  seconds.
+        """
+        self.logger.debug("Starting mission...")
+        self.vehicle.commands.next = 1
+        self.vehicle.mode = dronekit.VehicleMode("AUTO")
+        return self.wait_for(lambda: self.vehicle.mode.name == "AUTO", timeout)
+
+    def mission_complete(self):
+        """Returns True once the last waypoint of the mission has been reached."""
+        return self.mission_length > 0 and self.mission_reached >= self.mission_length
+
+    def start_path(self, points, acceptance_radius=2, lookahead=5, speed=None):
+        """Starts following the points (LocationGlobalRelative) in GUIDED mode
+        from the current location, without stopping at them (doesn't block,
+        see path_complete()).
+
+        On every location update the vehicle is sent towards the point
+        lookahead meters further along the path, moving on to the next
+        segment once its end is within acceptance_radius meters. With a speed
+        (meters per second) the target is sent with a velocity towards it
+        (slowing down for the end of the path), otherwise with simple_goto.
+        Raises ValueError if there are no points.
+        """
+        if not points:
+            raise ValueError('a path needs at least 1 point to fly to')
+        self.stop_path()
+        current = location_global_relative_to_gps_reading(
+                    self.vehicle.location.global_relative_frame)
+        frame = LocalFrame(current)
+        xs, ys = frame.to_xy(numpy.array([point.lat for point in points], dtype=float),
+                             numpy.array([point.lon for point in points], dtype=float))
+        follower = PathFollower(numpy.concatenate(([0.0], xs)), numpy.concatenate(([0.0], ys)),
+                                [current.altitude] + [point.alt for point in points],
+                                acceptance_radius, lookahead)
+        self.__path = (frame, follower, speed)
+        self.__target_frame = LocalFrame(location_global_relative_to_gps_reading(points[-1]))
+        self.__update_state()
+        self.logger.debug("Following path of {} points...".format(len(points)))
+        self.vehicle.add_attribute_listener('location.global_relative_frame',
+                                            self.__on_path_location)
+        self.__on_path_location(self.vehicle, 'location.global_relative_frame',
+                                self.vehicle.location.global_relative_frame)
+
+    def stop_path(self):
+        """Stops following the path started with start_path()."""
+        if self.__path:
+            self.vehicle.remove_attribute_listener('location.global_relative_frame',
+                                                   self.__on_path_location)
+            self.__path = None
+
+    def path_complete(self):
+        """Returns True once the end of the path (see start_path) is reached."""
+        return self.__path is not None and self.__path[1].done
+
+    def __on_path_location(self, vehicle, attribute, location):
+        """Location listener, steers towards the target ahead on the path."""
+        path = self.__path
+        if (path is None or location.lat is None or location.lon is None or
+                location.alt is None):
+            return
+        frame, follower, speed = path
+        if follower.done or self.vehicle.mode.name != "GUIDED":
+            return
+        x, y = frame.to_xy(location.lat, location.lon)
+        target, remaining = follower.update(x, y, location.alt)
+        reading = get_location_offset(frame.origin, target[1], target[0])
+        if follower.done:
+            self.logger.debug("Reached end of path")
+            if self.__com:
+                self.__com.send(u"Reached end of path", priority=DEBUG)
+        if speed is None:
+            self.vehicle.simple_goto(dronekit.LocationGlobalRelative(
+                reading.latitude, reading.longitude, float(target[2])))
+            return
+        offset = target - numpy.array((x, y, location.alt))
+        distance = numpy.sqrt((offset * offset).sum())
+        velocity = offset * (min(speed, remaining) / distance) if distance > 0 else offset
+        message = self.vehicle.message_factory.set_position_target_global_int_encode(
+            0, 0, 0, mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT, POSITION_VELOCITY_MASK,
+            int(reading.latitude * 1e7), int(reading.longitude * 1e7), float(target[2]),
+            float(velocity[1]), float(velocity[0]), float(-velocity[2]),  # North, east, down
+            0, 0, 0, 0, 0)
+        self.vehicle.send_mavlink(message)
+
     def goto(self, point):
         """Tells the drone to goto to a point (doesn't block, user responsible
         for verifying point is reached).
@@ -154,19 +529,35 @@ class Controller:
         point: expected to be a LocationGlobalRelative.
         """
         self.logger.debug("Going to destination: {}".format(point))
+        self.__target_frame = LocalFrame(location_global_relative_to_gps_reading(point))
+        self.__update_state()
         self.vehicle.simple_goto(point)
 
+    def abort(self):
+        """Switches to LAND mode without waiting (safe to call from callbacks)."""
+        self.logger.critical("Aborting, landing...")
+        self.vehicle.mode = dronekit.VehicleMode("LAND")
+
+    def return_to_launch(self):
+        """Switches to RTL mode without waiting (safe to call from callbacks)."""
+        self.logger.critical("Returning to launch...")
+        self.vehicle.mode = dronekit.VehicleMode("RTL")
+
     def land(self):
         """Lands the drone and blocks until landed."""
         self.logger.debug("Landing...")
         self.vehicle.mode = dronekit.VehicleMode("LAND")
-        while True:
-            time.sleep(3)
+
+        def _on_ground(state):
+            # None < 1 is True in Python 2, an unknown altitude is not the ground
+            return state.altitude is not None and state.altitude < 1
+
+        def _landed():
+            state = self.state
+            return _on_ground(state) or state.armed is False
+        while not self.wait_for(_landed, 3):
             self.log_flight_info()
-            self.logger.debug("{}".format(self.vehicle.location.global_relative_frame))
-            if self.vehicle.location.global_relative_frame.alt < 1:
-                self.logger.debug("Reached Ground")
-                break
-            if self.vehicle.armed is False:
-                self.logger.debug("Reached Ground (assuming since no longer armed)")
-                break
+        if _on_ground(self.state):
+            self.logger.debug("Reached Ground")
+        else:
+            self.logger.debug("Reached Ground (assuming since no longer armed)")
@@ -0,0 +1,226 @@
+"""A pure Python stand in for the c++ i2c data server.
+
+It speaks the same protocol as the real server (a reply to every request and,
+optionally, samples published on a PUB socket) over any zmq transport, so
+I2cDataClient and I2cDataSubscriber can be tested and benchmarked on any
+machine. The sample rate, jitter, drop rate and response delay are
+configurable to mimic a loaded BeagleBone.
+
+Run a server (and optionally benchmark the client against it) with:
+    python -m control.fakedataserver --location tcp://*:5555 --publish tcp://*:5556
+    python -m control.fakedataserver --location tcp://127.0.0.1:5555 --benchmark 1000
+"""
+import argparse
+import collections
+import logging
+import math
+import random
+import threading
+import time
+import zmq
+from i2cdataclient import PAYLOAD_LAYOUTS, I2cDataClient
+
+
+class FakeI2cDataServer(object):
+    """Answers sensor data requests (and publishes samples) from a thread."""
+    def __init__(self, location, publish_location=None, rate=10.0, jitter=0.0,
+                 drop_rate=0.0, response_delay=0.0, binary=False, context=None, seed=None):
+        """Sets up the server, call start() to bind and serve.
+
+        Args:
+            location (str): Where requests are served (bound).
+            publish_location (str): Where samples are published (None to not publish).
+            rate (float): Samples published per second.
+            jitter (float): Maximum random seconds added to each publish
+                            period and response delay.
+            drop_rate (float): Probability of a request or sample being dropped.
+            response_delay (float): Seconds before a request is answered.
+            binary (bool): Send version 1 binary payloads instead of text.
+            context (zmq.Context): Context to use (needed for inproc://).
+            seed (int): Seed for the random jitter, drops and data.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.location = location
+        self.publish_location = publish_location
+        self.rate = rate
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.response_delay = response_delay
+        self.binary = binary
+        self.requests = 0
+        self.replies = 0
+        self.published = 0
+        self.dropped = 0
+        self.__context = context or zmq.Context()
+        self.__random = random.Random(seed)
+        self.__thread = None
+        self.__running = threading.Event()
+        self.__bound = threading.Event()
+        self.__bind_error = None  # Raised by start() when binding failed
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Binds the sockets and starts serving from a background thread.
+        Raises the error of a failed bind (e.g. zmq.ZMQError when the address
+        is in use)."""
+        self.__running.set()
+        self.__bound.clear()
+        self.__bind_error = None
+        self.__thread = threading.Thread(target=self.__serve, name='fake-i2c-server')
+        self.__thread.daemon = True
+        self.__thread.start()
+        self.__bound.wait()
+        if self.__bind_error is not None:
+            self.stop()
+            raise self.__bind_error
+
+    def stop(self):
+        """Stops serving and closes the sockets."""
+        self.__running.clear()
+        if self.__thread:
+            self.__thread.join()
+            self.__thread = None
+
+    def sample(self):
+        """Returns the data of a new sample (text or binary payload)."""
+        now = time.time()
+        temperature = 20.0 + 5.0 * math.sin(now / 60.0) + self.__random.gauss(0, 0.1)
+        altitude = 100.0 + self.__random.gauss(0, 0.5)
+        if self.binary:
+            payload, fields = PAYLOAD_LAYOUTS[1]
+            values = {'time': now, 'temperature': temperature, 'altitude': altitude}
+            return payload.pack(1, *[values[field] for field in fields])
+        return 'Temperature: {:.2f} Altitude: {:.2f}'.format(temperature, altitude).encode('ascii')
+
+    def __period(self):
+        """Returns the seconds until the next sample is published."""
+        return 1.0 / self.rate + self.__random.uniform(0, self.jitter)
+
+    def __serve(self):
+        """Server thread body."""
+        router = publisher = None
+        try:
+            router = self.__context.socket(zmq.ROUTER)
+            router.setsockopt(zmq.LINGER, 0)
+            router.bind(self.location)
+            if self.publish_location:
+                publisher = self.__context.socket(zmq.PUB)
+                publisher.setsockopt(zmq.LINGER, 0)
+                publisher.bind(self.publish_location)
+        except Exception as err:
+            self.__bind_error = err
+            self.__running.clear()
+        finally:
+            self.__bound.set()
+        replies = collections.deque()  # (due time, frames), answered in order
+        next_publish = time.time() + self.__period()
+        try:
+            while self.__running.is_set():
+                now = time.time()
+                wake = now + 0.05
+                if publisher:
+                    wake = min(wake, next_publish)
+                if replies:
+                    wake = min(wake, replies[0][0])
+                if router.poll(max(int((wake - now) * 1000), 0)):
+                    self.__receive(router, replies)
+                now = time.time()
+                while replies and replies[0][0] <= now:
+                    router.send_multipart(replies.popleft()[1])
+                    self.replies += 1
+                if publisher and now >= next_publish:
+                    next_publish += self.__period()
+                    if self.__random.random() < self.drop_rate:
+                        self.dropped += 1
+                    else:
+                        publisher.send(self.sample())
+                        self.published += 1
+        finally:
+            if router:
+                router.close()
+            if publisher:
+                publisher.close()
+
+    def __receive(self, router, replies):
+        """Reads every waiting request and schedules its reply."""
+        while True:
+            try:
+                frames = router.recv_multipart(zmq.NOBLOCK)
+            except zmq.error.Again:
+                return
+            self.requests += 1
+            if self.__random.random() < self.drop_rate:
+                self.dropped += 1
+                continue
+            due = time.time() + self.response_delay + self.__random.uniform(0, self.jitter)
+            if replies:
+                due = max(due, replies[-1][0])  # The real server answers in order
+            # frames are [identity, empty delimiter, request]
+            replies.append((due, frames[:-1] + [self.sample()]))
+
+
+def benchmark(location, count, context=None):
+    """Reads count samples from the server at location with I2cDataClient and
+    returns a dictionary of the results (latencies in seconds)."""
+    client = I2cDataClient(location, context=context)
+    latencies = []
+    failures = 0
+    start = time.time()
+    try:
+        for _ in range(count):
+            sent = time.time()
+            if client.read() is None:
+                failures += 1
+            else:
+                latencies.append(time.time() - sent)
+    finally:
+        client.close()
+    elapsed = time.time() - start
+    latencies.sort()
+    result = {'reads': count, 'failures': failures, 'elapsed': elapsed,
+              'reads_per_second': count / elapsed if elapsed else 0.0}
+    if latencies:
+        result['latency_mean'] = sum(latencies) / len(latencies)
+        result['latency_p50'] = latencies[len(latencies) // 2]
+        result['latency_p99'] = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+        result['latency_max'] = latencies[-1]
+    return result
+
+
+def main():
+    """Runs a fake data server until interrupted (or benchmarks against it)."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--location', default='tcp://*:5555')
+    parser.add_argument('--publish', default=None)
+    parser.add_argument('--rate', type=float, default=10.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    parser.add_argument('--response-delay', type=float, default=0.0)
+    parser.add_argument('--binary', action='store_true')
+    parser.add_argument('--benchmark', type=int, default=0,
+                        help='read this many samples with I2cDataClient and print the results')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = FakeI2cDataServer(args.location, args.publish, rate=args.rate, jitter=args.jitter,
+                               drop_rate=args.drop_rate, response_delay=args.response_delay,
+                               binary=args.binary)
+    with server:
+        if args.benchmark:
+            for key, value in sorted(benchmark(args.location, args.benchmark).items()):
+                print('{}: {}'.format(key, value))
+            return
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Geofences checked on every position update.
+
+A geofence converts its limits to a local metric frame around home once
+(see gps.LocalFrame), so checking a fix only costs a few float operations.
+GeofenceMonitor attaches a geofence to the vehicle's location listener and
+calls back once, on the first breach.
+
+CylinderGeofence is a radius and altitude around home. ZonedGeofence adds
+PolygonZones: inclusion polygons the vehicle must stay in and exclusion
+polygons (e.g. buildings) it must stay out of, each with its own altitude
+limit. A polygon indexes its edges in horizontal strips when it is built, so
+a point only has to be tested against the few edges crossing its strip, even
+for polygons with hundreds of vertices.
+
+Every geofence has breach() for a single fix and path_breach() to check a
+whole planned path (waypoints and the straight legs between them) at once.
+"""
+import logging
+import threading
+import numpy
+from gps import LocalFrame
+
+
+class CylinderGeofence(object):
+    """A cylinder around home, limited by distance and altitude."""
+    def __init__(self, home, max_distance, max_altitude):
+        """
+        Args:
+            home (GpsReading): Center of the cylinder.
+            max_distance (float): Radius in meters.
+            max_altitude (float): Height in meters (relative to home).
+        """
+        self.frame = LocalFrame(home)
+        self.max_distance = max_distance
+        self.max_altitude = max_altitude
+        self.__max_distance_squared = max_distance * max_distance
+
+    def breach(self, latitude, longitude, altitude):
+        """Returns a description of the limit exceeded, or None if the point
+        is inside the geofence."""
+        x, y = self.frame.to_xy(latitude, longitude)
+        if x*x + y*y > self.__max_distance_squared:
+            return "Exceeded distance limit of {} m ({:.1f} m)".format(
+                self.max_distance, (x*x + y*y) ** 0.5)
+        if altitude is not None and altitude > self.max_altitude:
+            return "Exceeded altitude limit of {} m ({:.1f} m)".format(
+                self.max_altitude, altitude)
+        return None
+
+    def path_breach(self, latitudes, longitudes, altitudes):
+        """Checks a path flown in order. Returns the (index, description) of
+        the first point outside the geofence, or None if the whole path is
+        inside (the cylinder is convex, so legs between inside points are too)."""
+        x, y = self.frame.to_xy(numpy.asarray(latitudes, dtype=float),
+                                numpy.asarray(longitudes, dtype=float))
+        outside = ((x*x + y*y > self.__max_distance_squared) |
+                   (numpy.asarray(altitudes, dtype=float) > self.max_altitude))
+        if not outside.any():
+            return None
+        index = int(numpy.argmax(outside))
+        return index, self.breach(latitudes[index], longitudes[index], altitudes[index])
+
+
+class PolygonZone(object):
+    """A polygon zone of a ZonedGeofence, in meters east (x) and north (y) of home.
+
+    An inclusion zone is flyable space up to max_altitude (None for no limit
+    of its own). An exclusion zone is forbidden up to max_altitude (None for
+    every altitude), so the vehicle may still fly over a building.
+    """
+    def __init__(self, vertices, max_altitude=None, exclusion=False, name=None):
+        """
+        Args:
+            vertices (list): (x, y) tuples of the polygon, in order.
+            max_altitude (float): Altitude limit of the zone in meters.
+            exclusion (bool): True if the zone must be avoided.
+            name (str): Used in breach descriptions.
+        """
+        if len(vertices) < 3:
+            raise ValueError('a polygon zone needs at least 3 vertices')
+        self.vertices = [(float(x), float(y)) for x, y in vertices]
+        self.max_altitude = max_altitude
+        self.exclusion = exclusion
+        self.name = name or ('exclusion zone' if exclusion else 'inclusion zone')
+        # Every edge, legs can cross any of them (see crosses)
+        self.all_edges = edges = numpy.array([vertex + self.vertices[(i + 1) % len(self.vertices)]
+                                              for i, vertex in enumerate(self.vertices)])
+        # Horizontal edges never cross a horizontal ray (see contains)
+        self.edges = edges[edges[:, 1] != edges[:, 3]]
+        self.min_x, self.min_y = edges[:, 0].min(), edges[:, 1].min()
+        self.max_x, self.max_y = edges[:, 0].max(), edges[:, 1].max()
+        self.__build_strips()
+
+    @classmethod
+    def from_locations(cls, home, latitudes, longitudes, **kwargs):
+        """Returns the zone with the given corner coordinates (see __init__
+        for the other arguments)."""
+        x, y = LocalFrame(home).to_xy(numpy.asarray(latitudes, dtype=float),
+                                      numpy.asarray(longitudes, dtype=float))
+        return cls(list(zip(x.tolist(), y.tolist())), **kwargs)
+
+    def __build_strips(self):
+        """Buckets the edges by the horizontal strips of the bounding box they
+        cross (one strip per edge, so a strip usually holds only a few)."""
+        self.__strip_count = max(len(self.edges), 1)
+        self.__strip_height = (self.max_y - self.min_y) / self.__strip_count or 1.0
+        low = numpy.minimum(self.edges[:, 1], self.edges[:, 3])
+        high = numpy.maximum(self.edges[:, 1], self.edges[:, 3])
+        first = self.__strips_of(low)
+        last = self.__strips_of(high)
+        buckets = [[] for _ in range(self.__strip_count)]
+        for index in range(len(self.edges)):
+            for strip in range(first[index], last[index] + 1):
+                buckets[strip].append(index)
+        self.__strip_edges = [self.edges[bucket] for bucket in buckets]
+        self.__strip_tuples = [[tuple(edge) for edge in edges.tolist()]
+                               for edges in self.__strip_edges]
+
+    def __strips_of(self, y):
+        """Returns the strip index of each y (clipped to the bounding box)."""
+        strips = numpy.floor((numpy.asarray(y, dtype=float) - self.min_y) / self.__strip_height)
+        return numpy.clip(strips, 0, self.__strip_count - 1).astype(int)
+
+    def contains(self, x, y):
+        """Returns True if the point (x, y) is inside the polygon."""
+        if not (self.min_x <= x <= self.max_x and self.min_y <= y <= self.max_y):
+            return False
+        strip = min(int((y - self.min_y) / self.__strip_height), self.__strip_count - 1)
+        inside = False
+        for x1, y1, x2, y2 in self.__strip_tuples[strip]:
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+        return inside
+
+    def contains_many(self, x, y):
+        """Batch version of contains. Returns a numpy bool array with an
+        entry for every point of the x and y arrays."""
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        inside = numpy.zeros(x.shape, dtype=bool)
+        in_box = ((x >= self.min_x) & (x <= self.max_x) &
+                  (y >= self.min_y) & (y <= self.max_y))
+        strips = self.__strips_of(y)
+        for strip in numpy.unique(strips[in_box]):
+            points = numpy.nonzero(in_box & (strips == strip))[0]
+            edges = self.__strip_edges[strip]
+            if not len(edges):
+                continue
+            px, py = x[points, None], y[points, None]
+            x1, y1, x2, y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+            crosses = (((y1 > py) != (y2 > py)) &
+                       (px < x1 + (py - y1) * (x2 - x1) / (y2 - y1)))
+            inside[points] = crosses.sum(axis=1) % 2 == 1
+        return inside
+
+    def crosses(self, x1, y1, x2, y2):
+        """Returns a numpy bool array, True for every segment (x1, y1) to
+        (x2, y2) (arrays) touching an edge of the polygon."""
+        x1, y1, x2, y2 = [numpy.asarray(value, dtype=float)[:, None]
+                          for value in (x1, y1, x2, y2)]
+        edges = self.all_edges
+        ex1, ey1, ex2, ey2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+        boxes = ((numpy.minimum(x1, x2) <= numpy.maximum(ex1, ex2)) &
+                 (numpy.maximum(x1, x2) >= numpy.minimum(ex1, ex2)) &
+                 (numpy.minimum(y1, y2) <= numpy.maximum(ey1, ey2)) &
+                 (numpy.maximum(y1, y2) >= numpy.minimum(ey1, ey2)))
+        side_1 = ((x2 - x1) * (ey1 - y1) - (y2 - y1) * (ex1 - x1))
+        side_2 = ((x2 - x1) * (ey2 - y1) - (y2 - y1) * (ex2 - x1))
+        side_3 = ((ex2 - ex1) * (y1 - ey1) - (ey2 - ey1) * (x1 - ex1))
+        side_4 = ((ex2 - ex1) * (y2 - ey1) - (ey2 - ey1) * (x2 - ex1))
+        return (boxes & (side_1 * side_2 <= 0) & (side_3 * side_4 <= 0)).any(axis=1)
+
+
+class ZonedGeofence(object):
+    """A geofence made of polygon zones, optionally inside a cylinder.
+
+    A point breaches the geofence if it is outside the cylinder (max_distance
+    and max_altitude around home, None for no limit), outside every inclusion
+    zone (when there are any), above the max_altitude of the inclusion zones
+    it is in, or inside an exclusion zone below its max_altitude.
+    """
+    def __init__(self, home, zones, max_distance=None, max_altitude=None):
+        """
+        Args:
+            home (GpsReading): Origin of the zones' x and y.
+            zones (list): PolygonZones.
+            max_distance (float): Radius in meters.
+            max_altitude (float): Height in meters (relative to home).
+        """
+        self.frame = LocalFrame(home)
+        self.inclusions = [zone for zone in zones if not zone.exclusion]
+        self.exclusions = [zone for zone in zones if zone.exclusion]
+        self.cylinder = None
+        if max_distance is not None or max_altitude is not None:
+            self.cylinder = CylinderGeofence(home, float('inf') if max_distance is None
+                                             else max_distance,
+                                             float('inf') if max_altitude is None
+                                             else max_altitude)
+
+    def breach(self, latitude, longitude, altitude):
+        """Returns a description of the limit exceeded, or None if the point
+        is inside the geofence."""
+        if self.cylinder:
+            description = self.cylinder.breach(latitude, longitude, altitude)
+            if description:
+                return description
+        x, y = self.frame.to_xy(latitude, longitude)
+        return self.__breach_xy(x, y, altitude)
+
+    def __breach_xy(self, x, y, altitude):
+        """breach() for a point in the local frame."""
+        if self.inclusions:
+            zones = [zone for zone in self.inclusions if zone.contains(x, y)]
+            if not zones:
+                return "Left the inclusion zones at ({:.1f}, {:.1f})".format(x, y)
+            if altitude is not None and not any(zone.max_altitude is None or
+                                                altitude <= zone.max_altitude
+                                                for zone in zones):
+                return "Exceeded altitude limit of {} ({:.1f} m)".format(
+                    zones[0].name, altitude)
+        for zone in self.exclusions:
+            if ((altitude is None or zone.max_altitude is None or
+                 altitude <= zone.max_altitude) and zone.contains(x, y)):
+                return "Entered {} at ({:.1f}, {:.1f})".format(zone.name, x, y)
+        return None
+
+    def path_breach(self, latitudes, longitudes, altitudes):
+        """Checks a path flown in order, every point and the straight leg to
+        the next one. Returns the (index, description) of the first point
+        outside the geofence or leg leaving it (index of the leg's start), or
+        None if the whole path is inside.
+
+        A leg must stay within a single inclusion zone, and may only cross an
+        exclusion zone if both its ends are above the zone's max_altitude.
+        """
+        if self.cylinder:
+            result = self.cylinder.path_breach(latitudes, longitudes, altitudes)
+            if result:
+                return result
+        x, y = self.frame.to_xy(numpy.asarray(latitudes, dtype=float),
+                                numpy.asarray(longitudes, dtype=float))
+        altitudes = numpy.asarray(altitudes, dtype=float)
+        breaches = []  # (index, description), the first one is returned
+        ok = numpy.ones(len(x), dtype=bool)
+        if self.inclusions:
+            inside = numpy.array([zone.contains_many(x, y) for zone in self.inclusions])
+            allowed = numpy.array([numpy.ones(len(x), dtype=bool) if zone.max_altitude is None
+                                   else altitudes <= zone.max_altitude
+                                   for zone in self.inclusions])
+            ok &= (inside & allowed).any(axis=0)
+            # Legs need a zone containing both ends that they do not cross out of
+            leg_zones = inside[:, :-1] & inside[:, 1:]
+            for row, zone in enumerate(self.inclusions):
+                legs = numpy.nonzero(leg_zones[row])[0]
+                if len(legs):
+                    leg_zones[row, legs] = ~zone.crosses(x[legs], y[legs],
+                                                         x[legs + 1], y[legs + 1])
+            for leg in numpy.nonzero(~leg_zones.any(axis=0))[0]:
+                breaches.append((int(leg), "Leg from point {} leaves the inclusion "
+                                           "zones".format(int(leg))))
+        for zone in self.exclusions:
+            below = (numpy.ones(len(x), dtype=bool) if zone.max_altitude is None
+                     else altitudes <= zone.max_altitude)
+            ok &= ~(below & zone.contains_many(x, y))
+            legs = numpy.nonzero(below[:-1] | below[1:])[0]
+            if len(legs):
+                crossing = zone.crosses(x[legs], y[legs], x[legs + 1], y[legs + 1])
+                for leg in legs[crossing]:
+                    breaches.append((int(leg), "Leg from point {} crosses {}".format(
+                        int(leg), zone.name)))
+        for index in numpy.nonzero(~ok)[0]:
+            breaches.append((int(index), self.__breach_xy(x[index], y[index], altitudes[index])))
+        if not breaches:
+            return None
+        return min(breaches, key=lambda breach: breach[0])
+
+
+class GeofenceMonitor(object):
+    """Checks a geofence on every location update of a dronekit vehicle.
+
+    on_breach(description) is called from the dronekit thread for every
+    location outside the geofence until it returns True (the breach was acted
+    upon, e.g. the vehicle is landing), after which the monitor stays
+    triggered. A breach it does not act upon (e.g. a pilot is flying) is
+    reported again the next time the vehicle leaves the geofence. It must not
+    block.
+    """
+    def __init__(self, geofence, on_breach):
+        self.logger = logging.getLogger(__name__)
+        self.geofence = geofence
+        self.on_breach = on_breach
+        self.triggered = False
+        self.__outside = False  # The current breach has been logged
+        self.__lock = threading.Lock()
+        self.__vehicle = None
+
+    def attach(self, vehicle):
+        """Starts checking the vehicle's location updates."""
+        self.__vehicle = vehicle
+        vehicle.add_attribute_listener('location.global_relative_frame', self._on_location)
+
+    def detach(self):
+        """Stops checking location updates."""
+        if self.__vehicle:
+            self.__vehicle.remove_attribute_listener('location.global_relative_frame',
+                                                     self._on_location)
+            self.__vehicle = None
+
+    def _on_location(self, vehicle, attribute, location):
+        """Location listener, checks the new fix against the geofence."""
+        if self.triggered or location.lat is None or location.lon is None:
+            return
+        description = self.geofence.breach(location.lat, location.lon, location.alt)
+        if description is None:
+            self.__outside = False
+            return
+        with self.__lock:
+            if self.triggered:
+                return
+            if not self.__outside:
+                self.__outside = True
+                self.logger.critical(description)
+            self.triggered = bool(self.on_breach(description))
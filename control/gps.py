@@ -1,10 +1,24 @@
 """Defines classes used to read and handle GPS data"""
+import datetime
+import functools
+import logging
 import math
-import pynmea2
-import serial
+import operator
+import threading
+import time
+import numpy
+from lazy import LazyModule
 
 
 EARTH_RADIUS = 6371001.0  # Average radius of spherical earth in meters
+DEGREE_LENGTH = math.pi / 180 * EARTH_RADIUS  # Meters per degree of latitude
+_HALF_RADIAN = math.pi / 360  # Radians in half a degree (mean of two latitudes)
+NMEA_STREAM_TYPES = ('GGA', 'RMC', 'VTG')  # Sentence types parsed when streaming
+NMEA_MAX_LENGTH = 128  # Longer unterminated data is garbage (spec max is 82 bytes)
+
+# Only needed to read a receiver, imported when a Gps is opened (see lazy.py)
+pynmea2 = LazyModule('pynmea2')
+serial = LazyModule('serial')
 
 
 def get_location_offset(origin, north_offset, east_offset):
@@ -46,15 +60,110 @@ def get_relative_from_location(origin, point):
 def get_distance(reading_1, reading_2):
     """
     Returns distance in meters between two GpsReadings.
-    The latitude is fairly accurate in this calculation
-    but the longitude is off.
+
+    Uses an equirectangular projection at the mean latitude of the two
+    readings, which is within a few millimeters of the great circle distance
+    over the few hundred meters we fly (a longitude degree is only worth
+    cos(latitude) of a latitude degree). The cosine makes it a little slower
+    than the old flat formula, use LocalFrame.distance (no cosine) when many
+    distances from the same origin are needed.
 
     Source:
-    https://github.com/dronekit/dronekit-python/blob/master/examples/mission_basic/mission_basic.py
+    https://www.movable-type.co.uk/scripts/latlong.html (Equirectangular approximation)
+    """
+    lat_1 = reading_1.latitude
+    lat_2 = reading_2.latitude
+    lat_diff = lat_1 - lat_2
+    lon_diff = ((reading_1.longitude - reading_2.longitude) *
+                math.cos((lat_1 + lat_2) * _HALF_RADIAN))
+    # math.hypot is slower than the plain square root for these values
+    return math.sqrt(lat_diff*lat_diff + lon_diff*lon_diff) * DEGREE_LENGTH
+
+
+def get_location_offsets(origin, north_offsets, east_offsets):
+    """
+    Batch version of get_location_offset. Returns a (latitudes, longitudes)
+    tuple of numpy arrays for every north/east offset pair (in meters) from the
+    origin GpsReading. The values match get_location_offset exactly.
+    """
+    north_offsets = numpy.asarray(north_offsets, dtype=float)
+    east_offsets = numpy.asarray(east_offsets, dtype=float)
+
+    # Offsets coordinates in radians
+    lat_offsets = north_offsets / EARTH_RADIUS
+    lon_offsets = east_offsets / (EARTH_RADIUS*math.cos(math.pi*origin.latitude/180))
+
+    # New positions in decimal degrees
+    new_lats = origin.latitude + (lat_offsets * 180/math.pi)
+    new_lons = origin.longitude + (lon_offsets * 180/math.pi)
+    return (new_lats, new_lons)
+
+
+def get_relatives_from_locations(origin, latitudes, longitudes):
+    """
+    Batch version of get_relative_from_location. Returns a (x, y) tuple of
+    numpy arrays in meters for every latitude/longitude pair based on the
+    origin GpsReading. The values match get_relative_from_location exactly.
+    """
+    latitudes = numpy.asarray(latitudes, dtype=float)
+    longitudes = numpy.asarray(longitudes, dtype=float)
+    lon_offsets = (longitudes - origin.longitude) * (math.pi / 180)
+    lat_offsets = (latitudes - origin.latitude) * (math.pi / 180)
+    x = lon_offsets * (EARTH_RADIUS*math.cos(math.pi*origin.latitude/180))
+    y = lat_offsets * EARTH_RADIUS
+    return (x, y)
+
+
+def get_distances(latitudes_1, longitudes_1, latitudes_2, longitudes_2):
+    """
+    Batch version of get_distance. Returns a numpy array of distances in meters
+    between each pair of coordinates. Arguments are broadcast against each
+    other, so a single point can be compared against a whole path. The values
+    match get_distance (to floating point rounding).
     """
-    lat_diff = reading_1.latitude - reading_2.latitude
-    lon_diff = reading_1.longitude - reading_2.longitude
-    return math.sqrt((lat_diff*lat_diff) + (lon_diff*lon_diff)) * 1.113195e5
+    latitudes_1 = numpy.asarray(latitudes_1, dtype=float)
+    latitudes_2 = numpy.asarray(latitudes_2, dtype=float)
+    lon_diffs = ((numpy.asarray(longitudes_1, dtype=float) -
+                  numpy.asarray(longitudes_2, dtype=float)) *
+                 numpy.cos((latitudes_1 + latitudes_2) * _HALF_RADIAN))
+    lat_diffs = latitudes_1 - latitudes_2
+    # Not numpy.hypot, so the results match get_distance exactly
+    return numpy.sqrt(lat_diffs*lat_diffs + lon_diffs*lon_diffs) * DEGREE_LENGTH
+
+
+class LocalFrame(object):
+    """A local east/north frame in meters around an origin GpsReading.
+
+    The scale factors of get_relative_from_location are computed once, so
+    converting a point only takes a couple of multiplications.
+    """
+    __slots__ = ('origin', 'latitude', 'longitude', 'east_scale', 'north_scale')
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.latitude = origin.latitude
+        self.longitude = origin.longitude
+        self.north_scale = (math.pi / 180) * EARTH_RADIUS
+        self.east_scale = (math.pi / 180) * (EARTH_RADIUS*math.cos(math.pi*origin.latitude/180))
+
+    def to_xy(self, latitude, longitude):
+        """Returns the (x, y) meters east and north of the origin (scalars or
+        numpy arrays)."""
+        return ((longitude - self.longitude) * self.east_scale,
+                (latitude - self.latitude) * self.north_scale)
+
+    def distance(self, latitude, longitude):
+        """Returns the distance in meters from the origin. Like get_distance
+        but with the cos(latitude) of the origin, computed once."""
+        x = (longitude - self.longitude) * self.east_scale
+        y = (latitude - self.latitude) * self.north_scale
+        return math.sqrt(x*x + y*y)
+
+    def distances(self, latitudes, longitudes):
+        """Batch version of distance, returns a numpy array."""
+        x, y = self.to_xy(numpy.asarray(latitudes, dtype=float),
+                          numpy.asarray(longitudes, dtype=float))
+        return numpy.sqrt(x*x + y*y)  # Matches distance exactly, numpy.hypot does not
 
 
 class GpsReadError(Exception):
@@ -63,8 +172,10 @@ class GpsReadError(Exception):
         super(GpsReadError, self).__init__((message, data))
 
 
-class GpsReading:
+class GpsReading(object):
     """A data class for GPS reading attributes"""
+    __slots__ = ('latitude', 'longitude', 'altitude', 'time')
+
     def __init__(self, latitude, longitude, altitude, time):
         self.latitude = latitude
         self.longitude = longitude
@@ -85,10 +196,190 @@ class GpsReading:
                 self.time == other.time)
 
 
+def _time_to_seconds(value):
+    """Returns a GpsReading time as a float (datetime.time becomes seconds
+    since midnight)."""
+    if isinstance(value, datetime.time):
+        return (value.hour*3600 + value.minute*60 + value.second +
+                value.microsecond/1e6)
+    return float(value or 0)
+
+
+class GpsTrack(object):
+    """Columnar storage for the most recent GpsReadings, in fixed memory.
+
+    The readings are kept in one float64 array (one row per field) instead of
+    one object per reading. Once capacity readings are stored, every new one
+    overwrites the oldest, so a track of a long flight never grows. Every
+    reading is written twice (at slot i and i + capacity), which keeps the
+    stored readings contiguous: the latitudes, longitudes, altitudes and
+    times properties are views that can be passed straight to the batch
+    functions (get_relatives_from_locations, get_distances, ...) without
+    copying. Times are stored as floats, a datetime.time is converted to
+    seconds since midnight.
+
+    Slicing returns a new GpsTrack (a copy with the same capacity), so the
+    original track is never modified through a slice.
+    """
+    __slots__ = ('_data', '_capacity', '_count')
+
+    def __init__(self, capacity=256):
+        self._capacity = max(int(capacity), 1)
+        self._data = numpy.empty((4, 2 * self._capacity))
+        self._count = 0  # Readings appended so far (including overwritten ones)
+
+    @classmethod
+    def from_readings(cls, readings, capacity=None):
+        """Returns a new GpsTrack holding the given GpsReadings (the last
+        capacity of them, all of them by default)."""
+        readings = list(readings)
+        track = cls(capacity or len(readings))
+        track.extend(readings)
+        return track
+
+    def __repr__(self):
+        """Returns representation of GPS track"""
+        return '{}(<{} of {} readings>)'.format(self.__class__.__name__, len(self),
+                                                self._capacity)
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        """Returns a GpsReading for an integer index or a GpsTrack copy for a slice."""
+        window = self._window()
+        if isinstance(index, slice):
+            data = window[:, index]
+            track = GpsTrack(self._capacity)
+            size = min(data.shape[1], self._capacity)
+            track._data[:, :size] = data[:, data.shape[1] - size:]
+            track._data[:, self._capacity:self._capacity + size] = track._data[:, :size]
+            track._count = size
+            return track
+        size = window.shape[1]
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError('GpsTrack index out of range')
+        latitude, longitude, altitude, time = window[:, index].tolist()
+        return GpsReading(latitude, longitude, altitude, time)
+
+    @property
+    def capacity(self):
+        """Number of readings kept at most."""
+        return self._capacity
+
+    @property
+    def latitudes(self):
+        """View of the stored latitudes (oldest first)."""
+        return self._window()[0]
+
+    @property
+    def longitudes(self):
+        """View of the stored longitudes (oldest first)."""
+        return self._window()[1]
+
+    @property
+    def altitudes(self):
+        """View of the stored altitudes (oldest first)."""
+        return self._window()[2]
+
+    @property
+    def times(self):
+        """View of the stored times (oldest first)."""
+        return self._window()[3]
+
+    def append(self, reading):
+        """Appends a GpsReading to the track (overwriting the oldest one when
+        the track is full)."""
+        slot = self._count % self._capacity
+        column = (reading.latitude, reading.longitude, reading.altitude,
+                  _time_to_seconds(reading.time))
+        self._data[:, slot] = column
+        self._data[:, slot + self._capacity] = column
+        self._count += 1
+
+    def extend(self, readings):
+        """Appends every GpsReading in readings to the track."""
+        for reading in readings:
+            self.append(reading)
+
+    def relative_to(self, origin):
+        """Returns (x, y) arrays in meters of every reading from the origin
+        GpsReading (see get_relatives_from_locations)."""
+        return get_relatives_from_locations(origin, self.latitudes, self.longitudes)
+
+    def _window(self):
+        """Returns a view of the stored readings, oldest first."""
+        if not self._count:
+            return self._data[:, :0]
+        end = (self._count - 1) % self._capacity + self._capacity + 1
+        return self._data[:, end - len(self):end]
+
+
+def nmea_checksum_ok(sentence):
+    """Returns True if the bytes of an NMEA sentence ($...*hh) carry a valid
+    checksum (XOR of every byte between '$' and '*')."""
+    star = sentence.rfind(b'*')
+    if star < 1 or len(sentence) < star + 3:
+        return False
+    try:
+        expected = int(sentence[star + 1:star + 3], 16)
+    except ValueError:
+        return False
+    return functools.reduce(operator.xor, bytearray(sentence[1:star]), 0) == expected
+
+
+class NmeaFramer(object):
+    """Frames NMEA sentences out of raw chunks of serial data.
+
+    Data is collected in a reusable buffer and split on line endings. Sentences
+    are filtered by their type (the three characters after the talker id, e.g.
+    GGA in $GNGGA) and checksum before being returned, so nothing is handed to
+    pynmea2 that would be thrown away.
+    """
+    def __init__(self, sentence_types=NMEA_STREAM_TYPES):
+        self._types = frozenset(t.encode('ascii') for t in sentence_types)
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Adds data to the buffer and returns a list of the complete, valid
+        sentences (as text, without line endings) of the wanted types."""
+        buf = self._buffer
+        buf.extend(data)
+        sentences = []
+        start = 0
+        end = buf.find(b'\n')
+        while end != -1:
+            line = bytes(buf[start:end]).rstrip()
+            if (line[:1] == b'$' and line[3:6] in self._types and
+                    nmea_checksum_ok(line)):
+                try:
+                    sentences.append(line.decode('ascii'))
+                except UnicodeDecodeError:
+                    pass  # Corrupted despite the checksum, NMEA is ascii only
+            start = end + 1
+            end = buf.find(b'\n', start)
+        del buf[:start]
+        if len(buf) > NMEA_MAX_LENGTH:
+            del buf[:]
+        return sentences
+
+
 class Gps:
     """A class for gathering GPS data via serial"""
     def __init__(self, port, baudrate):
+        self.logger = logging.getLogger(__name__)
         self.ser = serial.Serial(port, baudrate, timeout=1)
+        self._latest = (None, 0.0)  # (GpsReading, time received), replaced atomically
+        self._history = None  # GpsTrack of the recent readings
+        self._history_lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
 
     def __repr__(self):
         """Returns representation of GPS"""
@@ -111,3 +402,118 @@ class Gps:
                 break
         return GpsReading(msg.latitude, msg.longitude, msg.altitude,
                           msg.timestamp)
+
+    def sentences(self, sentence_types=NMEA_STREAM_TYPES):
+        """Generator yielding parsed pynmea2 messages of the given types.
+
+        The serial port is read in bulk (everything waiting, or blocking for
+        a single byte when nothing is) and framed with an NmeaFramer. Only
+        sentences of the wanted types with valid checksums are parsed.
+        """
+        framer = NmeaFramer(sentence_types)
+        while True:
+            for msg in self._read_sentences(framer):
+                yield msg
+
+    def stream(self):
+        """Generator yielding a GpsReading for every GGA sentence received.
+
+        Unlike read(), this never discards partial data between calls and does
+        not parse unwanted sentences, so each fix is returned as soon as its
+        line ends.
+        """
+        for msg in self.sentences(('GGA',)):
+            yield GpsReading(msg.latitude, msg.longitude, msg.altitude,
+                             msg.timestamp)
+
+    def start(self, history=0):
+        """Starts a background thread that keeps reading the serial port.
+
+        The newest fix is then available through latest() without blocking.
+        If history is given, the last history readings are also kept in a
+        fixed size GpsTrack (see history()). read(), sentences() and stream()
+        must not be used while the thread is running.
+        """
+        if self._thread:
+            return
+        self._history = GpsTrack(history) if history else None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._acquire, name='gps-reader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background reader thread (blocks until it exits)."""
+        if not self._thread:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def latest(self, max_age=None):
+        """Returns the newest GpsReading from the reader thread.
+
+        :param max_age: If given, None is returned when the newest fix is older
+                        than max_age seconds.
+        :returns: GpsReading -- or None if there is no (recent enough) fix.
+        """
+        reading, received = self._latest
+        if reading is None or (max_age is not None and time.time() - received > max_age):
+            return None
+        return reading
+
+    def fix_age(self):
+        """Returns the age in seconds of the newest fix (None if no fix yet)."""
+        reading, received = self._latest
+        if reading is None:
+            return None
+        return time.time() - received
+
+    def history(self):
+        """Returns a GpsTrack (a copy) of the recent readings kept by the
+        reader thread."""
+        if self._history is None:
+            return GpsTrack(1)
+        with self._history_lock:
+            return self._history[:]
+
+    def _read_sentences(self, framer):
+        """Reads whatever is waiting on the port and returns the parsed messages."""
+        waiting = self.ser.in_waiting
+        msgs = []
+        for sentence in framer.feed(self.ser.read(waiting if waiting else 1)):
+            try:
+                msgs.append(pynmea2.parse(sentence))
+            except pynmea2.ParseError:
+                pass
+            except Exception:
+                # pynmea2 raises more than ParseError on odd sentences
+                self.logger.exception('Could not parse %r', sentence)
+        return msgs
+
+    def _acquire(self):
+        """Reader thread body, publishes every GGA fix as the latest reading."""
+        framer = NmeaFramer(('GGA',))
+        while not self._stop_event.is_set():
+            try:
+                msgs = self._read_sentences(framer)
+            except serial.SerialException as err:
+                self.logger.error('SerialException: {}'.format(err))
+                self._stop_event.wait(1)
+                continue
+            except Exception:
+                # Keep reading, a dead thread would leave latest() stale forever
+                self.logger.exception('Unexpected error reading the gps')
+                self._stop_event.wait(1)
+                continue
+            for msg in msgs:
+                try:
+                    reading = GpsReading(msg.latitude, msg.longitude, msg.altitude,
+                                         msg.timestamp)
+                except Exception:
+                    self.logger.exception('Could not read a fix from %r', msg)
+                    continue
+                self._latest = (reading, time.time())
+                if self._history is not None:
+                    with self._history_lock:
+                        self._history.append(reading)
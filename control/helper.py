@@ -1,6 +1,9 @@
 """Defines some helper functions."""
-from dronekit import LocationGlobalRelative
 from gps import GpsReading
+from lazy import LazyModule
+
+
+dronekit = LazyModule('dronekit')
 
 
 def location_global_relative_to_gps_reading(global_relative):
@@ -11,5 +14,5 @@ def location_global_relative_to_gps_reading(global_relative):
 
 def gps_reading_to_location_global(gps_reading):
     """Converts a GpsReading to a LocationGlobalRelative."""
-    return LocationGlobalRelative(gps_reading.latitude,
-                                  gps_reading.longitude, gps_reading.altitude)
+    return dronekit.LocationGlobalRelative(gps_reading.latitude,
+                                           gps_reading.longitude, gps_reading.altitude)
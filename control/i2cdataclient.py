@@ -3,45 +3,400 @@
 Two of the current devices we're using are utilizing i2c... Since there isn't
 an easy way to do i2c in python we've written a c++ program that acts as a
 data server. It waits for a request before performing reads and sending the
-data as a string. The I2cDataClient class handles getting data from server and
-returning it in a usable way.
+data as a string (or as a versioned fixed layout binary payload, see
+PAYLOAD_LAYOUTS). The I2cDataClient class handles getting data from server and
+returning it in a usable way (as a SensorSample).
+
+The client uses a DEALER socket, so several requests can be in flight and a
+lost reply never leaves the socket stuck the way a REQ socket gets stuck. The
+server answers requests in order, so replies are matched to requests first in
+first out.
+
+A data server can also publish samples at its own rate on a PUB socket. The
+I2cDataSubscriber class receives those without any request (on a background
+thread after start()), keeping the newest sample (with the time it arrived)
+and optionally a history of recent samples, which can be written to a csv
+file after the flight.
 """
+import collections
+import csv
 import logging
 import re
-import zmq
+import struct
+import threading
+import time
+from lazy import LazyModule
+
+
+# Imported when the first client connects (see lazy.py)
+zmq = LazyModule('zmq')
+
+REQUEST = b'totally arbitrary request message'
+
+# Binary payload layouts by version (first byte of the payload). A payload is
+# the version byte followed by the fields of SensorSample listed here, packed
+# little endian. Adding a sensor means adding its field to SensorSample and a
+# new version here, the decoding is the same for every version.
+PAYLOAD_LAYOUTS = {
+    1: (struct.Struct('<Bdff'), ('time', 'temperature', 'altitude')),
+}
+
+# The original text format, still accepted from older servers
+_TEXT_FORMAT = re.compile(r'Temperature: (\S+) Altitude: (\S+)')
+
+_logger = logging.getLogger(__name__)
+
+
+class SensorSample(object):
+    """A data class for one sample of the i2c sensors.
+
+    temperature is in degrees Celcius, altitude in meters (from sea level) and
+    time is the time.time() the sample was taken (or received, for servers
+    sending the text format).
+    """
+    __slots__ = ('temperature', 'altitude', 'time')
+
+    def __init__(self, temperature, altitude, time):
+        self.temperature = temperature
+        self.altitude = altitude
+        self.time = time
+
+    def __repr__(self):
+        """Returns representation of the sample"""
+        return '{}({}, {}, {})'.format(self.__class__.__name__, self.temperature,
+                                       self.altitude, self.time)
+
+    def __eq__(self, other):
+        """Compares if two SensorSamples are equal"""
+        return (self.temperature == other.temperature and
+                self.altitude == other.altitude and
+                self.time == other.time)
+
+
+def parse_data(data):
+    """Returns the SensorSample of a server message (None if it is invalid).
+
+    Binary payloads (see PAYLOAD_LAYOUTS) are decoded with struct, anything
+    else is parsed as the original "Temperature: X Altitude: Y" text.
+    """
+    version = bytearray(data[:1])
+    if version and version[0] < 0x20:
+        layout = PAYLOAD_LAYOUTS.get(version[0])
+        if layout is None:
+            _logger.error('unknown payload version: {}'.format(version[0]))
+            return None
+        payload, fields = layout
+        try:
+            values = payload.unpack(data)
+        except struct.error as err:
+            _logger.error('invalid payload: {}'.format(err))
+            return None
+        sample = SensorSample(None, None, None)
+        for field, value in zip(fields, values[1:]):
+            setattr(sample, field, value)
+        return sample
+    text = data.decode('ascii', 'replace') if isinstance(data, bytes) else data
+    match = _TEXT_FORMAT.match(text)
+    try:
+        return SensorSample(float(match.group(1)), float(match.group(2)), time.time())
+    except (AttributeError, ValueError):
+        _logger.error('invalid data: {}'.format(text))
+        return None
+
+
+class SensorRead(object):
+    """The pending result of I2cDataClient.read_async()."""
+    def __init__(self, client):
+        self.__client = client
+        self.__done = False
+        self.__data = None
+        self.sent = time.time()
+
+    def done(self):
+        """Returns True once the read has completed (or failed)."""
+        if not self.__done:
+            self.__client.poll()
+        return self.__done
+
+    def result(self, timeout=None):
+        """Returns the data read (see I2cDataClient.read()), waiting up to
+        timeout seconds (the client's timeout by default). None if the read
+        failed or is not done yet."""
+        self.__client.wait(self, timeout)
+        return self.__data
+
+    def _complete(self, data):
+        """Marks the read as completed with data (None if it failed)."""
+        self.__data = data
+        self.__done = True
 
 
 class I2cDataClient:
     """This class acts as a client to the data server."""
-    def __init__(self, server_location):
-        """Opens a connection to server_location."""
+    def __init__(self, server_location, timeout=0.5, max_in_flight=4, context=None):
+        """Opens a connection to server_location.
+
+        Requests not answered within timeout seconds are failed and the
+        connection is reopened (the server may have restarted). A zmq context
+        can be given (needed to reach an inproc:// server).
+        """
         self.logger = logging.getLogger(__name__)
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.last = None  # The newest data read
+        self.last_time = None  # time.time() the newest data arrived
         self.__server_location = server_location
-        self.__context = zmq.Context()
-        self.__socket = self.__context.socket(zmq.REQ)
-        self.__socket.connect(server_location)
-        self.__socket.setsockopt(zmq.LINGER, 0)
-        self.__socket.RCVTIMEO = 500
+        self.__context = context or zmq.Context()
+        self.__socket = None
+        self.__pending = collections.deque()
+        self.__connect()
+
+    def read(self, timeout=None):
+        """Request data from the data server and return it as a SensorSample.
+
+        This functions is a blocking function, it blocks till data is returned
+        or timeout seconds (the client's timeout by default) have passed.
+
+        :returns: SensorSample -- The data read from MPL3115A2 (temperature
+                                  and altitude are floats, see SensorSample).
+                                  None if the read failed.
+
+        """
+        data = self.read_async().result(timeout)
+        if data is None:
+            self.logger.error('could not perform read')
+        return data
 
-    def read(self):
-        """Request data from the data server and return it as a dictionary.
+    def read_async(self):
+        """Request data from the data server without waiting for it.
 
-        This functions is a blocking function, a call to recv() blocks till
-        data is returned.
+        When max_in_flight requests are already waiting, no new request is
+        sent and the newest pending read is returned instead.
 
-        :returns: dictionary -- The data read from MPL3115A2. Looks like
-                                {'temperature': 'temp', altitude: 'alt'}.
-                                Note that 'temp' and 'alt' are strings. Also
-                                note that the units are degrees Celcius and
-                                meters (from sea level).
+        :returns: SensorRead -- use done() and result() to get the data.
 
         """
-        self.__socket.send(b'totally arbitrary request message', zmq.NOBLOCK)
+        self.poll()
+        if len(self.__pending) >= self.max_in_flight:
+            return self.__pending[-1]
+        pending = SensorRead(self)
         try:
-            data_string = self.__socket.recv()
-            match = re.match(r'Temperature: (\S+) Altitude: (\S+)', data_string)
-            data = {'temperature': match.group(1), 'altitude': match.group(2)}
-            return data
+            self.__socket.send_multipart([b'', REQUEST], zmq.NOBLOCK)
         except zmq.error.Again as err:
             self.logger.error('zmq.error.Again: {}'.format(err))
-            self.logger.error('could not perform read')
+            pending._complete(None)
+            return pending
+        self.__pending.append(pending)
+        return pending
+
+    def read_latest(self, max_age=None):
+        """Returns the newest data without blocking and requests fresh data
+        for the next call (None if nothing has been read yet, or if max_age is
+        given and the newest data arrived more than max_age seconds ago)."""
+        if not self.__pending:
+            self.read_async()
+        else:
+            self.poll()
+        if max_age is not None and (self.last_time is None or self.age() > max_age):
+            return None
+        return self.last
+
+    def age(self):
+        """Returns the age in seconds of the newest data (None if there is none)."""
+        if self.last_time is None:
+            return None
+        return time.time() - self.last_time
+
+    def poll(self, timeout=0):
+        """Handles replies that have arrived, waiting up to timeout seconds
+        for the first one. Fails requests older than the client's timeout."""
+        while self.__pending and self.__socket.poll(int(timeout * 1000)):
+            timeout = 0
+            try:
+                frames = self.__socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.error.Again:
+                break
+            data = parse_data(frames[-1])
+            if data is not None:
+                self.last = data
+                self.last_time = time.time()
+            self.__pending.popleft()._complete(data)
+        if self.__pending and time.time() - self.__pending[0].sent > self.timeout:
+            self.logger.error('data server did not answer within {} s, reconnecting'.format(
+                              self.timeout))
+            for pending in self.__pending:
+                pending._complete(None)
+            self.__connect()
+
+    def wait(self, pending, timeout=None):
+        """Blocks till the SensorRead pending is done or timeout seconds
+        (the client's timeout by default) have passed."""
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        while not pending.done():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self.poll(remaining)
+
+    def close(self):
+        """Closes the connection, failing any pending requests."""
+        for pending in self.__pending:
+            pending._complete(None)
+        self.__pending.clear()
+        self.__socket.close()
+
+    def __connect(self):
+        """Opens a new socket to the server, dropping any pending requests."""
+        if self.__socket is not None:
+            self.__socket.close()
+        self.__pending.clear()
+        self.__socket = self.__context.socket(zmq.DEALER)
+        self.__socket.setsockopt(zmq.LINGER, 0)
+        self.__socket.connect(self.__server_location)
+
+
+class I2cDataSubscriber:
+    """This class receives the samples published by the data server.
+
+    Without a reader thread, samples are only received when polled (by
+    poll(), read(), read_latest() or history()) and the socket's high water
+    mark can drop samples between polls. After start() a background thread
+    receives every sample as it arrives and the other methods only look at
+    what it received.
+    """
+    def __init__(self, publisher_location, history=0, context=None):
+        """Subscribes to the samples published at publisher_location.
+
+        If history is given, the last history samples are kept (see history()).
+        A zmq context can be given (needed to reach an inproc:// publisher).
+        """
+        self.logger = logging.getLogger(__name__)
+        self.last = None  # The newest sample
+        self.last_time = None  # time.time() the newest sample arrived
+        self.__history = collections.deque(maxlen=history) if history else None
+        self.__received = 0  # Samples received so far
+        self.__polled = 0  # Samples received at the last poll()
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__stop_event = threading.Event()
+        self.__context = context or zmq.Context()
+        self.__socket = self.__context.socket(zmq.SUB)
+        self.__socket.setsockopt(zmq.LINGER, 0)
+        self.__socket.setsockopt(zmq.SUBSCRIBE, b'')
+        self.__socket.connect(publisher_location)
+
+    def start(self):
+        """Starts a background thread receiving the samples as they arrive."""
+        if self.__thread:
+            return
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__receive_samples, name='i2c-subscriber')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """Stops the background thread (blocks until it exits)."""
+        if not self.__thread:
+            return
+        self.__stop_event.set()
+        self.__thread.join()
+        self.__thread = None
+
+    def poll(self, timeout=0):
+        """Receives every sample that has arrived, waiting up to timeout
+        seconds for the first one. Returns the number of samples received
+        since the last poll."""
+        if self.__thread:
+            with self.__condition:
+                if self.__received == self.__polled and timeout > 0:
+                    self.__condition.wait(timeout)
+        else:
+            self.__receive(timeout)
+        with self.__condition:
+            received = self.__received - self.__polled
+            self.__polled = self.__received
+        return received
+
+    def read(self, timeout=1.0):
+        """Waits up to timeout seconds for a new sample and returns it as a
+        SensorSample. None if no sample arrived."""
+        deadline = time.time() + timeout
+        while not self.poll(max(deadline - time.time(), 0)):
+            if time.time() >= deadline:
+                self.logger.error('no sample published within {} s'.format(timeout))
+                return None
+        return self.last
+
+    def read_latest(self, max_age=None):
+        """Returns the newest sample without blocking (None if there is none
+        yet, or if max_age is given and it arrived more than max_age seconds
+        ago)."""
+        self.poll()
+        if max_age is not None and (self.last_time is None or self.age() > max_age):
+            return None
+        return self.last
+
+    def age(self):
+        """Returns the age in seconds of the newest sample (None if there is none)."""
+        if self.last_time is None:
+            return None
+        return time.time() - self.last_time
+
+    def close(self):
+        """Stops the background thread and closes the subscription."""
+        self.stop()
+        self.__socket.close()
+
+    def history(self):
+        """Returns a list of the recent (time.time() received, SensorSample)."""
+        self.poll()
+        if self.__history is None:
+            return []
+        with self.__condition:
+            return list(self.__history)
+
+    def write_history(self, path):
+        """Writes the recent samples to a csv file (for post-flight analysis).
+
+        :returns: int -- the number of samples written.
+        """
+        history = self.history()
+        with open(path, 'wb') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['received', 'time', 'temperature', 'altitude'])
+            for received, sample in history:
+                writer.writerow([repr(received), repr(sample.time), repr(sample.temperature),
+                                 repr(sample.altitude)])
+        return len(history)
+
+    def __receive(self, timeout):
+        """Receives every sample that has arrived, waiting up to timeout
+        seconds for the first one."""
+        while self.__socket.poll(int(timeout * 1000)):
+            timeout = 0
+            try:
+                data_string = self.__socket.recv(zmq.NOBLOCK)
+            except zmq.error.Again:
+                break
+            received = time.time()
+            data = parse_data(data_string)
+            if data is None:
+                continue
+            with self.__condition:
+                self.last = data
+                self.last_time = received
+                if self.__history is not None:
+                    self.__history.append((received, data))
+                self.__received += 1
+                self.__condition.notify_all()
+
+    def __receive_samples(self):
+        """Reader thread body."""
+        while not self.__stop_event.is_set():
+            try:
+                self.__receive(0.1)
+            except zmq.error.ZMQError as err:
+                self.logger.error('ZMQError: {}'.format(err))
+                self.__stop_event.wait(0.1)
@@ -0,0 +1,44 @@
+"""Imports heavy dependencies the first time they are used.
+
+dronekit (and pymavlink with it) takes a few hundred milliseconds to import
+on the BeagleBone, pynmea2 and pyserial a few tens. A module that only needs
+them in some of its functions binds a LazyModule instead:
+
+    dronekit = LazyModule('dronekit')
+
+and uses it like the module itself. The real module is imported on the first
+attribute access, so importing the control package (and running the unit
+tests of the pure Python parts) does not pay for dependencies it never uses.
+Every attribute is looked up on the real module, so patching it (e.g.
+mock.patch('dronekit.connect')) works as usual.
+"""
+import importlib
+import sys
+
+
+class LazyModule(object):
+    """Stands in for a module until one of its attributes is used."""
+    __slots__ = ('name', '_module')
+
+    def __init__(self, name):
+        self.name = name
+        self._module = None
+
+    def __repr__(self):
+        """Returns representation of the lazy module"""
+        return '{}({}, loaded={})'.format(self.__class__.__name__, self.name, self.loaded)
+
+    @property
+    def loaded(self):
+        """True if the module has been imported (by this or any other user)."""
+        return self._module is not None or self.name in sys.modules
+
+    def load(self):
+        """Imports the module (once) and returns it."""
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self.name)
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
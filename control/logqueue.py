@@ -0,0 +1,237 @@
+"""Logs from the flight loop without waiting on the SD card.
+
+A FileHandler formats and writes every record in the thread that logs it,
+so a slow write to the BeagleBone's SD card stalls the flight loop. With
+start_logging() the logging call only puts the record on a queue (a few
+microseconds). A QueueListener thread formats the records and writes them to
+the file and the console, and fsyncs the file at most once per
+FSYNC_INTERVAL instead of flushing after every record.
+
+The QueueHandler merges the arguments into the message before queueing the
+record, so values changed afterwards (or objects that are not thread-safe)
+are never formatted from the listener thread. Only the time stamp and the
+layout of the line are added by the listener.
+
+A RateLimitFilter lets records logged with the same extra={'key': ...}
+through at most once per interval and reports how many were suppressed, so a
+message logged on every update (logger.debug('Velocity: %s', velocity,
+extra={'key': 'velocity'})) does not flood the queue. Records without a key
+(and warnings and errors) are never rate limited, the counts still pending
+are written when the QueueListener stops.
+"""
+import logging
+import os
+import Queue
+import threading
+import time
+
+
+QUEUE_SIZE = 10000  # Records waiting to be written, more are dropped
+FSYNC_INTERVAL = 1.0  # Seconds between fsyncs of the log file at most
+RATE_LIMIT_INTERVAL = 0.5  # Seconds between two records with the same key at least
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_STOP = object()  # Put on the queue to stop the listener
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a queue for a QueueListener to write (Python 2 has no
+    logging.handlers.QueueHandler). When the queue is full the record is
+    dropped and counted instead of blocking the caller."""
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Merges the arguments (and the traceback) into the message, like
+        logging.handlers.QueueHandler.prepare in Python 3."""
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets records with the same key (given with extra={'key': ...}) through
+    at most once every interval seconds. The next record let through after
+    some were suppressed says how many. Records without a key or above
+    max_level always pass."""
+    def __init__(self, interval=RATE_LIMIT_INTERVAL, max_level=logging.INFO, clock=time.time):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.max_level = max_level
+        self.clock = clock
+        self.__lock = threading.Lock()
+        # Key: [time last let through, records suppressed since, last one suppressed]
+        self.__keys = {}
+
+    def filter(self, record):
+        key = getattr(record, 'key', None)
+        if key is None or record.levelno > self.max_level:
+            return True
+        now = self.clock()
+        with self.__lock:
+            last = self.__keys.get(key)
+            if last is None:
+                self.__keys[key] = [now, 0, None]
+                return True
+            if now - last[0] < self.interval:
+                last[1] += 1
+                last[2] = record
+                return False
+            suppressed = last[1]
+            last[0], last[1], last[2] = now, 0, None
+        if suppressed:
+            # Rare, so formatting here does not matter
+            record.msg = '{} ({} similar suppressed)'.format(record.getMessage(), suppressed)
+            record.args = None
+        return True
+
+    def flush(self):
+        """Returns a record for every key with suppressed records not reported
+        yet (the last one suppressed, saying how many were)."""
+        with self.__lock:
+            pending = [tuple(last) for last in self.__keys.values() if last[1]]
+            for last in self.__keys.values():
+                last[1], last[2] = 0, None
+        records = []
+        for _, suppressed, record in pending:
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = '{} (last of {} suppressed)'.format(record.getMessage(), suppressed)
+            record.args = None
+            records.append(record)
+        return sorted(records, key=lambda record: record.created)
+
+
+class SyncingFileHandler(logging.FileHandler):
+    """A FileHandler that does not flush every record, the QueueListener
+    calls sync() to flush and fsync the file from time to time."""
+    def flush(self):
+        pass
+
+    def sync(self):
+        """Writes the buffered records to the disk."""
+        self.acquire()
+        try:
+            if self.stream and not self.stream.closed:
+                self.stream.flush()
+                os.fsync(self.stream.fileno())
+        finally:
+            self.release()
+
+
+class QueueListener(object):
+    """Hands the records put on a queue by a QueueHandler to handlers from a
+    background thread. Handlers with a sync() method are synced once the
+    records waiting are written, at most every fsync_interval seconds (and
+    when stopping). The suppressed counts rate_limit (a RateLimitFilter) has
+    not reported yet are written when stopping."""
+    def __init__(self, queue, handlers, fsync_interval=FSYNC_INTERVAL, rate_limit=None):
+        self.queue = queue
+        self.handlers = list(handlers)
+        self.fsync_interval = fsync_interval
+        self.rate_limit = rate_limit
+        self.__thread = None
+
+    def start(self):
+        """Starts the writer thread."""
+        if self.__thread:
+            return
+        self.__thread = threading.Thread(target=self.__run, name='log-writer')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """Writes the records left, syncs and stops the writer thread."""
+        if not self.__thread:
+            return
+        if self.rate_limit:
+            for record in self.rate_limit.flush():
+                self.queue.put(record)
+        self.queue.put(_STOP)
+        self.__thread.join()
+        self.__thread = None
+
+    def __run(self):
+        """Writer thread body."""
+        last_sync = time.time()
+        written = False  # Records written since the last sync
+        while True:
+            # Only wake up on a timer when there is something to sync
+            timeout = max(last_sync + self.fsync_interval - time.time(), 0) if written else None
+            try:
+                record = self.queue.get(True, timeout)
+            except Queue.Empty:
+                record = None
+            if record is _STOP:
+                break
+            if record is not None:
+                self.__handle(record)
+                written = True
+            if written and time.time() - last_sync >= self.fsync_interval:
+                self.__sync()
+                last_sync, written = time.time(), False
+        self.__sync()
+
+    def __handle(self, record):
+        """Writes a record with every handler whose level it reaches."""
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def __sync(self):
+        """Syncs the handlers that can be synced."""
+        for handler in self.handlers:
+            if hasattr(handler, 'sync'):
+                try:
+                    handler.sync()
+                except (IOError, OSError, ValueError):
+                    pass  # Keep logging to the other handlers
+
+
+def start_logging(logger, filename=None, console=True, level=logging.DEBUG,
+                  fsync_interval=FSYNC_INTERVAL, rate_limit_interval=RATE_LIMIT_INTERVAL,
+                  queue_size=QUEUE_SIZE):
+    """Logs the records of logger (and its children) to filename and the
+    console from a background thread.
+
+    Args:
+        logger (Logger): Logger to attach the QueueHandler to.
+        filename (str): Log file (None to not log to a file).
+        console (bool): Also log to stderr.
+        level (int): Level of the logger and the handlers.
+        fsync_interval (float): Seconds between fsyncs of the file at most.
+        rate_limit_interval (float): Seconds between records logged with the
+                                     same extra={'key': ...} (None to not
+                                     rate limit).
+        queue_size (int): Records waiting to be written at most.
+
+    :returns: tuple -- (QueueHandler, QueueListener), stop() the listener
+              to write the records left before exiting.
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    if filename:
+        handlers.append(SyncingFileHandler(filename))
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+    queue_handler = QueueHandler(Queue.Queue(queue_size))
+    rate_limit = RateLimitFilter(rate_limit_interval) if rate_limit_interval else None
+    if rate_limit:
+        queue_handler.addFilter(rate_limit)
+    listener = QueueListener(queue_handler.queue, handlers, fsync_interval, rate_limit)
+    listener.start()
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    return queue_handler, listener
@@ -2,10 +2,12 @@
 
 Uses the ttyO4 connection (UART4) on the beaglebone to connect to a Pixhawk flight controller.
 Uses the ttyO1 connection (UART1) to connect to a xBee wireless communication module.
-Uses tcp://localhost:5555 to connect to zmq server for reading i2c sensor data.
+Uses tcp://localhost:5555 to connect to zmq server for reading i2c sensor data (or subscribes
+to the samples it publishes when I2C_PUB_CONNECTION_STRING is set).
 Installing the appropriate main.service file allows for this to start on boot.
 
-The waypoints sent from the GCS will be a list of dictionaries in the form:
+The waypoints sent from the GCS will be a list of dictionaries (sent either plainly or with
+control.reliable.ReliableLink for acknowledged, chunked delivery) in the form:
     {"x" : <int>,       - positive east offset from start location in meters
      "y" : <int>,       - positive north offset from start location in meters
      "z" : <int>}       - altitude in meters
@@ -15,24 +17,35 @@ must conform to Python2 syntax. However, the program running on the GCS is writt
 and therefore expects the newer syntax. The most notable side effect from this is that all strings
 used by the communication module must be sent as unicode strings.
 
+The GCS can send commands at any time (handled as soon as they arrive, even mid-flight):
+    {"command" : "abort"}   - land where the UAV is
+    {"command" : "rtl"}     - return to launch
+
 The sensor data that the GCS expects will be a dictionary in the form:
     {"x" : <int>,       - positive east offset from start location in meters
      "y" : <int>,       - positive north offset from start location in meters
      "z" : <int>,       - altitude in meters
-     "temp" : <float>,  - temperature in degrees Celsius
+     "temp" : <float>,  - temperature in degrees Celsius (null without a recent sample)
      "lat"  : <float>,  - latitude
      "lon"  : <float>,  - longitude
      "time" : <float>}  - seconds since start of flight path
 """
 
+import atexit
 import logging
 import sys
 import time
-import dronekit
-from control.communication import Communication
-from control.controller import Controller
-from control.i2cdataclient import I2cDataClient
-from control.gps import get_location_offset, get_distance, get_relative_from_location
+import numpy
+from control.bringup import bring_up, startup_report
+from control.communication import CRITICAL, DEBUG, Communication
+from control.controller import AUTONOMOUS_MODES, Controller
+from control.geofence import ZonedGeofence
+from control.i2cdataclient import I2cDataClient, I2cDataSubscriber
+from control.logqueue import start_logging
+from control.reliable import ReliableLink
+from control.route import optimize_route, route_length
+from control.scheduler import Scheduler
+from control.gps import GpsReading, get_location_offsets
 from control.helper import location_global_relative_to_gps_reading, gps_reading_to_location_global
 
 # Set max and min allowed distance for the UAV to travel from start location
@@ -40,11 +53,113 @@ MAX_RADIUS = 250
 MAX_ALTITUDE = 50
 MIN_ALTITUDE = 3
 
+# The in flight geofence is a bit looser than the limits above, by a few meters
+# of gps error horizontally and more vertically (gps altitude is not accurate
+# at all), to avoid false landings
+GEOFENCE_DISTANCE_MARGIN = 5
+GEOFENCE_ALTITUDE_MARGIN = 10
+
+# A waypoint is reached within this horizontal distance (meters, sent with the
+# mission, the flight controller may use its own waypoint radius instead)
+ARRIVAL_RADIUS = 1.5
+
+# Inclusion and exclusion zones (geofence.PolygonZone, in meters east/north of the
+# start location) every waypoint and leg of the flight path must respect, e.g.
+#   PolygonZone([(20, 20), (40, 20), (40, 35), (20, 35)], max_altitude=25,
+#               exclusion=True, name='library')
+GEOFENCE_ZONES = []
+
+# Reorder the waypoints from the GCS for a shorter flight path (see control.route),
+# spending at most ROUTE_TIME_BUDGET seconds on it. Off by default, the GCS
+# operator may have picked the order on purpose
+OPTIMIZE_ROUTE = False
+ROUTE_TIME_BUDGET = 0.5
+
+# Fly the path in GUIDED mode with Controller.start_path (blending from one point
+# into the next at CRUISE_SPEED m/s, LOOKAHEAD meters ahead) instead of as an
+# AUTO mission
+FOLLOW_PATH = False
+CRUISE_SPEED = 5
+LOOKAHEAD = 5
+
+# Rates (per second) of the tasks run while flying the path (see control.scheduler),
+# the geofence is checked on every position update regardless
+ARRIVAL_RATE = 5
+TELEMETRY_RATE = 2
+LOG_RATE = 1
+SCHEDULER_REPORT_RATE = 1.0 / 30
+
+# Telemetry samples are sent to the GCS in batches of up to this many samples
+# or this many seconds (see Communication.send_telemetry)
+TELEMETRY_BATCH_SIZE = 5
+TELEMETRY_BATCH_INTERVAL = 1.0
+
+# Offer binary framing (see control.protocol) to the GCS once connected, telemetry
+# stays newline terminated json if the GCS does not accept it
+BINARY_FRAMING = True
+
+# Sensor samples older than this (seconds) are not sent as live data (temp is None)
+SENSOR_MAX_AGE = 2.0
+
+
+def connect_data_server():
+    """Returns a client of the i2c data server once a sample has been read
+    (raises IOError if none can be read)."""
+    if I2C_PUB_CONNECTION_STRING:
+        # Samples are published by the server, no request round trips
+        data_client = I2cDataSubscriber(I2C_PUB_CONNECTION_STRING, history=I2C_HISTORY)
+    else:
+        data_client = I2cDataClient(I2C_CONNECTION_STRING)
+    if not data_client.read():
+        data_client.close()
+        raise IOError("no data from the zmq data server")
+    if I2C_PUB_CONNECTION_STRING:
+        data_client.start()  # Receive every sample as it arrives
+    return data_client
+
+
+def optimize_waypoints(logger, com, waypoints):
+    """Returns the waypoints reordered for the shortest flight path from the
+    start location and back that could be found, reporting the distance saved
+    (the waypoints unchanged if the order found is not shorter).
+
+    Args:
+        <Logger> logger                             - system logger
+        <Communication> com                         - xBee connection
+        <list> waypoints                            - {"x": <int>, "y": <int>, "z": <int>}
+                                                        distances from start location
+    """
+    xs = [point[u'x'] for point in waypoints]
+    ys = [point[u'y'] for point in waypoints]
+    start_time = time.time()
+    order = optimize_route(xs, ys, ROUTE_TIME_BUDGET)
+    original = route_length(xs, ys, range(len(waypoints)))
+    optimized = route_length(xs, ys, order)
+    if not optimized < original:
+        # E.g. the time budget ran out before improving a hand-planned order
+        logger.debug("No shorter route found in %.2f s, keeping the original order",
+                     time.time() - start_time)
+        return waypoints
+    message = u"Route optimized in {:.2f} s: {:.0f} m -> {:.0f} m ({:.0f} m saved)".format(
+        time.time() - start_time, original, optimized, original - optimized)
+    logger.debug(message)
+    com.send(message, priority=DEBUG)
+    return [waypoints[index] for index in order]
+
+
+def send_waypoint_error(logger, com, point, description):
+    """Reports a waypoint rejected by create_waypoints to the log and the GCS."""
+    logger.critical("Waypoint is {}".format(point))
+    logger.critical(description)
+    com.send(u"Waypoint is {}".format(point), priority=CRITICAL)
+    com.send(u"{}".format(description), priority=CRITICAL)
+
 
 def create_waypoints(logger, com, start_location, waypoints):
     """Returns a list of LocationGlobalRelative points to be sent to Pixhawk.
     This function will also return None if any waypoint exceeds the max or min distances
-    defined at the top of main.py.
+    defined at the top of main.py, or the path to, between or back from the waypoints
+    leaves the GEOFENCE_ZONES.
 
     Args:
         <Logger> logger                             - system logger
@@ -54,198 +169,282 @@ def create_waypoints(logger, com, start_location, waypoints):
                                                         distances from start location
     """
     start_gps = location_global_relative_to_gps_reading(start_location)
+    xs = [point[u'x'] for point in waypoints]
+    ys = [point[u'y'] for point in waypoints]
+    zs = [point[u'z'] for point in waypoints]
+
+    # Convert and check the whole flight path (from and back to the start) at once
+    latitudes, longitudes = get_location_offsets(start_gps, ys, xs)
+    too_low = numpy.nonzero(numpy.asarray(zs) < MIN_ALTITUDE)[0]
+    if len(too_low):
+        send_waypoint_error(logger, com, waypoints[too_low[0]],
+                            "Waypoint under min allowed altitude of {}m".format(MIN_ALTITUDE))
+        return None
+    geofence = ZonedGeofence(start_gps, GEOFENCE_ZONES, MAX_RADIUS, MAX_ALTITUDE)
+    breach = geofence.path_breach(
+        numpy.concatenate(([start_gps.latitude], latitudes, [start_gps.latitude])),
+        numpy.concatenate(([start_gps.longitude], longitudes, [start_gps.longitude])),
+        [start_gps.altitude] + zs + [start_gps.altitude])
+    if breach:
+        index, description = breach
+        point = waypoints[min(max(index - 1, 0), len(waypoints) - 1)]
+        send_waypoint_error(logger, com, point, description)
+        return None
+
     location_points = []
-    for point in waypoints:
-        x = point[u'x']
-        y = point[u'y']
-        z = point[u'z']
-        gps_waypoint = get_location_offset(start_gps, y, x)
-        gps_waypoint.altitude = z
-        if get_distance(start_gps, gps_waypoint) > MAX_RADIUS:
-            logger.critical("Waypoint is {}".format(point))
-            logger.critical("Waypoint exceeds max allowed radius of {}m".format(MAX_RADIUS))
-            com.send("Waypoint is {}".format(point))
-            com.send("Waypoint exceeds max allowed radius of {}m".format(MAX_RADIUS))
-            return None
-        elif gps_waypoint.altitude > MAX_ALTITUDE:
-            logger.critical("Waypoint is {}".format(point))
-            logger.critical("Waypoint exceeds max allowed altitude of {}m".format(MAX_ALTITUDE))
-            com.send("Waypoint is {}".format(point))
-            com.send("Waypoint exceeds max allowed altitude of {}m".format(MAX_ALTITUDE))
-            return None
-        elif gps_waypoint.altitude < MIN_ALTITUDE:
-            logger.critical("Waypoint is {}".format(point))
-            logger.critical("Waypoint under min allowed altitude of {}m".format(MIN_ALTITUDE))
-            com.send("Waypoint is {}".format(point))
-            com.send("Waypoint under min allowed altitude of {}m".format(MIN_ALTITUDE))
-            return None
+    for latitude, longitude, altitude in zip(latitudes, longitudes, zs):
+        gps_waypoint = GpsReading(float(latitude), float(longitude), altitude, 0)
         location_points.append(gps_reading_to_location_global(gps_waypoint))
     return location_points
 
 
-def package_data(home, location, data_client, flight_time):
+def package_data(state, data_client, flight_time):
     """Returns a dictionary of sensor data to be sent to the GCS.
 
     Args:
-        <LocationGlobalRelative> home       - Location of Pixhawk at time of startup
-        <LocationGlobalRelative> location   - Location of Pixhawk at time of reading
-        <I2cDataClient> data_client         - i2c data client connection
+        <VehicleState> state                - Snapshot of the Pixhawk at time of reading
+                                                (after arming, x/y are relative to home)
+        <I2cDataClient> data_client         - i2c data client connection (temp is
+                                                None without a recent sample)
         <float> flight_time                 - time since start of flight
     """
     data = {}
-    location_gps = location_global_relative_to_gps_reading(location)
-    home_gps = location_global_relative_to_gps_reading(home)
-    x, y = get_relative_from_location(home_gps, location_gps)
+    x, y = state.xy or (None, None)  # No x/y before arming or without a fix
     data[u'x'] = x
     data[u'y'] = y
-    data[u'z'] = location.alt
-    i2c_data = data_client.read()
-    data[u'temp'] = float(i2c_data['temperature'])
-    data[u'lat'] = location.lat
-    data[u'lon'] = location.lon
+    data[u'z'] = state.location.alt
+    # Never waits on the data server, a sample that is too old is not sent as live
+    i2c_data = data_client.read_latest(max_age=SENSOR_MAX_AGE)
+    data[u'temp'] = i2c_data.temperature if i2c_data else None
+    data[u'lat'] = state.location.lat
+    data[u'lon'] = state.location.lon
     data[u'time'] = flight_time
     return data
 
 
-def is_destination_reached(logger, com, vehicle_control, destination):
-    """Returns True if the current altitude is within 3 meters of
-    target altitude and if the direct distance is within 2 meters of
-    target location. Otherwise returns False.
+def handle_command(logger, com, vehicle_control, message):
+    """Carries out a command from the GCS. Returns True if message was a command
+    (so it is not also treated as waypoints). Called from the communication
+    reader thread, so it must not block.
 
     Args:
         <Logger> logger                         - system logger
         <Communication> com                     - xBee connection
         <Controller> vehicle_control            - controller object
-        <LocationGlobalRelative> destination    - destination point
+        <object> message                        - message received from GCS
     """
-
-    current = vehicle_control.vehicle.location.global_relative_frame
-    current_reading = location_global_relative_to_gps_reading(current)
-    point_reading = location_global_relative_to_gps_reading(destination)
-    current_altitude = current_reading.altitude
-    target_altitude = point_reading.altitude
-    distance = get_distance(current_reading, point_reading)
-    if distance < 2 and abs(current_altitude - target_altitude) < 3:
-        logger.debug('Destination Reached')
-        com.send(u"Destination Reached")
-        time.sleep(3)
-        return True
-    return False
+    if not isinstance(message, dict) or u'command' not in message:
+        return False
+    command = message[u'command']
+    logger.critical("Command received: {}".format(command))
+    if command == u'abort':
+        com.send(u"Aborting, landing", priority=CRITICAL)
+        vehicle_control.abort()
+    elif command == u'rtl':
+        com.send(u"Returning to launch", priority=CRITICAL)
+        vehicle_control.return_to_launch()
+    else:
+        com.send(u"Unknown command: {}".format(command), priority=CRITICAL)
+    return True
 
 
 def main():
     """Takes the drone up and then lands."""
-    # Setup logging
+    # Setup logging, the records are written to the file and the console by a
+    # background thread (written out on exit)
     logger = logging.getLogger('control')
-    logger.setLevel(logging.DEBUG)
-    filehandler = logging.FileHandler('main.log')
-    filehandler.setLevel(logging.DEBUG)
-    console = logging.StreamHandler()
-    console.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    filehandler.setFormatter(formatter)
-    console.setFormatter(formatter)
-    logger.addHandler(filehandler)
-    logger.addHandler(console)
-
-    # Connect to xBee
-    com = Communication(COM_CONNECTION_STRING, 0.1)
+    log_handler, log_listener = start_logging(logger, 'main.log', level=logging.DEBUG)
+    atexit.register(log_listener.stop)
+
+    # Open the xBee, the i2c data server and the flight controller at the same time
+    # (the flight controller's parameters are downloaded in the background and
+    # only waited for when arming)
+    logger.debug("Starting program, connecting to devices.")
+    start_time = time.time()
+    startups = bring_up([
+        ('xbee', lambda: Communication(COM_CONNECTION_STRING, 0.1,
+                                       batch_size=TELEMETRY_BATCH_SIZE,
+                                       batch_interval=TELEMETRY_BATCH_INTERVAL,
+                                       asynchronous=True)),
+        ('data server', connect_data_server),
+        ('flight controller', lambda: Controller(PIXHAWK_CONNECTION_STRING, baud=57600,
+                                                 wait_ready=False)),
+    ])
+    summary = startup_report(startups, time.time() - start_time)
+    logger.debug(summary)
+
+    com = startups['xbee'].device
+    if not com:
+        logger.critical("Could not connect to wireless communication receiver")
+        sys.exit(1)
     logger.debug("Connected to wireless communication receiver")
-    com.send(u"Connected to wireless communication receiver")
+    com.send(u"Connected to wireless communication receiver", priority=DEBUG)
+    com.send(u"{}".format(summary), priority=DEBUG)
 
-    # Connect to i2c data server
-    data_client = I2cDataClient("tcp://localhost:5555")
-    if not data_client.read():
+    data_client = startups['data server'].device
+    if not data_client:
         logger.critical("Can't connect to zmq data server")
-        com.send(u"Can't connect to zmq data server")
+        com.send(u"Can't connect to zmq data server", priority=CRITICAL)
+        com.close()
         sys.exit(1)
 
-    # Connect to the drone
-    logger.debug("Starting program, attempting connection to flight controller.")
-    com.send(u"Starting program, attempting connection to flight controller")
-    vehicle_control = None
-    try:
-        vehicle_control = Controller(PIXHAWK_CONNECTION_STRING, baud=57600, com=com)
-        logger.debug("Connected to flight controller")
-        com.send(u"Connected to flight controller")
-    except dronekit.APIException as err:
-        logger.critical("dronekit.APIException: {}".format(err))
+    vehicle_control = startups['flight controller'].device
+    if not vehicle_control:
+        logger.critical("{}: {}".format(type(startups['flight controller'].error).__name__,
+                                        startups['flight controller'].error))
         logger.critical("Could not connect to flight controller.")
-        com.send(u"Could not connect to flight controller.")
+        com.send(u"Could not connect to flight controller.", priority=CRITICAL)
+        com.close()
         sys.exit(1)
+    vehicle_control.set_com(com)
+    logger.debug("Connected to flight controller")
+    com.send(u"Connected to flight controller", priority=DEBUG)
+
+    # Switch to binary framing before the reader thread starts (see
+    # Communication.negotiate_binary)
+    if BINARY_FRAMING and not com.negotiate_binary():
+        logger.warning("GCS did not accept binary framing, sending json")
+        com.send(u"GCS did not accept binary framing, sending json", priority=DEBUG)
+
+    # Handle GCS messages as soon as they arrive
+    com.subscribe(lambda message: handle_command(logger, com, vehicle_control, message))
+    com.start_receiving()
 
     # Wait until the waypoints flight path is received from GCS
     logger.debug("Waiting to receive flight path from GCS")
-    com.send(u"Waiting to receive flight path from GCS")
-    waypoints = com.receive()
+    com.send(u"Waiting to receive flight path from GCS", priority=DEBUG)
+    link = ReliableLink(com)
+    waypoints = link.receive()
     while not waypoints:
-        waypoints = com.receive()
-        time.sleep(1)
-
-    # Create points
-    start_location = vehicle_control.vehicle.location.global_relative_frame
-    points = create_waypoints(logger, com, start_location, waypoints)
+        waypoints = link.receive()
+
+    # Create points (flying them in the original order if the optimized route
+    # is rejected, e.g. a leg crosses an exclusion zone)
+    start_location = vehicle_control.state.location
+    points = None
+    if OPTIMIZE_ROUTE and len(waypoints) > 2:
+        ordered = optimize_waypoints(logger, com, waypoints)
+        if ordered is not waypoints:
+            points = create_waypoints(logger, com, start_location, ordered)
+            if not points:
+                logger.debug("Optimized route rejected, trying the original order")
+                com.send(u"Optimized route rejected, trying the original order",
+                         priority=DEBUG)
+    if not points:
+        points = create_waypoints(logger, com, start_location, waypoints)
 
     if not points:
         logger.critical("Invalid points received from GCS")
-        com.send(u"Invalid points received from GCS")
+        com.send(u"Invalid points received from GCS", priority=CRITICAL)
+        com.close()
         sys.exit(1)
 
+    # Upload the flight path (returning above the start at the last altitude) as a
+    # mission before arming, the flight controller flies it on its own
+    points.append(gps_reading_to_location_global(
+        GpsReading(start_location.lat, start_location.lon, points[-1].alt, 0)))
+    for index, point in enumerate(points):
+        logger.debug("Destination %d: %s", index, point)
+    # The parameters download started at bring-up, arming needs it done
+    try:
+        vehicle_control.wait_ready()
+    except Exception as err:
+        logger.critical("Flight controller not ready: {}: {}".format(type(err).__name__, err))
+        com.send(u"Flight controller not ready: {}".format(err), priority=CRITICAL)
+        data_client.close()
+        vehicle_control.vehicle.close()
+        com.close()
+        sys.exit(1)
+
+    if not FOLLOW_PATH:
+        vehicle_control.upload_mission(points, ARRIVAL_RADIUS)
+
     # Arm and takeoff
     vehicle_control.arm()
     vehicle_control.takeoff(10)
-    points.append(vehicle_control.home)
 
-    # Log points
-    for index, point in enumerate(points):
-        logger.debug("Destination {}: {}".format(index, point))
+    # Don't let the vehicle go too far, checked on every position update from now on
+    vehicle_control.enable_geofence(MAX_RADIUS + GEOFENCE_DISTANCE_MARGIN,
+                                    MAX_ALTITUDE + GEOFENCE_ALTITUDE_MARGIN, GEOFENCE_ZONES)
 
-    # Go to the points
+    # Fly the path
     flight_start_time = time.time()
-    if vehicle_control.vehicle.mode.name == "GUIDED":
-        logger.debug("Flying to points...")
-        for point in points:
-            com.send(u"Destination: {}".format(point))
-            if vehicle_control.vehicle.mode.name != "GUIDED":
-                com.send(u"Mode no longer guided")
-                break
-            vehicle_control.goto(point)
-
-            # Wait for vehicle to reach destination before updating the point
-            for sleep_time in range(60):
-                if vehicle_control.vehicle.mode.name != "GUIDED":
-                    com.send(u"Mode no longer guided")
-                    break
-                vehicle_control.log_flight_info(point)
-                data_for_gcs = package_data(vehicle_control.home,
-                                            vehicle_control.vehicle.location.global_relative_frame,
-                                            data_client, time.time() - flight_start_time)
-                com.send(data_for_gcs)
-                # Don't let the vehicle go too far (could be stricter if get_distance
-                # improved and if gps was more accurate. Also note that altitude
-                # is looser here to avoid false landings (since gps altitude not
-                # accurate at all).
-                vehicle_control.check_geofence(MAX_RADIUS+10, MAX_ALTITUDE+10)
-                if is_destination_reached(logger, com, vehicle_control, point):
-                    break
-                time.sleep(1)
-
-    # Land if still in guided mode (i.e. no user takeover, no flight controller failure)
-    if vehicle_control.vehicle.mode.name == "GUIDED":
+    if vehicle_control.state.mode == "GUIDED":
+        if FOLLOW_PATH:
+            logger.debug("Following path...")
+            com.send(u"Following path...", priority=DEBUG)
+            vehicle_control.start_path(points, ARRIVAL_RADIUS, LOOKAHEAD, CRUISE_SPEED)
+            flight_mode, path_complete = "GUIDED", vehicle_control.path_complete
+        else:
+            logger.debug("Flying mission...")
+            com.send(u"Flying mission...", priority=DEBUG)
+            if not vehicle_control.start_mission():
+                logger.critical("Could not switch to AUTO")
+                com.send(u"Could not switch to AUTO", priority=CRITICAL)
+            flight_mode, path_complete = "AUTO", vehicle_control.mission_complete
+        finished = []
+
+        def _check_arrival():
+            state = vehicle_control.state
+            if state.mode != flight_mode or path_complete():
+                finished.append(state)
+
+        def _send_telemetry():
+            com.send_telemetry(package_data(vehicle_control.state, data_client,
+                                            time.time() - flight_start_time))
+
+        def _report():
+            for line in scheduler.report():
+                logger.debug(line)
+
+        scheduler = Scheduler()
+        scheduler.add_task('arrival', ARRIVAL_RATE, _check_arrival)
+        scheduler.add_task('telemetry', TELEMETRY_RATE, _send_telemetry)
+        scheduler.add_task('log', LOG_RATE, vehicle_control.log_flight_info)
+        scheduler.add_task('report', SCHEDULER_REPORT_RATE, _report)
+        scheduler.run(stop=lambda: finished)
+        for line in scheduler.report():
+            logger.debug(line)
+            com.send(u"{}".format(line), priority=DEBUG)
+        complete = path_complete()
+        vehicle_control.stop_path()
+        if complete:
+            logger.debug('Path complete')
+            com.send(u"Path complete", priority=DEBUG)
+        else:
+            com.send(u"Mode no longer {}".format(flight_mode.lower()), priority=CRITICAL)
+
+    # Land if still flying autonomously (i.e. no user takeover, no flight controller failure)
+    if vehicle_control.state.mode in AUTONOMOUS_MODES:
         vehicle_control.land()
 
     # Always keep the programming running and logging until the vehicle is disarmed
-    while vehicle_control.vehicle.armed:
+    while not vehicle_control.wait_for(lambda: not vehicle_control.state.armed, 1):
         vehicle_control.log_flight_info()
-        time.sleep(1)
+
+    # Keep the sensor samples of the flight for post-flight analysis
+    if I2C_PUB_CONNECTION_STRING:
+        try:
+            count = data_client.write_history(I2C_HISTORY_FILE)
+            logger.debug("Wrote %d sensor samples to %s", count, I2C_HISTORY_FILE)
+        except IOError as err:
+            logger.error("Could not write the sensor samples: %s", err)
+    data_client.close()
 
     # Program end
+    if log_handler.dropped:
+        logger.warning("%d log records dropped (log queue full)", log_handler.dropped)
     logger.debug("Finished program.")
-    com.send("Finished program.")
+    com.send("Finished program.", priority=DEBUG)
+    com.close()
     sys.exit(0)
 
 
 if __name__ == "__main__":
     PIXHAWK_CONNECTION_STRING = '/dev/ttyO4'
     COM_CONNECTION_STRING = '/dev/ttyO1'
+    I2C_CONNECTION_STRING = 'tcp://localhost:5555'
+    I2C_PUB_CONNECTION_STRING = None  # e.g. 'tcp://localhost:5556' if the server publishes
+    I2C_HISTORY = 3600  # Samples kept and written to I2C_HISTORY_FILE after the flight
+    I2C_HISTORY_FILE = 'samples.csv'
     main()
@@ -0,0 +1,81 @@
+"""Follows a path of straight segments without stopping at its points.
+
+PathFollower precomputes the segments of a path (in a local metric frame,
+see gps.LocalFrame) once. For every position update it projects the
+position on the current segment, moves on to the next segment as soon as
+the end of the current one is within the acceptance radius, and returns a
+target lookahead meters further along the path. Chasing that target blends
+smoothly from one segment into the next instead of stopping at each point.
+"""
+import math
+import numpy
+
+
+class PathFollower(object):
+    """Tracks progress along a path and returns the point to steer towards."""
+    def __init__(self, xs, ys, zs, acceptance_radius=2.0, lookahead=5.0):
+        """
+        Args:
+            xs, ys, zs (list): Path points in meters (east, north, up), the
+                               first one is where the vehicle starts.
+            acceptance_radius (float): Distance (meters) from the end of a
+                                       segment at which the next one is started
+                                       (and the path is completed).
+            lookahead (float): Distance (meters) along the path of the target.
+        """
+        self.points = numpy.column_stack((numpy.asarray(xs, dtype=float),
+                                          numpy.asarray(ys, dtype=float),
+                                          numpy.asarray(zs, dtype=float)))
+        if len(self.points) < 2:
+            raise ValueError('a path needs at least 2 points')
+        self.acceptance_radius = acceptance_radius
+        self.lookahead = lookahead
+        vectors = numpy.diff(self.points, axis=0)
+        self.lengths = numpy.sqrt((vectors * vectors).sum(axis=1))
+        safe_lengths = numpy.where(self.lengths > 0, self.lengths, 1.0)
+        self.directions = vectors / safe_lengths[:, None]
+        # Path length left after the end of each segment
+        self.remaining_after = numpy.concatenate((numpy.cumsum(self.lengths[::-1])[::-1][1:],
+                                                  [0.0]))
+        self.segment = 0  # Index of the segment being flown
+        self.done = False
+
+    def update(self, x, y, z):
+        """Advances along the path for the position (x, y, z).
+
+        :returns: tuple -- (target, remaining) the (x, y, z) numpy array to
+                  steer towards and the path length (meters) left from the
+                  position's projection on the path.
+        """
+        position = numpy.array((x, y, z), dtype=float)
+        last = len(self.lengths) - 1
+        while True:
+            along = self.__along(position)
+            end = self.points[self.segment + 1]
+            reached = (math.sqrt(((end - position) ** 2).sum()) <= self.acceptance_radius or
+                       along >= self.lengths[self.segment])
+            if not reached:
+                break
+            if self.segment == last:
+                if math.sqrt(((end - position) ** 2).sum()) <= self.acceptance_radius:
+                    self.done = True
+                break
+            self.segment += 1
+        remaining = (self.lengths[self.segment] - along) + self.remaining_after[self.segment]
+        return self.__point_at(self.segment, along + self.lookahead), remaining
+
+    def __along(self, position):
+        """Returns the distance along the current segment of the projection of
+        position (clipped to the segment)."""
+        offset = position - self.points[self.segment]
+        along = float(numpy.dot(offset, self.directions[self.segment]))
+        return min(max(along, 0.0), float(self.lengths[self.segment]))
+
+    def __point_at(self, segment, along):
+        """Returns the point along meters from the start of segment (carried
+        over into the following segments, stopping at the end of the path)."""
+        while along > self.lengths[segment] and segment < len(self.lengths) - 1:
+            along -= self.lengths[segment]
+            segment += 1
+        along = min(along, self.lengths[segment])
+        return self.points[segment] + self.directions[segment] * along
@@ -0,0 +1,291 @@
+"""Compact binary framing for messages sent over the Xbee.
+
+JSON encoding of a telemetry sample is roughly three times larger than the
+data it carries. This module defines a length prefixed, CRC checked frame with
+fixed struct layouts for the message types we send all the time (telemetry
+samples and waypoint lists). Anything else (status strings, arbitrary data) is
+still carried, as UTF-8 text or JSON inside a frame.
+
+A frame looks like:
+    sync (2 bytes, 0xA5 0x5A)
+    type (1 byte)
+    length of payload (2 bytes, little endian)
+    header check (1 byte, low byte of the CRC-16/CCITT of type and length)
+    payload (length bytes)
+    CRC-16/CCITT of type, length, header check and payload (2 bytes, little endian)
+
+The header check, the known message types and their largest valid lengths
+are verified before waiting for the payload, so a corrupted length can not
+make the decoder wait for bytes that never come.
+
+Several telemetry samples can be sent in one MSG_TELEMETRY_BATCH frame (see
+encode_telemetry_batch). The first sample of a batch is sent in full and the
+rest as small fixed point deltas against the previous sample.
+
+Both the drone and the GCS use encode_message and FrameDecoder, so the decoder
+always matches what the drone sends. A FrameDecoder with json_lines=True also
+returns newline terminated JSON found between frames, which is what a peer
+sends until it has switched to binary framing.
+"""
+import binascii
+import json
+import logging
+import math
+import struct
+
+
+PROTOCOL_VERSION = 2
+SYNC = b'\xa5\x5a'
+MAX_PAYLOAD = 4096  # Bytes, about 0.7 s at 57600 baud (larger data goes through ReliableLink)
+MAX_JSON_LINE = 4096  # Bytes of an unterminated JSON line kept by the decoder
+
+# Message types
+MSG_JSON = 0x01
+MSG_STRING = 0x02
+MSG_TELEMETRY = 0x10
+MSG_WAYPOINTS = 0x11
+MSG_TELEMETRY_BATCH = 0x12
+
+TELEMETRY_FIELDS = (u'x', u'y', u'z', u'temp', u'lat', u'lon', u'time')
+WAYPOINT_FIELDS = (u'x', u'y', u'z')
+
+_HEADER = struct.Struct('<2sBHB')
+_CRC = struct.Struct('<H')
+_TELEMETRY = struct.Struct('<ffffddf')
+_WAYPOINT_COUNT = struct.Struct('<H')
+_WAYPOINT = struct.Struct('<fff')
+_DELTA = struct.Struct('<hhhhiiH')
+
+# Fixed point scale of each telemetry field in a batch delta (x, y, z in cm,
+# temp in 0.01 degrees, lat/lon in 1e-7 degrees (about 1 cm) and time in ms)
+DELTA_SCALES = (100, 100, 100, 100, 10000000, 10000000, 1000)
+_DELTA_LIMITS = [(-2**15, 2**15 - 1)] * 4 + [(-2**31, 2**31 - 1)] * 2 + [(0, 2**16 - 1)]
+
+# Largest valid payload of every message type
+_MAX_LENGTHS = {MSG_JSON: MAX_PAYLOAD, MSG_STRING: MAX_PAYLOAD,
+                MSG_TELEMETRY: _TELEMETRY.size, MSG_WAYPOINTS: MAX_PAYLOAD,
+                MSG_TELEMETRY_BATCH: MAX_PAYLOAD}
+
+_logger = logging.getLogger(__name__)
+
+
+def _crc(data):
+    """Returns the CRC-16/CCITT of data."""
+    return binascii.crc_hqx(data, 0xffff)
+
+
+def _header_check(msg_type, length):
+    """Returns the header check byte of a frame."""
+    return _crc(struct.pack('<BH', msg_type, length)) & 0xff
+
+
+def _frame(msg_type, payload):
+    """Returns the frame for a payload of the given message type."""
+    if len(payload) > _MAX_LENGTHS[msg_type]:
+        raise ValueError('payload too large for a frame: {} bytes'.format(len(payload)))
+    header = _HEADER.pack(SYNC, msg_type, len(payload), _header_check(msg_type, len(payload)))
+    return header + payload + _CRC.pack(_crc(header[2:] + payload))
+
+
+def _is_waypoint_list(data):
+    """Returns True if data is a list of {"x", "y", "z"} dictionaries."""
+    return (isinstance(data, list) and
+            all(isinstance(point, dict) and len(point) == len(WAYPOINT_FIELDS) and
+                all(field in point for field in WAYPOINT_FIELDS) for point in data))
+
+
+def encode_message(data):
+    """Returns data encoded as a single frame.
+
+    Telemetry dictionaries (exactly the TELEMETRY_FIELDS keys) and waypoint
+    lists get a fixed binary layout. Strings are sent as UTF-8 and anything
+    else as JSON, so it must be "jsonnable".
+
+    Raises ValueError if data does not fit in a frame (MAX_PAYLOAD bytes),
+    send large data with reliable.ReliableLink, which splits it in chunks.
+    """
+    try:
+        if isinstance(data, dict) and len(data) == len(TELEMETRY_FIELDS):
+            values = [data[field] for field in TELEMETRY_FIELDS]
+            return _frame(MSG_TELEMETRY, _TELEMETRY.pack(*values))
+        if data and _is_waypoint_list(data):
+            payload = [_WAYPOINT_COUNT.pack(len(data))]
+            payload.extend(_WAYPOINT.pack(*[point[field] for field in WAYPOINT_FIELDS])
+                           for point in data)
+            return _frame(MSG_WAYPOINTS, b''.join(payload))
+    except (KeyError, struct.error):
+        pass  # Not the fixed layout after all, fall back to json
+    if isinstance(data, type(u'')):
+        return _frame(MSG_STRING, data.encode('utf-8'))
+    if isinstance(data, bytes):
+        return _frame(MSG_STRING, data)
+    return _frame(MSG_JSON, json.dumps(data).encode('utf-8'))
+
+
+def _quantize(sample):
+    """Returns the fixed point values of a telemetry sample."""
+    return [int(math.floor(sample[field] * scale + 0.5))
+            for field, scale in zip(TELEMETRY_FIELDS, DELTA_SCALES)]
+
+
+def encode_telemetry_batch(samples):
+    """Returns telemetry samples encoded as delta compressed frames.
+
+    Normally this is a single MSG_TELEMETRY_BATCH frame. When a value changes
+    too much for its delta field (e.g. a long gap in time) a new frame is
+    started, so the result may be several frames concatenated. Every sample but
+    the first of a frame loses precision to the DELTA_SCALES fixed point.
+    A sample with a value that is not a finite number (e.g. a temp of None
+    when there is no recent sensor sample) is sent as a frame of its own
+    (see encode_message).
+    """
+    frames = []
+    payload = []
+    previous = None
+    for sample in samples:
+        try:
+            values = _quantize(sample)
+        except (TypeError, ValueError, OverflowError):
+            if payload:
+                frames.append(_frame(MSG_TELEMETRY_BATCH, b''.join(payload)))
+            frames.append(encode_message(sample))
+            payload, previous = [], None
+            continue
+        deltas = None
+        if (previous is not None and
+                len(payload) < (MAX_PAYLOAD - _TELEMETRY.size) // _DELTA.size):
+            deltas = [value - last for value, last in zip(values, previous)]
+            if any(not low <= delta <= high for delta, (low, high) in zip(deltas, _DELTA_LIMITS)):
+                deltas = None
+        if deltas is None:
+            if payload:
+                frames.append(_frame(MSG_TELEMETRY_BATCH, b''.join(payload)))
+            payload = [_TELEMETRY.pack(*[sample[field] for field in TELEMETRY_FIELDS])]
+            # The decoder only sees the packed values, so start from those
+            values = _quantize(dict(zip(TELEMETRY_FIELDS, _TELEMETRY.unpack(payload[0]))))
+        else:
+            payload.append(_DELTA.pack(*deltas))
+        previous = values
+    if payload:
+        frames.append(_frame(MSG_TELEMETRY_BATCH, b''.join(payload)))
+    return b''.join(frames)
+
+
+def _decode_telemetry_batch(payload):
+    """Returns the list of telemetry samples in a batch payload."""
+    if (len(payload) - _TELEMETRY.size) % _DELTA.size:
+        raise ValueError('telemetry batch payload has the wrong size')
+    first = dict(zip(TELEMETRY_FIELDS, _TELEMETRY.unpack_from(payload)))
+    samples = [first]
+    values = _quantize(first)
+    for offset in range(_TELEMETRY.size, len(payload), _DELTA.size):
+        values = [value + delta for value, delta in
+                  zip(values, _DELTA.unpack_from(payload, offset))]
+        samples.append(dict((field, float(value) / scale) for field, value, scale in
+                            zip(TELEMETRY_FIELDS, values, DELTA_SCALES)))
+    return samples
+
+
+def decode_payload(msg_type, payload):
+    """Returns the original data of a frame payload.
+
+    Raises ValueError if the payload is invalid for the message type.
+    """
+    try:
+        if msg_type == MSG_TELEMETRY:
+            return dict(zip(TELEMETRY_FIELDS, _TELEMETRY.unpack(payload)))
+        if msg_type == MSG_WAYPOINTS:
+            count, = _WAYPOINT_COUNT.unpack_from(payload)
+            if len(payload) != _WAYPOINT_COUNT.size + count * _WAYPOINT.size:
+                raise ValueError('waypoint payload has the wrong size')
+            return [dict(zip(WAYPOINT_FIELDS, values)) for values in
+                    (_WAYPOINT.unpack_from(payload, _WAYPOINT_COUNT.size + i * _WAYPOINT.size)
+                     for i in range(count))]
+        if msg_type == MSG_TELEMETRY_BATCH:
+            return _decode_telemetry_batch(payload)
+        if msg_type == MSG_STRING:
+            return payload.decode('utf-8')
+        if msg_type == MSG_JSON:
+            return json.loads(payload.decode('utf-8'))
+    except struct.error as err:
+        raise ValueError(str(err))
+    raise ValueError('unknown message type {}'.format(msg_type))
+
+
+class FrameDecoder(object):
+    """Incrementally decodes frames out of a byte stream.
+
+    Data is fed in whatever chunks arrive from the serial port. Garbage,
+    frames with an invalid header and frames with a bad CRC are skipped by
+    searching for the next sync bytes. With json_lines=True, newline
+    terminated JSON between frames is decoded too.
+    """
+    def __init__(self, json_lines=False):
+        self._buffer = bytearray()
+        self.json_lines = json_lines
+        self.errors = 0  # Number of corrupt frames skipped
+
+    def feed(self, data):
+        """Adds data to the buffer and returns a list of the decoded messages.
+        Telemetry batches are returned as their individual samples."""
+        buf = self._buffer
+        buf.extend(data)
+        messages = []
+        while True:
+            start = buf.find(SYNC)
+            if self.json_lines and start != 0:
+                end = buf.find(b'\n', 0, start if start != -1 else len(buf))
+                if end != -1:
+                    self.__decode_line(bytes(buf[:end]), messages)
+                    del buf[:end + 1]
+                    continue
+                if start == -1:
+                    if len(buf) > MAX_JSON_LINE:
+                        del buf[:]
+                    break
+            if start == -1:
+                # Keep a trailing first sync byte, the second may be on its way
+                del buf[:-1 if buf[-1:] == SYNC[:1] else len(buf)]
+                break
+            del buf[:start]
+            if len(buf) < _HEADER.size:
+                break
+            _, msg_type, length, check = _HEADER.unpack_from(bytes(buf[:_HEADER.size]))
+            if (check != _header_check(msg_type, length) or
+                    length > _MAX_LENGTHS.get(msg_type, -1)):
+                self.errors += 1
+                _logger.warn('dropping frame with invalid header')
+                del buf[:1]
+                continue
+            end = _HEADER.size + length
+            if len(buf) < end + _CRC.size:
+                break
+            crc, = _CRC.unpack_from(bytes(buf[end:end + _CRC.size]))
+            body = bytes(buf[2:end])
+            if crc != _crc(body):
+                self.errors += 1
+                _logger.warn('dropping frame with bad crc')
+                del buf[:1]
+                continue
+            del buf[:end + _CRC.size]
+            try:
+                data = decode_payload(msg_type, body[_HEADER.size - 2:])
+                if msg_type == MSG_TELEMETRY_BATCH:
+                    messages.extend(data)
+                else:
+                    messages.append(data)
+            except ValueError as err:
+                self.errors += 1
+                _logger.warn('ValueError: {}'.format(err))
+        return messages
+
+    def __decode_line(self, line, messages):
+        """Appends the message of a JSON line to messages (if it is one)."""
+        line = line.strip()
+        if not line:
+            return
+        try:
+            messages.append(json.loads(line.decode('utf-8')))
+        except ValueError as err:
+            self.errors += 1
+            _logger.warn('ValueError: {}'.format(err))
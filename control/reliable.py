@@ -0,0 +1,165 @@
+"""Acknowledged delivery of messages over a Communication link.
+
+Communication.receive() returns None for anything corrupted, so a lost or
+damaged line of a waypoint list silently loses the whole mission. The
+ReliableLink class splits a message into numbered chunks, keeps a window of
+chunks in flight and only retransmits the chunks the other side has not
+acknowledged. The acknowledgements are selective: each carries a bitmask of
+every chunk received so far.
+
+The chunks and acknowledgements are plain dictionaries, so they work with json
+and binary framing:
+    {"rel": "data", "id": <int>, "seq": <int>, "n": <int>, "p": <str>}
+    {"rel": "ack", "id": <int>, "n": <int>, "have": <int bitmask>}
+
+Both the drone and the GCS use ReliableLink. Messages that were not sent
+reliably are passed through by receive(), so a plain Communication.send() on
+the other side still works.
+"""
+import collections
+import json
+import logging
+import random
+import time
+
+
+CHUNK_SIZE = 128  # Characters of json per chunk
+WINDOW = 8  # Chunks in flight before waiting for an acknowledgement
+RETRANSMIT_TIMEOUT = 1.0  # Seconds before an unacknowledged chunk is resent
+
+
+def _is_reliable(message, kind):
+    """Returns True if message is a reliable chunk or ack (kind 'data'/'ack')."""
+    return isinstance(message, dict) and message.get(u'rel') == kind
+
+
+class ReliableLink(object):
+    """Sends and receives acknowledged, chunked messages over a Communication."""
+    def __init__(self, com, chunk_size=CHUNK_SIZE, window=WINDOW,
+                 retransmit_timeout=RETRANSMIT_TIMEOUT):
+        self.logger = logging.getLogger(__name__)
+        self.com = com
+        self.chunk_size = chunk_size
+        self.window = window
+        self.retransmit_timeout = retransmit_timeout
+        self.retransmits = 0  # Chunks sent more than once
+        self.__next_id = random.randint(0, 0xffff)
+        self.__pending = collections.deque()  # Unrelated messages seen while sending
+        self.__partial = {}  # id -> {seq: text} of messages being received
+        self.__completed = collections.deque(maxlen=16)  # (id, n) already delivered
+
+    def send(self, data, timeout=30):
+        """Send data (must be "jsonnable") and block until it is acknowledged.
+
+        :returns: bool -- True if every chunk was acknowledged before timeout
+                  seconds passed.
+
+        """
+        text = json.dumps(data)
+        chunks = [text[i:i + self.chunk_size]
+                  for i in range(0, len(text), self.chunk_size)] or [u'']
+        msg_id = self.__next_id
+        self.__next_id = (self.__next_id + 1) & 0xffff
+        unacked = set(range(len(chunks)))
+        sent_at = {}
+        deadline = time.time() + timeout
+        while unacked:
+            now = time.time()
+            if now > deadline:
+                self.logger.error('Message {} not acknowledged, {} of {} chunks missing'.format(
+                                  msg_id, len(unacked), len(chunks)))
+                return False
+            in_flight = sum(1 for seq in unacked if seq in sent_at and
+                            now - sent_at[seq] < self.retransmit_timeout)
+            for seq in sorted(unacked):
+                if in_flight >= self.window:
+                    break
+                if seq in sent_at:
+                    if now - sent_at[seq] < self.retransmit_timeout:
+                        continue
+                    self.retransmits += 1
+                self.com.send({u'rel': u'data', u'id': msg_id, u'seq': seq,
+                               u'n': len(chunks), u'p': chunks[seq]})
+                sent_at[seq] = now
+                in_flight += 1
+            reply = self.com.receive()
+            if _is_reliable(reply, u'ack'):
+                if reply.get(u'id') == msg_id:
+                    have = reply.get(u'have', 0)
+                    unacked = set(seq for seq in unacked if not have >> seq & 1)
+            elif _is_reliable(reply, u'data'):
+                received = self.__receive_chunk(reply)
+                if received is not None:
+                    self.__pending.append(received)
+            elif reply is not None:
+                self.__pending.append(reply)
+        return True
+
+    def receive(self, timeout=None):
+        """Receive the next message, reassembling reliably sent messages.
+
+        Chunks are acknowledged as they arrive (every half window, when the
+        message completes and whenever the link goes quiet).
+
+        :returns: The original data, or None if nothing arrived before timeout
+                  seconds passed (with no timeout, a single com.receive()).
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self.__pending:
+                return self.__pending.popleft()
+            message = self.com.receive()
+            if _is_reliable(message, u'data'):
+                data = self.__receive_chunk(message)
+                if data is not None:
+                    return data
+            elif message is None:
+                self.__acknowledge_partial()
+            elif not _is_reliable(message, u'ack'):
+                return message
+            if deadline is None:
+                if message is None:
+                    return None
+            elif time.time() > deadline:
+                return None
+
+    def __receive_chunk(self, message):
+        """Stores a chunk and returns the original data once it is complete."""
+        try:
+            msg_id, seq, count = message[u'id'], message[u'seq'], message[u'n']
+            text = message[u'p']
+        except KeyError:
+            self.logger.warn('Invalid chunk: {}'.format(message))
+            return None
+        if (msg_id, count) in self.__completed:
+            self.__acknowledge(msg_id, count, (1 << count) - 1)  # Our ack was lost
+            return None
+        if msg_id not in self.__partial:
+            self.__partial = {msg_id: {}}  # The sender gave up on anything older
+        chunks = self.__partial[msg_id]
+        chunks[seq] = text
+        if len(chunks) < count:
+            if len(chunks) % max(self.window // 2, 1) == 0:
+                self.__acknowledge_partial()
+            return None
+        del self.__partial[msg_id]
+        self.__completed.append((msg_id, count))
+        self.__acknowledge(msg_id, count, (1 << count) - 1)
+        try:
+            return json.loads(u''.join(chunks[i] for i in range(count)))
+        except (KeyError, ValueError) as err:
+            self.logger.warn('Could not reassemble message {}: {}'.format(msg_id, err))
+            return None
+
+    def __acknowledge_partial(self):
+        """Acknowledges the chunks received so far of unfinished messages."""
+        for msg_id, chunks in self.__partial.items():
+            have = 0
+            for seq in chunks:
+                have |= 1 << seq
+            self.__acknowledge(msg_id, None, have)
+
+    def __acknowledge(self, msg_id, count, have):
+        """Sends a selective acknowledgement."""
+        self.com.send({u'rel': u'ack', u'id': msg_id, u'n': count, u'have': have})
@@ -0,0 +1,140 @@
+"""Orders waypoints for a short flight path.
+
+The GCS sends sample sites in whatever order they were picked, flying them
+in that order can zig-zag across the field. optimize_route() finds a short
+closed route from home (the origin of the local x/y frame, in meters) through
+every point and back, using a nearest neighbour route improved with 2-opt
+(reversing a stretch of the route) and Or-opt (moving runs of up to 3 points
+elsewhere) moves until no move helps or the time budget runs out. Building
+the nearest neighbour route also stops when the budget runs out.
+
+Every candidate move for a given stretch is evaluated at once with numpy, so
+a few thousand points are handled well within a second. Distances are
+horizontal only, climbing between altitudes is not taken into account.
+"""
+import time
+import numpy
+
+
+TIME_BUDGET = 0.5  # Seconds spent improving a route at most
+OR_OPT_LENGTHS = (1, 2, 3)  # Lengths of the runs of points moved by Or-opt
+_EPSILON = 1e-9  # Smallest improvement (meters) worth a move
+
+
+def route_length(xs, ys, order):
+    """Returns the length in meters of the closed route from home through
+    the points (xs[i], ys[i]) in the given order and back."""
+    x = numpy.concatenate(([0.0], numpy.asarray(xs, dtype=float)[list(order)], [0.0]))
+    y = numpy.concatenate(([0.0], numpy.asarray(ys, dtype=float)[list(order)], [0.0]))
+    return float(numpy.hypot(numpy.diff(x), numpy.diff(y)).sum())
+
+
+def _nearest_neighbour(points, deadline):
+    """Returns a route (node indices starting with home, 0) always flying to
+    the closest point not visited yet. Once the deadline has passed the
+    points left are appended in the order they were given."""
+    count = len(points)
+    visited = numpy.zeros(count, dtype=bool)
+    visited[0] = True
+    route = [0]
+    current = points[0]
+    for _ in range(count - 1):
+        if time.time() > deadline:
+            route.extend(numpy.flatnonzero(~visited))
+            break
+        distances = numpy.hypot(points[:, 0] - current[0], points[:, 1] - current[1])
+        distances[visited] = numpy.inf
+        node = int(numpy.argmin(distances))
+        visited[node] = True
+        route.append(node)
+        current = points[node]
+    return numpy.array(route)
+
+
+def _two_opt_pass(points, route, deadline):
+    """Applies the best 2-opt move for every edge of the route in turn.
+    Returns the route and whether it improved."""
+    count = len(route)
+    improved = False
+    for i in range(count - 2):
+        if time.time() > deadline:
+            break
+        ordered = points[route]
+        following = numpy.roll(ordered, -1, axis=0)
+        lengths = numpy.hypot(*(following - ordered).T)
+        # Replace edges (i, i+1) and (j, j+1) with (i, j) and (i+1, j+1)
+        last = count - 1 if i == 0 else count  # Edge (n-1, 0) touches edge (0, 1)
+        j = numpy.arange(i + 2, last)
+        if not len(j):
+            continue
+        gains = (lengths[i] + lengths[j] -
+                 numpy.hypot(*(ordered[j] - ordered[i]).T) -
+                 numpy.hypot(*(following[j] - following[i]).T))
+        best = int(numpy.argmax(gains))
+        if gains[best] > _EPSILON:
+            route[i + 1:j[best] + 1] = route[i + 1:j[best] + 1][::-1].copy()
+            improved = True
+    return route, improved
+
+
+def _or_opt_pass(points, route, deadline):
+    """Moves runs of points to the cheapest place elsewhere in the route
+    (possibly reversed). Returns the route and whether it improved."""
+    improved = False
+    for run in OR_OPT_LENGTHS:
+        i = 1
+        while i + run <= len(route):
+            if time.time() > deadline:
+                return route, improved
+            count = len(route)
+            ordered = points[route]
+            first, last = ordered[i], ordered[i + run - 1]
+            before, after = ordered[i - 1], ordered[(i + run) % count]
+            removed = (numpy.hypot(*(first - before)) + numpy.hypot(*(after - last)) -
+                       numpy.hypot(*(after - before)))
+            rest = numpy.concatenate((route[:i], route[i + run:]))
+            starts = points[rest]
+            ends = numpy.roll(starts, -1, axis=0)
+            lengths = numpy.hypot(*(ends - starts).T)
+            forward = (numpy.hypot(*(first - starts).T) + numpy.hypot(*(ends - last).T) -
+                       lengths)
+            backward = (numpy.hypot(*(last - starts).T) + numpy.hypot(*(ends - first).T) -
+                        lengths)
+            forward[i - 1] = backward[i - 1] = numpy.inf  # Where the run already is
+            k_forward = int(numpy.argmin(forward))
+            k_backward = int(numpy.argmin(backward))
+            if min(forward[k_forward], backward[k_backward]) < removed - _EPSILON:
+                segment = route[i:i + run]
+                if backward[k_backward] < forward[k_forward]:
+                    segment, k = segment[::-1], k_backward
+                else:
+                    k = k_forward
+                route = numpy.concatenate((rest[:k + 1], segment, rest[k + 1:]))
+                improved = True
+            else:
+                i += 1
+    return route, improved
+
+
+def optimize_route(xs, ys, time_budget=TIME_BUDGET):
+    """Returns the order (a list of indices of xs and ys) to fly the points
+    (xs[i], ys[i]) (meters east and north of home) in for a short closed
+    route from home and back.
+
+    The route is improved until no 2-opt or Or-opt move shortens it or
+    time_budget seconds have passed, whichever is first. The nearest
+    neighbour route it starts from (quadratic in the number of points) is
+    bounded by the same budget.
+    """
+    deadline = time.time() + time_budget
+    points = numpy.column_stack((numpy.concatenate(([0.0], numpy.asarray(xs, dtype=float))),
+                                 numpy.concatenate(([0.0], numpy.asarray(ys, dtype=float)))))
+    if len(points) <= 3:
+        return list(range(len(points) - 1))  # Every order is as short
+    route = _nearest_neighbour(points, deadline)
+    improved = True
+    while improved and time.time() <= deadline:
+        route, improved = _two_opt_pass(points, route, deadline)
+        route, moved = _or_opt_pass(points, route, deadline)
+        improved = improved or moved
+    return [int(node) - 1 for node in route[1:]]
@@ -0,0 +1,141 @@
+"""Runs periodic tasks at independent fixed rates.
+
+The flight loop used to do everything once a second, one after the other,
+so a slow sensor read delayed every other check. A Scheduler runs each named
+task at its own rate. Release times are kept on a fixed grid (the next one
+is the previous one plus the period, not the end of the run plus the
+period), so the rates do not drift however long the tasks take. Tasks due at
+the same time run in the order they were added.
+
+A task that starts late by a whole period or more skips the releases it
+missed, and a run that has not finished by the next release missed its
+deadline. Both are counted per task (see Scheduler.stats), showing which
+rates the BeagleBone can not keep up with.
+"""
+import heapq
+import logging
+import time
+
+
+class PeriodicTask(object):
+    """A task of a Scheduler and its statistics (times in seconds)."""
+    __slots__ = ('name', 'period', 'callback', 'start', 'release', 'runs', 'skipped',
+                 'misses', 'max_lateness', 'total_time', 'max_time')
+
+    def __init__(self, name, period, callback):
+        self.name = name
+        self.period = period
+        self.callback = callback
+        self.start = 0.0  # Time of the first release
+        self.release = 0  # Number of the next release
+        self.runs = 0
+        self.skipped = 0  # Releases not run at all because the task was too late
+        self.misses = 0  # Runs finished after the next release, plus skipped releases
+        self.max_lateness = 0.0  # Longest delay between a release and its run
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @property
+    def next_due(self):
+        """Time of the next release (computed from the start, so rounding
+        errors do not add up)."""
+        return self.start + self.release * self.period
+
+    def stats(self):
+        """Returns a dictionary of the task's statistics."""
+        return {'rate': 1.0 / self.period, 'runs': self.runs, 'skipped': self.skipped,
+                'misses': self.misses, 'max_lateness': self.max_lateness,
+                'mean_time': self.total_time / self.runs if self.runs else 0.0,
+                'max_time': self.max_time}
+
+
+class Scheduler(object):
+    """Runs named periodic tasks at independent rates from one thread."""
+    def __init__(self, clock=time.time, wait=time.sleep):
+        """
+        Args:
+            clock (function): Returns the current time in seconds.
+            wait (function): wait(seconds) blocks until the next release is
+                             due (it may return early, e.g. to check stop).
+        """
+        self.logger = logging.getLogger(__name__)
+        self.clock = clock
+        self.wait = wait
+        self.tasks = []
+        self.__queue = []  # (next due, order added, task)
+
+    def add_task(self, name, rate, callback):
+        """Runs callback() rate times per second (first as soon as run()
+        starts). Returns the PeriodicTask."""
+        if rate <= 0:
+            raise ValueError('rate must be positive: {}'.format(rate))
+        task = PeriodicTask(name, 1.0 / rate, callback)
+        self.tasks.append(task)
+        return task
+
+    def run(self, stop=None, timeout=None):
+        """Runs the tasks until stop() returns True (checked before every run
+        and after every wait) or timeout seconds have passed.
+
+        :returns: bool -- True if stop() ended the run.
+        """
+        if not self.tasks:
+            raise ValueError('no tasks to run')
+        start = self.clock()
+        self.__queue = [(start, index, task) for index, task in enumerate(self.tasks)]
+        heapq.heapify(self.__queue)
+        for task in self.tasks:
+            task.start = start
+            task.release = 0
+        while True:
+            if stop and stop():
+                return True
+            now = self.clock()
+            if timeout is not None and now - start >= timeout:
+                return False
+            due, index, task = self.__queue[0]
+            if due > now:
+                wait = due - now
+                if timeout is not None:
+                    wait = min(wait, start + timeout - now)
+                self.wait(wait)
+                continue
+            heapq.heappop(self.__queue)
+            self.__run_task(task, now)
+            heapq.heappush(self.__queue, (task.next_due, index, task))
+
+    def __run_task(self, task, now):
+        """Runs a due task, updates its statistics and schedules its next release."""
+        current = int((now - task.start) / task.period + 1e-9)  # Latest release due
+        if current > task.release:
+            task.skipped += current - task.release
+            task.misses += current - task.release
+            task.release = current
+        task.max_lateness = max(task.max_lateness, now - task.next_due)
+        try:
+            task.callback()
+        except Exception:
+            self.logger.exception('Error in task {}'.format(task.name))
+        finished = self.clock()
+        task.runs += 1
+        task.total_time += finished - now
+        task.max_time = max(task.max_time, finished - now)
+        task.release += 1
+        if finished > task.next_due + 1e-9:
+            task.misses += 1
+
+    def stats(self):
+        """Returns a dictionary of the statistics of every task by name."""
+        return dict((task.name, task.stats()) for task in self.tasks)
+
+    def report(self):
+        """Returns a list of lines summarizing the statistics of every task."""
+        lines = []
+        for task in self.tasks:
+            stats = task.stats()
+            lines.append('{}: {:g} Hz, {} runs, {} deadline misses ({} skipped), '
+                         'max late {:.3f} s, mean {:.4f} s, max {:.4f} s'.format(
+                             task.name, stats['rate'], stats['runs'], stats['misses'],
+                             stats['skipped'], stats['max_lateness'], stats['mean_time'],
+                             stats['max_time']))
+        return lines
@@ -0,0 +1,133 @@
+"""Reports how long the control package takes to import and connect.
+
+Every module is imported in a fresh interpreter (modules already imported
+would take no time), and the heavy dependencies it pulled in are listed, so
+a module importing dronekit or pynmea2 it does not need (see lazy.py) stands
+out. Devices given on the command line are then opened at the same time, as
+main.py does, and timed.
+
+    python -m control.startup_profile
+    python -m control.startup_profile --xbee /dev/ttyO1 --vehicle /dev/ttyO4 --baud 57600
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from bringup import bring_up, startup_report
+from communication import Communication
+from controller import Controller
+from i2cdataclient import I2cDataClient
+
+
+# Profiled imports, dependencies first
+IMPORTS = ('numpy', 'serial', 'pynmea2', 'zmq', 'pymavlink.mavutil', 'dronekit',
+           'control.gps', 'control.geofence', 'control.helper', 'control.communication',
+           'control.i2cdataclient', 'control.controller', 'control.main')
+
+# Dependencies reported when an import pulls them in
+HEAVY_MODULES = ('numpy', 'serial', 'pynmea2', 'zmq', 'pymavlink', 'dronekit')
+
+# Dependencies imported eagerly on purpose, and why
+EAGER_MODULES = (
+    ('numpy', 'used on every position update (geofence, path following), where the '
+              'LazyModule indirection would cost on every call'),
+)
+
+_IMPORT_SCRIPT = '''import sys, time
+start = time.time()
+__import__(sys.argv[1])
+seconds = time.time() - start
+print(repr(seconds) + ' ' + ' '.join(name for name in sys.argv[2:] if name in sys.modules))
+'''
+
+
+def import_time(name, repeat=1):
+    """Imports name in repeat fresh interpreters.
+
+    :returns: tuple -- (seconds, modules) the fastest import time and the
+              HEAVY_MODULES loaded by the import.
+    """
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (root, env.get('PYTHONPATH'))))
+    best = None
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _IMPORT_SCRIPT, name] +
+                                         list(HEAVY_MODULES), env=env)
+        fields = output.decode('ascii').split()
+        seconds, modules = float(fields[0]), tuple(fields[1:])
+        best = seconds if best is None else min(best, seconds)
+    return best, modules
+
+
+def import_report(names=IMPORTS, repeat=1):
+    """Returns a list of lines with the import time of every module."""
+    width = max(len(name) for name in names)
+    lines = []
+    for name in names:
+        try:
+            seconds, modules = import_time(name, repeat)
+        except subprocess.CalledProcessError:
+            lines.append('{}  failed'.format(name.ljust(width)))
+            continue
+        loaded = [module for module in modules if not name.startswith(module)]
+        dependencies = '  ({})'.format(', '.join(loaded)) if loaded else ''
+        lines.append('{}  {:7.1f} ms{}'.format(name.ljust(width), seconds * 1000, dependencies))
+    return lines
+
+
+def _open_data_server(location):
+    """Returns a client of the i2c data server once a sample has been read."""
+    data_client = I2cDataClient(location)
+    if not data_client.read():
+        data_client.close()
+        raise IOError('no data from the data server at {}'.format(location))
+    return data_client
+
+
+def main():
+    """Prints the import times and, for the devices given, the connect times."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='import every module this many times and keep the fastest')
+    parser.add_argument('--xbee', default=None, help='serial port of the xBee')
+    parser.add_argument('--data-server', default=None, help='location of the i2c data server')
+    parser.add_argument('--vehicle', default=None, help='connection string of the Pixhawk')
+    parser.add_argument('--baud', type=int, default=None)
+    args = parser.parse_args()
+
+    print('Imports (fresh interpreter, fastest of {}):'.format(args.repeat))
+    for line in import_report(repeat=args.repeat):
+        print('  ' + line)
+    for name, reason in EAGER_MODULES:
+        print('  {} is imported eagerly on purpose: {}'.format(name, reason))
+
+    devices = []
+    if args.xbee:
+        devices.append(('xbee', lambda: Communication(args.xbee, 0.1)))
+    if args.data_server:
+        devices.append(('data server', lambda: _open_data_server(args.data_server)))
+    if args.vehicle:
+        devices.append(('flight controller', lambda: Controller(args.vehicle, baud=args.baud,
+                                                                wait_ready=False)))
+    if not devices:
+        return
+    logging.basicConfig(level=logging.INFO)
+    start = time.time()
+    startups = bring_up(devices)
+    print(startup_report(startups, time.time() - start))
+    vehicle_control = startups['flight controller'].device if args.vehicle else None
+    if vehicle_control:
+        start = time.time()
+        vehicle_control.wait_ready()
+        print('Flight controller ready after {:.2f} s more'.format(time.time() - start))
+        vehicle_control.vehicle.close()
+    for name in ('xbee', 'data server'):
+        if name in startups and startups[name].device:
+            startups[name].device.close()
+
+
+if __name__ == "__main__":
+    main()
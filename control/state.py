@@ -0,0 +1,118 @@
+"""An immutable snapshot of the vehicle state.
+
+Reading dronekit attributes one by one during a loop iteration can mix
+values from different updates, and every consumer converted the location
+again. The Controller builds a new VehicleState whenever dronekit reports an
+update, numbered by a sequence number, and everything in one iteration reads
+the same snapshot (see Controller.state). The distance to the target is
+computed with the snapshot, the other derived values (the GpsReading, local
+x/y and distance to home) the first time they are used and then cached in the
+snapshot.
+"""
+import operator
+import time
+from gps import GpsReading
+
+
+_UNSET = object()  # Derived value not computed yet
+# Index of the derived values in the cache list of a snapshot
+_READING, _XY, _DISTANCE_TO_HOME = range(3)
+
+
+class VehicleState(tuple):
+    """A snapshot of the vehicle, its attributes can not be changed.
+
+    location is a LocationGlobalRelative, mode the name of the flight mode,
+    home_frame the LocalFrame around home (None before arming) and
+    target_frame the LocalFrame around the GpsReading being flown to (None if
+    there is none), made once per target so distance_to_target computes no
+    cosine on every update.
+
+    A snapshot is built on every update, so like a namedtuple it is a tuple
+    (a single allocation). distance_to_target is computed when the snapshot
+    is built, the other derived values are cached in a list at its end.
+    """
+    __slots__ = ()
+
+    def __new__(cls, seq, location, mode, armed, velocity=None, groundspeed=None,
+                airspeed=None, home_frame=None, target_frame=None, timestamp=None):
+        # The distance to the target is read on every update, so it is computed
+        # here (LocalFrame.distance inlined) instead of through a cached property
+        distance_to_target = None
+        if target_frame is not None and location is not None:
+            latitude, longitude = location.lat, location.lon
+            if latitude is not None and longitude is not None:
+                x = (longitude - target_frame.longitude) * target_frame.east_scale
+                y = (latitude - target_frame.latitude) * target_frame.north_scale
+                distance_to_target = (x*x + y*y) ** 0.5
+        return tuple.__new__(cls, (seq, time.time() if timestamp is None else timestamp,
+                                   location, mode, armed, velocity, groundspeed, airspeed,
+                                   home_frame, target_frame, distance_to_target,
+                                   [_UNSET, _UNSET, _UNSET]))
+
+    seq = property(operator.itemgetter(0))
+    time = property(operator.itemgetter(1))
+    location = property(operator.itemgetter(2))
+    mode = property(operator.itemgetter(3))
+    armed = property(operator.itemgetter(4))
+    velocity = property(operator.itemgetter(5))
+    groundspeed = property(operator.itemgetter(6))
+    airspeed = property(operator.itemgetter(7))
+    home_frame = property(operator.itemgetter(8))
+    target_frame = property(operator.itemgetter(9))
+    # Horizontal distance in meters from the target (None if none)
+    distance_to_target = property(operator.itemgetter(10))
+
+    def __repr__(self):
+        """Returns representation of the snapshot"""
+        return '{}(seq={}, mode={}, armed={}, location={})'.format(
+            self.__class__.__name__, self.seq, self.mode, self.armed, self.location)
+
+    @property
+    def target(self):
+        """The GpsReading being flown to (None if there is none)."""
+        return self.target_frame.origin if self.target_frame is not None else None
+
+    @property
+    def altitude(self):
+        """Altitude in meters relative to home (None if unknown)."""
+        return self.location.alt if self.location is not None else None
+
+    @property
+    def reading(self):
+        """The location as a GpsReading (None if there is no fix)."""
+        cache = self[11]
+        reading = cache[_READING]
+        if reading is _UNSET:
+            location = self.location
+            if location is None or location.lat is None or location.lon is None:
+                reading = None
+            else:
+                reading = GpsReading(location.lat, location.lon, location.alt, self.time)
+            cache[_READING] = reading
+        return reading
+
+    @property
+    def xy(self):
+        """The (x, y) meters east and north of home (None before arming)."""
+        cache = self[11]
+        xy = cache[_XY]
+        if xy is _UNSET:
+            reading = self.reading
+            if reading is None or self.home_frame is None:
+                xy = None
+            else:
+                xy = self.home_frame.to_xy(reading.latitude, reading.longitude)
+            cache[_XY] = xy
+        return xy
+
+    @property
+    def distance_to_home(self):
+        """Horizontal distance in meters from home (None before arming)."""
+        cache = self[11]
+        distance = cache[_DISTANCE_TO_HOME]
+        if distance is _UNSET:
+            xy = self.xy
+            distance = None if xy is None else (xy[0]*xy[0] + xy[1]*xy[1]) ** 0.5
+            cache[_DISTANCE_TO_HOME] = distance
+        return distance
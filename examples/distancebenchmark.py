@@ -0,0 +1,135 @@
+"""Compares the speed and accuracy of the gps distance functions.
+
+Distances from a fixed origin to random points within the flight radius are
+computed with the old flat earth formula, get_distance, LocalFrame.distance
+and the batch variants, and compared against the haversine formula.
+
+The distance to the destination computed on every location update is then
+timed the way the flight loop computes it: the old loop converted the
+vehicle location and the destination to GpsReadings and called the flat
+get_distance (is_destination_reached in main.py). Now the Controller builds a
+VehicleState snapshot and distance_to_target projects the raw location into
+a LocalFrame made once per target. The benchmark fails if the new per-update
+distance, snapshot included, is slower. Run with:
+    PYTHONPATH=. python examples/distancebenchmark.py
+"""
+import math
+import random
+import sys
+import timeit
+import dronekit
+import control.gps
+import control.helper
+import control.state
+
+ORIGIN = control.gps.GpsReading(33.142220, -87.582491, 0, 0)
+RADIUS = 250  # Meters
+COUNT = 10000
+ROUNDS = 20  # Every function runs once per round, the fastest round is kept
+
+
+def flat_distance(reading_1, reading_2):
+    """The distance get_distance used to compute (longitude not scaled)."""
+    lat_diff = reading_1.latitude - reading_2.latitude
+    lon_diff = reading_1.longitude - reading_2.longitude
+    return math.sqrt((lat_diff*lat_diff) + (lon_diff*lon_diff)) * 1.113195e5
+
+
+def haversine_distance(reading_1, reading_2):
+    """The great circle distance, used as the reference."""
+    lat_1 = math.radians(reading_1.latitude)
+    lat_2 = math.radians(reading_2.latitude)
+    lon_diff = math.radians(reading_2.longitude - reading_1.longitude)
+    a = (math.sin((lat_2 - lat_1) / 2) ** 2 +
+         math.cos(lat_1) * math.cos(lat_2) * math.sin(lon_diff / 2) ** 2)
+    return 2 * control.gps.EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def old_update_distance(location, destination):
+    """The distance to the destination the old flight loop computed on every
+    update (GpsReadings made from both locations, then the flat formula)."""
+    current_reading = control.helper.location_global_relative_to_gps_reading(location)
+    point_reading = control.helper.location_global_relative_to_gps_reading(destination)
+    return flat_distance(current_reading, point_reading)
+
+
+def new_update_distance(seq, location, target_frame):
+    """The distance to the destination on every update now: the snapshot the
+    Controller builds (see Controller.__snapshot), then its distance_to_target."""
+    state = control.state.VehicleState(seq, location, 'GUIDED', True, None, None, None,
+                                       None, target_frame)
+    return state.distance_to_target
+
+
+def compare_update_distance(points, reference):
+    """Prints the time of the old and new per-update distance to the
+    destination and returns True if the new one is no slower.
+
+    Both include everything done on an update from the vehicle location on
+    (reading the location from dronekit is the same for both and not timed).
+    """
+    destination = dronekit.LocationGlobalRelative(ORIGIN.latitude, ORIGIN.longitude, 0)
+    locations = [dronekit.LocationGlobalRelative(point.latitude, point.longitude, 10)
+                 for point in points]
+    target_frame = control.gps.LocalFrame(ORIGIN)  # Made once per target by the Controller
+    candidates = [
+        ('old (GpsReadings + flat)', lambda: [old_update_distance(location, destination)
+                                              for location in locations]),
+        ('snapshot + distance', lambda: [new_update_distance(seq, location, target_frame)
+                                         for seq, location in enumerate(locations)]),
+    ]
+    old, new = fastest(candidates)
+    error = max(abs(distance - expected)
+                for distance, expected in zip(candidates[1][1](), reference))
+    print('Per-update distance to the destination:')
+    print('{:<25} {:8.3f} us/update'.format(candidates[0][0], old / COUNT * 1e6))
+    print('{:<25} {:8.3f} us/update     max error {:.4f} m   ({:.2f}x the old time)'.format(
+        candidates[1][0], new / COUNT * 1e6, error, new / old))
+    return new <= old
+
+
+def fastest(candidates):
+    """Returns the fastest time in seconds of every (name, function) over
+    ROUNDS rounds, interleaved so a busy moment on the board does not only
+    slow down one function."""
+    timings = [[] for _ in candidates]
+    for _ in range(ROUNDS):
+        for (_, function), times in zip(candidates, timings):
+            times.append(timeit.timeit(function, number=1))
+    return [min(times) for times in timings]
+
+
+def main():
+    """Prints the time per distance and the worst error of each function, and
+    exits with an error if the new per-update distance is slower than the old."""
+    rng = random.Random(204)
+    points = [control.gps.get_location_offset(ORIGIN, rng.uniform(-RADIUS, RADIUS),
+                                              rng.uniform(-RADIUS, RADIUS))
+              for _ in range(COUNT)]
+    latitudes = [point.latitude for point in points]
+    longitudes = [point.longitude for point in points]
+    frame = control.gps.LocalFrame(ORIGIN)
+    reference = [haversine_distance(ORIGIN, point) for point in points]
+    candidates = [
+        ('flat (old get_distance)', lambda: [flat_distance(ORIGIN, point) for point in points]),
+        ('get_distance', lambda: [control.gps.get_distance(ORIGIN, point) for point in points]),
+        ('LocalFrame.distance', lambda: [frame.distance(point.latitude, point.longitude)
+                                         for point in points]),
+        ('get_distances (batch)', lambda: control.gps.get_distances(
+            ORIGIN.latitude, ORIGIN.longitude, latitudes, longitudes)),
+        ('LocalFrame.distances', lambda: frame.distances(latitudes, longitudes)),
+        ('haversine', lambda: [haversine_distance(ORIGIN, point) for point in points]),
+    ]
+    print('{} distances up to {} m from {}'.format(COUNT, RADIUS, ORIGIN))
+    for (name, function), seconds in zip(candidates, fastest(candidates)):
+        error = max(abs(distance - expected)
+                    for distance, expected in zip(function(), reference))
+        print('{:<25} {:8.3f} us/distance   max error {:.4f} m'.format(
+            name, seconds / COUNT * 1e6, error))
+    print('')
+    if not compare_update_distance(points, reference):
+        sys.exit('The per-update distance is slower than the old one')
+
+
+if __name__ == "__main__":
+    main()
@@ -69,10 +69,8 @@ def main(target_altitude, radius):
                 if vehicle_control.vehicle.mode.name != "GUIDED":
                     break
                 vehicle_control.log_flight_info(point)
-                # Don't let the vehicle go too far (could be stricter if get_distance
-                # improved and if gps was more accurate. Also note that altitude
-                # is looser here to avoid false landings (since gps altitude not
-                # accurate at all).
+                # Don't let the vehicle go too far (altitude is looser here to
+                # avoid false landings since gps altitude is not accurate at all).
                 vehicle_control.check_geofence(radius*2, target_altitude+20)
                 current = vehicle_control.vehicle.location.global_relative_frame
                 current_reading = location_global_relative_to_gps_reading(current)
@@ -22,7 +22,7 @@ VERSION = None
 
 # What packages are required for this module to be executed?
 REQUIRED = [
-    'pytest', 'dronekit', 'pyserial', 'pynmea2', 'dronekit-sitl', 'pyzmq'
+    'pytest', 'dronekit', 'pyserial', 'pynmea2', 'dronekit-sitl', 'pyzmq', 'numpy'
 ]
 
 # The rest you shouldn't have to touch too much :)
@@ -0,0 +1,30 @@
+"""Tests the bringup module."""
+import time
+import control.bringup
+
+
+def test_devices_open_concurrently():
+    """Confirm devices open at the same time and each is timed."""
+    def _slow(value):
+        def _open():
+            time.sleep(0.2)
+            return value
+        return _open
+    start = time.time()
+    startups = control.bringup.bring_up([('a', _slow(1)), ('b', _slow(2)), ('c', _slow(3))])
+    assert time.time() - start < 0.5
+    assert [startups[name].device for name in 'abc'] == [1, 2, 3]
+    assert all(0.15 < startups[name].seconds < 0.5 for name in 'abc')
+
+
+def test_failure_recorded():
+    """Confirm a device failing to open is reported without stopping the others."""
+    def _fail():
+        raise IOError('no data')
+    startups = control.bringup.bring_up([('xbee', lambda: 'com'), ('data server', _fail)])
+    assert startups['xbee'].device == 'com' and startups['xbee'].error is None
+    assert startups['data server'].device is None
+    assert isinstance(startups['data server'].error, IOError)
+    line = control.bringup.startup_report(startups, 1.5)
+    assert line.startswith('Startup: data server failed after ')
+    assert line.endswith(' (total 1.50 s)')
@@ -1,7 +1,10 @@
 """Tests the communication module."""
 import json
-from mock import patch, call
+import threading
+import time
+from mock import patch
 import control.communication
+import control.protocol
 
 
 @patch('serial.Serial')
@@ -40,10 +43,225 @@ def test_receiving_bad_data(mock_serial_class):
 
 @patch('serial.Serial')
 def test_sending_valid_data(mock_serial_class):
-    """Confirm the jsonned data is passed to pyserial correctly."""
+    """Confirm the jsonned data is passed to pyserial in a single write."""
     serial_mock = mock_serial_class.return_value
     data = {'test': 5}  # Random data
-    expected_calls = [call(json.dumps(data)), call(b'\n')]
     comm = control.communication.Communication('port', 2)
     comm.send(data)
-    serial_mock.write.assert_has_calls(expected_calls)
+    serial_mock.write.assert_called_once_with(str.encode(json.dumps(data)) + b'\n')
+
+
+@patch('serial.Serial')
+def test_binary_send_and_receive(mock_serial_class):
+    """Confirm binary framing writes one frame and decodes received frames."""
+    serial_mock = mock_serial_class.return_value
+    data = {'test': 5}
+    frame = control.protocol.encode_message(data)
+    comm = control.communication.Communication('port', 2, binary=True)
+    comm.send(data)
+    serial_mock.write.assert_called_once_with(frame)
+    serial_mock.in_waiting = len(frame)
+    serial_mock.read.side_effect = [frame, b'']
+    assert comm.receive() == data
+    assert comm.receive() is None
+
+
+@patch('serial.Serial')
+def test_binary_offer_is_accepted(mock_serial_class):
+    """Confirm a binary offer is answered and the framing switches with the
+    first binary frame received, which may contain newlines."""
+    serial_mock = mock_serial_class.return_value
+    accept = control.communication.BINARY_ACCEPT
+    frame = control.protocol.encode_message(u'two\nlines')
+    newline = frame.index(b'\n') + 1
+    serial_mock.readline.side_effect = [json.dumps(control.communication.BINARY_OFFER),
+                                        json.dumps(control.communication.BINARY_OFFER),
+                                        frame[:newline]]
+    serial_mock.in_waiting = len(frame) - newline
+    serial_mock.read.side_effect = [frame[newline:]]
+    comm = control.communication.Communication('port', 2)
+    assert comm.receive() is None
+    assert not comm.binary
+    assert comm.receive() is None  # The answer was lost, the offer is repeated
+    assert serial_mock.write.call_count == 2
+    serial_mock.write.assert_called_with(str.encode(json.dumps(accept)) + b'\n')
+    assert comm.receive() == u'two\nlines'
+    assert comm.binary
+
+
+@patch('serial.Serial')
+def test_negotiate_binary(mock_serial_class):
+    """Confirm binary framing is used once the offer is accepted, and json
+    still sent by the other side is received."""
+    serial_mock = mock_serial_class.return_value
+    serial_mock.readline.side_effect = [None, json.dumps(control.communication.BINARY_ACCEPT)]
+    comm = control.communication.Communication('port', 2)
+    assert comm.negotiate_binary()
+    assert comm.binary
+    data = str.encode(json.dumps(u'not switched yet')) + b'\n'
+    serial_mock.in_waiting = len(data)
+    serial_mock.read.side_effect = [data]
+    assert comm.receive() == u'not switched yet'
+
+
+@patch('serial.Serial')
+def test_binary_message_too_large(mock_serial_class):
+    """Confirm data too large for a frame is not sent."""
+    serial_mock = mock_serial_class.return_value
+    comm = control.communication.Communication('port', 2, binary=True)
+    assert not comm.send(u'x' * (control.protocol.MAX_PAYLOAD + 1))
+    assert not serial_mock.write.called
+
+
+@patch('serial.Serial')
+def test_telemetry_batching(mock_serial_class):
+    """Confirm telemetry is written once per batch and other data flushes it."""
+    serial_mock = mock_serial_class.return_value
+    samples = [{u'x': i, u'y': 0.0, u'z': 10.0, u'temp': 20.0,
+                u'lat': 33.1, u'lon': -87.5, u'time': i} for i in range(4)]
+    comm = control.communication.Communication('port', 2, batch_size=3)
+    for sample in samples:
+        comm.send_telemetry(sample)
+    jsoned = [str.encode(json.dumps(sample)) + b'\n' for sample in samples]
+    serial_mock.write.assert_called_once_with(b''.join(jsoned[:3]))
+    comm.send(u'GEOFENCE')
+    assert serial_mock.write.call_count == 3
+    serial_mock.write.assert_any_call(jsoned[3])
+
+
+@patch('serial.Serial')
+def test_binary_telemetry_batch_round_trip(mock_serial_class):
+    """Confirm a binary telemetry batch decodes to the samples sent."""
+    serial_mock = mock_serial_class.return_value
+    samples = [{u'x': 1.5 + i, u'y': -2.25, u'z': 10.0 - i, u'temp': 20.5,
+                u'lat': 33.1421 + i * 1e-5, u'lon': -87.5824, u'time': i * 0.5}
+               for i in range(5)]
+    comm = control.communication.Communication('port', 2, binary=True, batch_size=5)
+    for sample in samples:
+        comm.send_telemetry(sample)
+    frame = serial_mock.write.call_args[0][0]
+    assert len(frame) < len(control.protocol.encode_message(samples[0])) * 3
+    serial_mock.in_waiting = len(frame)
+    serial_mock.read.side_effect = [frame]
+    for sample in samples:
+        received = comm.receive()
+        for field in sample:
+            assert abs(received[field] - sample[field]) < 1e-6
+
+
+@patch('serial.Serial')
+def test_asynchronous_send_priorities_and_drops(mock_serial_class):
+    """Confirm queued messages are written critical first, with debug messages
+    dropped and coalesced under backpressure."""
+    serial_mock = mock_serial_class.return_value
+    gate = threading.Event()
+    written = []
+
+    def write(byte_data):
+        """Blocks the writer thread until the gate opens."""
+        gate.wait()
+        written.append(json.loads(byte_data.decode('utf-8')))
+    serial_mock.write.side_effect = write
+    comm = control.communication.Communication('port', 2, asynchronous=True, queue_size=2)
+    comm.send(u'first')  # Taken by the writer thread, which then blocks
+    while comm.queue_depth():
+        time.sleep(0.001)
+    for message in [u'a', u'b', u'b', u'c']:
+        comm.send(message, priority=control.communication.DEBUG)
+    comm.send(u'LAND', priority=control.communication.CRITICAL)
+    assert comm.queue_depth() == 3
+    assert comm.dropped[control.communication.DEBUG] == 1
+    assert comm.coalesced == 1
+    gate.set()
+    comm.close()
+    assert written == [u'first', u'LAND', u'b', u'c']
+
+
+@patch('serial.Serial')
+def test_reader_thread_dispatches_messages(mock_serial_class):
+    """Confirm the reader thread calls subscribers and keeps unhandled messages."""
+    serial_mock = mock_serial_class.return_value
+    lines = [json.dumps({u'command': u'abort'}), json.dumps([{u'x': 1, u'y': 2, u'z': 3}])]
+
+    def readline():
+        """Returns the lines, then acts like a serial timeout."""
+        if lines:
+            return lines.pop(0)
+        time.sleep(0.01)
+        return None
+    serial_mock.readline.side_effect = readline
+    commands = []
+
+    def on_command(message):
+        """Handles command messages."""
+        if isinstance(message, dict) and u'command' in message:
+            commands.append(message[u'command'])
+            return True
+        return False
+    comm = control.communication.Communication('port', 1)
+    comm.subscribe(on_command)
+    comm.start_receiving()
+    assert next(comm.messages()) == [{u'x': 1, u'y': 2, u'z': 3}]
+    assert commands == [u'abort']
+    comm.close()
+
+
+@patch('serial.Serial')
+def test_inbox_overflow_counted(mock_serial_class):
+    """Confirm the inbox has its own bound and counts the messages it drops."""
+    serial_mock = mock_serial_class.return_value
+    lines = [json.dumps(index) for index in range(5)]
+
+    def readline():
+        """Returns the lines, then acts like a serial timeout."""
+        if lines:
+            return lines.pop(0)
+        time.sleep(0.01)
+        return None
+    serial_mock.readline.side_effect = readline
+    comm = control.communication.Communication('port', 0.1, queue_size=1, inbox_size=3)
+    comm.start_receiving()
+    deadline = time.time() + 5
+    while lines and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert comm.inbox_dropped == 2
+    assert [comm.receive() for _ in range(3)] == [2, 3, 4]
+    comm.close()
+
+
+@patch('serial.Serial')
+def test_asynchronous_batch_flushed_on_time(mock_serial_class):
+    """Confirm the writer thread flushes a partial batch after batch_interval."""
+    serial_mock = mock_serial_class.return_value
+    sample = {u'x': 1.0, u'y': 0.0, u'z': 10.0, u'temp': 20.0,
+              u'lat': 33.1, u'lon': -87.5, u'time': 0.0}
+    comm = control.communication.Communication('port', 2, batch_size=5, batch_interval=0.05,
+                                               asynchronous=True)
+    start = time.time()
+    comm.send_telemetry(sample)
+    while not serial_mock.write.called and time.time() - start < 2:
+        time.sleep(0.005)
+    assert serial_mock.write.called
+    assert time.time() - start >= 0.05
+    serial_mock.write.assert_called_once_with(str.encode(json.dumps(sample)) + b'\n')
+    comm.close()
+
+
+@patch('serial.Serial')
+def test_writer_thread_survives_errors(mock_serial_class):
+    """Confirm the writer thread keeps writing after an unexpected error."""
+    serial_mock = mock_serial_class.return_value
+    written = []
+
+    def write(byte_data):
+        """Fails the first write."""
+        if serial_mock.write.call_count == 1:
+            raise TypeError('unexpected')
+        written.append(byte_data)
+    serial_mock.write.side_effect = write
+    comm = control.communication.Communication('port', 2, asynchronous=True)
+    comm.send(u'lost', priority=control.communication.CRITICAL)
+    comm.send(u'LAND', priority=control.communication.CRITICAL)
+    comm.close()
+    assert written == [str.encode(json.dumps(u'LAND')) + b'\n']
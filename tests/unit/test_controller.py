@@ -0,0 +1,237 @@
+"""Tests the controller module without a simulator."""
+import logging
+import threading
+import time
+import unittest
+from mock import Mock, patch
+import dronekit
+from pymavlink import mavutil
+import control.controller
+import control.gps
+import control.logqueue
+import control.state
+
+
+class ControllerWaitTest(unittest.TestCase):
+    """Controller unit tests using a mocked dronekit vehicle."""
+    def setUp(self):
+        self.patcher = patch('dronekit.connect')
+        self.addCleanup(self.patcher.stop)
+        self.connect = self.patcher.start()
+        self.vehicle = self.connect.return_value
+        self.listeners = {}
+        self.vehicle.add_attribute_listener.side_effect = (
+            lambda name, callback: self.listeners.setdefault(name, []).append(callback))
+        self.vehicle.add_message_listener.side_effect = (
+            lambda name, callback: self.listeners.setdefault(name, []).append(callback))
+        self.vehicle.armed = False
+        self.controller = control.controller.Controller('connection')
+
+    def update(self, attribute, value):
+        """Sets a vehicle attribute and calls its listeners like dronekit does."""
+        setattr(self.vehicle, attribute, value)
+        for callback in self.listeners.get(attribute, []):
+            callback(self.vehicle, attribute, value)
+
+    def test_wait_for_returns_on_update(self):
+        """Confirm wait_for returns as soon as a listener reports the change."""
+        timer = threading.Timer(0.05, self.update, ('armed', True))
+        timer.start()
+        start = time.time()
+        updates = []
+        self.assertTrue(self.controller.wait_for(lambda: self.vehicle.armed, 5,
+                                                 on_update=lambda: updates.append(1)))
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(updates, [1])
+
+    def message(self, name, seq):
+        """Calls the message listeners of name like dronekit does."""
+        for callback in self.listeners.get(name, []):
+            callback(self.vehicle, name, Mock(seq=seq))
+
+    def test_upload_mission(self):
+        """Confirm every point is uploaded as a relative altitude waypoint."""
+        points = [dronekit.LocationGlobalRelative(33.1 + i, -87.5, 10 + i) for i in range(3)]
+        self.controller.upload_mission(points, 1.5)
+        commands = self.vehicle.commands
+        self.assertEqual(commands.clear.call_count, 1)
+        self.assertEqual(commands.add.call_count, 3)
+        first = commands.add.call_args_list[0][0][0]
+        self.assertEqual((first.x, first.y, first.z, first.param2), (33.1, -87.5, 10, 1.5))
+        self.assertEqual(first.command, mavutil.mavlink.MAV_CMD_NAV_WAYPOINT)
+        self.assertEqual(first.frame, mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT)
+        self.assertEqual(commands.upload.call_count, 1)
+        self.assertFalse(self.controller.mission_complete())
+
+    def test_mission_progress_wakes_wait_for(self):
+        """Confirm mission messages are tracked and wake up wait_for."""
+        points = [dronekit.LocationGlobalRelative(33.1, -87.5, 10)] * 2
+        self.controller.upload_mission(points)
+        self.message('MISSION_CURRENT', 1)
+        self.message('MISSION_ITEM_REACHED', 1)
+        self.assertEqual(self.controller.mission_current, 1)
+        self.assertFalse(self.controller.mission_complete())
+        timer = threading.Timer(0.05, self.message, ('MISSION_ITEM_REACHED', 2))
+        timer.start()
+        start = time.time()
+        self.assertTrue(self.controller.wait_for(self.controller.mission_complete, 5))
+        self.assertLess(time.time() - start, 1)
+
+    def test_follow_path_with_velocity(self):
+        """Confirm the path is followed with velocity commands on location updates."""
+        start = dronekit.LocationGlobalRelative(33.142220, -87.582491, 10)
+        self.vehicle.location.global_relative_frame = start
+        self.vehicle.mode.name = "GUIDED"
+        origin = control.gps.GpsReading(start.lat, start.lon, 10, 0)
+        reading = control.gps.get_location_offset(origin, 0, 50)
+        end = dronekit.LocationGlobalRelative(reading.latitude, reading.longitude, 10)
+        self.controller.start_path([end], acceptance_radius=2, lookahead=5, speed=3)
+        encode = self.vehicle.message_factory.set_position_target_global_int_encode
+        args = encode.call_args[0]
+        self.assertEqual(args[4], control.controller.POSITION_VELOCITY_MASK)
+        self.assertAlmostEqual(args[8], 0)  # North
+        self.assertAlmostEqual(args[9], 3)  # East
+        self.assertAlmostEqual(args[10], 0)  # Down
+        self.assertEqual(self.vehicle.send_mavlink.call_count, 1)
+        self.assertFalse(self.controller.path_complete())
+        self.update('location.global_relative_frame',
+                    dronekit.LocationGlobalRelative(end.lat, end.lon - 1e-5, None))
+        self.assertEqual(self.vehicle.send_mavlink.call_count, 1)  # Altitude unknown, skipped
+        self.update('location.global_relative_frame',
+                    dronekit.LocationGlobalRelative(end.lat, end.lon - 1e-5, 10))
+        self.assertTrue(self.controller.path_complete())
+        self.controller.stop_path()
+        self.assertEqual(self.vehicle.remove_attribute_listener.call_count, 1)
+
+    def test_state_snapshot_per_update(self):
+        """Confirm every update makes a new numbered snapshot and old ones keep
+        their values."""
+        self.vehicle.mode.name = "GUIDED"
+        before = self.controller.state
+        self.update('armed', True)
+        after = self.controller.state
+        self.assertEqual(after.seq, before.seq + 1)
+        self.assertFalse(before.armed)
+        self.assertTrue(after.armed)
+        self.assertEqual(after.mode, "GUIDED")
+
+    def test_check_geofence_unknown_position(self):
+        """Confirm an unknown distance from home is not taken for inside the fence."""
+        home = control.gps.GpsReading(33.142220, -87.582491, 0, 0)
+        far = control.gps.get_location_offset(home, 100, 0)
+        location = dronekit.LocationGlobalRelative(far.latitude, far.longitude, 10)
+        self.controller.land = Mock()
+        with patch.object(self.controller.logger, 'warning') as warning:
+            unknown = control.state.VehicleState(1, location, 'GUIDED', True)
+            self.controller.check_geofence(50, 30, state=unknown)
+        warning.assert_called_once_with("Position unknown, geofence not checked")
+        self.assertFalse(self.controller.land.called)
+        known = control.state.VehicleState(2, location, 'GUIDED', True,
+                                           home_frame=control.gps.LocalFrame(home))
+        self.controller.check_geofence(50, 30, state=known)
+        self.assertEqual(self.controller.land.call_count, 1)
+
+    def test_start_path_without_points(self):
+        """Confirm an empty path is refused before anything is sent."""
+        listeners = self.vehicle.add_attribute_listener.call_count
+        with self.assertRaises(ValueError):
+            self.controller.start_path([])
+        self.assertFalse(self.vehicle.simple_goto.called)
+        self.assertFalse(self.vehicle.send_mavlink.called)
+        self.assertEqual(self.vehicle.add_attribute_listener.call_count, listeners)
+
+    def test_log_flight_info_rate_limited(self):
+        """Confirm the per-update flight info is keyed for the RateLimitFilter."""
+        logger = self.controller.logger
+        with patch.object(logger, 'isEnabledFor', return_value=True), \
+                patch.object(logger, 'debug') as debug:
+            self.controller.log_flight_info()
+        keys = [call[1]['extra']['key'] for call in debug.call_args_list]
+        self.assertEqual(keys, ['location', 'velocity', 'groundspeed', 'airspeed'])
+
+    def test_land_waits_for_a_known_altitude(self):
+        """Confirm an unknown altitude is not taken for the ground."""
+        self.vehicle.armed = True
+        self.vehicle.location.global_relative_frame = dronekit.LocationGlobalRelative(
+            33.1, -87.5, None)
+        self.update('armed', True)
+        landed = threading.Thread(target=self.controller.land)
+        landed.start()
+        landed.join(0.2)
+        self.assertTrue(landed.is_alive())
+        self.vehicle.location.global_relative_frame = dronekit.LocationGlobalRelative(
+            33.1, -87.5, 0.5)
+        self.update('location.global_relative_frame', self.vehicle.location.global_relative_frame)
+        landed.join(5)
+        self.assertFalse(landed.is_alive())
+
+    def test_log_flight_info_without_fix(self):
+        """Confirm no distance from the destination is logged without a fix."""
+        location = dronekit.LocationGlobalRelative(None, None, None)
+        state = control.state.VehicleState(1, location, 'GUIDED', True)
+        destination = dronekit.LocationGlobalRelative(33.14, -87.58, 10)
+        logger = self.controller.logger
+        with patch.object(logger, 'isEnabledFor', return_value=True), \
+                patch.object(logger, 'debug') as debug:
+            self.controller.log_flight_info(destination, state=state)
+        keys = [call[1]['extra']['key'] for call in debug.call_args_list]
+        self.assertEqual(keys, ['location', 'velocity', 'groundspeed', 'airspeed'])
+
+    def test_mode_changes_not_rate_limited(self):
+        """Confirm two quick mode changes are both logged through the
+        RateLimitFilter (dronekit only calls the listener on a change)."""
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        handler.addFilter(control.logqueue.RateLimitFilter(60))
+        logger = self.controller.logger
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        with patch.object(logger, 'isEnabledFor', return_value=True):
+            self.update('mode', dronekit.VehicleMode('AUTO'))
+            self.update('mode', dronekit.VehicleMode('LAND'))
+        modes = [record.args[1].name for record in records
+                 if record.msg.startswith('Attribute')]
+        self.assertEqual(modes, ['AUTO', 'LAND'])
+
+    def test_deferred_wait_ready(self):
+        """Confirm parameters are downloaded in the background after connecting,
+        only once."""
+        downloading = threading.Event()
+        self.vehicle.wait_ready.side_effect = lambda *args, **kwargs: downloading.wait(5)
+        controller = control.controller.Controller('connection', wait_ready=False)
+        self.assertEqual(self.connect.call_args[1]['wait_ready'], False)
+        self.assertFalse(controller.ready)
+        threading.Timer(0.05, downloading.set).start()
+        controller.wait_ready()
+        controller.wait_ready()
+        self.vehicle.wait_ready.assert_called_once_with(True, timeout=300)
+        self.assertTrue(controller.ready)
+
+    def test_wait_ready_raises_download_error(self):
+        """Confirm a failed download is raised by wait_ready and tried again."""
+        self.vehicle.wait_ready.side_effect = [dronekit.APIException('timeout'), True]
+        controller = control.controller.Controller('connection', wait_ready=False)
+        with self.assertRaises(dronekit.APIException):
+            controller.wait_ready()
+        self.assertFalse(controller.ready)
+        controller.wait_ready()
+        self.assertTrue(controller.ready)
+
+    def test_set_com_sends_bring_up_messages(self):
+        """Confirm the messages sent before there was a com are sent by set_com."""
+        controller = control.controller.Controller('connection', baud=57600, wait_ready=False)
+        controller.wait_ready()
+        com = Mock()
+        controller.set_com(com)
+        messages = [call[0][0] for call in com.send.call_args_list]
+        self.assertEqual(messages[:3], [u"Attempting connection to connection at baud 57600",
+                                        u"Connected.",
+                                        u"Waiting for vehicle parameters and attributes..."])
+        self.assertTrue(messages[3].startswith(u"Vehicle ready after"))
+        controller.set_com(Mock())
+        self.assertEqual(com.send.call_count, 4)
+
+    def test_wait_for_times_out(self):
+        """Confirm wait_for gives up after the timeout."""
+        self.assertFalse(self.controller.wait_for(lambda: self.vehicle.armed, 0.05))
@@ -0,0 +1,98 @@
+"""Tests the fakedataserver module."""
+import csv
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zmq
+import control.fakedataserver
+import control.i2cdataclient
+
+
+class FakeI2cDataServerTest(unittest.TestCase):
+    """Runs the real clients against the fake server over inproc."""
+    def setUp(self):
+        self.context = zmq.Context()
+        self.addCleanup(self.context.term)
+
+    def serve(self, **kwargs):
+        """Starts a fake server that is stopped at the end of the test."""
+        server = control.fakedataserver.FakeI2cDataServer(
+            'inproc://data', 'inproc://samples', context=self.context, seed=1, **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def client(self, cls, location, **kwargs):
+        """Returns a client that is closed at the end of the test."""
+        client = cls(location, context=self.context, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_client_reads_text_and_binary(self):
+        """Confirms the client gets samples in both formats."""
+        for binary in (False, True):
+            server = control.fakedataserver.FakeI2cDataServer(
+                'inproc://data{}'.format(binary), context=self.context, binary=binary)
+            with server:
+                client = self.client(control.i2cdataclient.I2cDataClient,
+                                     'inproc://data{}'.format(binary))
+                sample = client.read()
+                self.assertIsInstance(sample, control.i2cdataclient.SensorSample)
+                self.assertAlmostEqual(sample.altitude, 100.0, delta=5)
+
+    def test_dropped_requests_recover(self):
+        """Confirms dropped requests time out and later reads still work."""
+        server = self.serve(drop_rate=1.0)
+        client = self.client(control.i2cdataclient.I2cDataClient, 'inproc://data',
+                             timeout=0.05)
+        self.assertIsNone(client.read())
+        server.drop_rate = 0.0
+        self.assertIsNotNone(client.read())
+
+    def test_subscriber_receives_published_samples(self):
+        """Confirms published samples reach the subscriber."""
+        self.serve(rate=100.0)
+        subscriber = self.client(control.i2cdataclient.I2cDataSubscriber, 'inproc://samples',
+                                 history=10)
+        sample = subscriber.read(timeout=2)
+        self.assertIsNotNone(sample)
+        self.assertIn(sample, [received for _, received in subscriber.history()])
+
+    def test_subscriber_thread_writes_history(self):
+        """Confirms the reader thread receives samples without polling and
+        the history is written to a csv file."""
+        self.serve(rate=100.0)
+        subscriber = self.client(control.i2cdataclient.I2cDataSubscriber, 'inproc://samples',
+                                 history=10)
+        subscriber.start()
+        self.assertIsNotNone(subscriber.read(timeout=2))
+        time.sleep(0.1)
+        history = subscriber.history()
+        self.assertGreater(len(history), 2)
+        self.assertTrue(all(earlier[0] <= later[0]
+                            for earlier, later in zip(history, history[1:])))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'samples.csv')
+        written = subscriber.write_history(path)
+        with open(path) as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual(rows[0], ['received', 'time', 'temperature', 'altitude'])
+        self.assertEqual(len(rows), written + 1)
+
+    def test_bind_error_raised_by_start(self):
+        """Confirms start() raises instead of hanging when an address is in use."""
+        self.serve()
+        server = control.fakedataserver.FakeI2cDataServer('inproc://other', 'inproc://samples',
+                                                          context=self.context)
+        with self.assertRaises(zmq.ZMQError):
+            server.start()
+
+    def test_benchmark_reports_latency(self):
+        """Confirms the benchmark reads through the fake server."""
+        self.serve(response_delay=0.001)
+        result = control.fakedataserver.benchmark('inproc://data', 20, context=self.context)
+        self.assertEqual(result['failures'], 0)
+        self.assertGreaterEqual(result['latency_mean'], 0.001)
@@ -0,0 +1,151 @@
+"""Tests the geofence module."""
+import math
+from mock import Mock
+import numpy
+import control.geofence
+import control.gps
+
+HOME = control.gps.GpsReading(33.142220, -87.582491, 0, 0)
+
+
+def location(north, east, alt):
+    """Helper function returns a location like dronekit's at an offset from HOME."""
+    reading = control.gps.get_location_offset(HOME, north, east)
+    return Mock(lat=reading.latitude, lon=reading.longitude, alt=alt)
+
+
+def test_cylinder_geofence_limits():
+    """Confirm points are checked against the distance and altitude limits."""
+    fence = control.geofence.CylinderGeofence(HOME, 50, 30)
+    assert fence.breach(HOME.latitude, HOME.longitude, 10) is None
+    inside = location(30, 39, 29)
+    assert fence.breach(inside.lat, inside.lon, inside.alt) is None
+    outside = location(30, 41, 10)
+    assert 'distance' in fence.breach(outside.lat, outside.lon, outside.alt)
+    assert 'altitude' in fence.breach(HOME.latitude, HOME.longitude, 31)
+
+
+def test_monitor_triggers_once():
+    """Confirm the monitor checks every update and calls back only once."""
+    vehicle = Mock()
+    on_breach = Mock()
+    monitor = control.geofence.GeofenceMonitor(
+        control.geofence.CylinderGeofence(HOME, 50, 30), on_breach)
+    monitor.attach(vehicle)
+    name, callback = vehicle.add_attribute_listener.call_args[0]
+    assert name == 'location.global_relative_frame'
+    callback(vehicle, name, location(0, 0, 10))
+    assert not on_breach.called
+    callback(vehicle, name, location(60, 0, 10))
+    callback(vehicle, name, location(70, 0, 10))
+    assert on_breach.call_count == 1
+    monitor.detach()
+    vehicle.remove_attribute_listener.assert_called_once_with(name, callback)
+
+
+def test_monitor_rearms_when_breach_not_acted_upon():
+    """Confirm a breach the callback does not act on (manual flight) is
+    reported again later, and logged once per excursion."""
+    vehicle = Mock()
+    actions = []
+
+    def on_breach(description):
+        """Acts only after the pilot hands back control."""
+        actions.append(description)
+        return len(actions) > 3
+    monitor = control.geofence.GeofenceMonitor(
+        control.geofence.CylinderGeofence(HOME, 50, 30), on_breach)
+    monitor.logger = Mock()
+    monitor.attach(vehicle)
+    name, callback = vehicle.add_attribute_listener.call_args[0]
+    callback(vehicle, name, location(60, 0, 10))
+    callback(vehicle, name, location(70, 0, 10))
+    assert not monitor.triggered
+    callback(vehicle, name, location(0, 0, 10))
+    callback(vehicle, name, location(60, 0, 10))
+    assert monitor.logger.critical.call_count == 2
+    callback(vehicle, name, location(60, 0, 10))
+    assert monitor.triggered
+    callback(vehicle, name, location(60, 0, 10))
+    assert len(actions) == 4
+
+
+def star_zone(points, **kwargs):
+    """Helper function returns a star shaped (non convex) PolygonZone."""
+    vertices = []
+    for i in range(points * 2):
+        radius = 50 if i % 2 == 0 else 20
+        angle = math.pi * i / points
+        vertices.append((radius * math.cos(angle), radius * math.sin(angle)))
+    return control.geofence.PolygonZone(vertices, **kwargs)
+
+
+def brute_force_contains(vertices, x, y):
+    """Helper function, ray casting against every edge."""
+    inside = False
+    for i, (x1, y1) in enumerate(vertices):
+        x2, y2 = vertices[(i + 1) % len(vertices)]
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def test_polygon_zone_contains_matches_brute_force():
+    """Confirm the strip index gives the same answers as testing every edge."""
+    zone = star_zone(100)
+    xs = numpy.linspace(-60, 60, 41)
+    ys = numpy.linspace(-60, 60, 37)
+    grid_x, grid_y = [values.ravel() for values in numpy.meshgrid(xs, ys)]
+    expected = [brute_force_contains(zone.vertices, x, y) for x, y in zip(grid_x, grid_y)]
+    assert [zone.contains(x, y) for x, y in zip(grid_x, grid_y)] == expected
+    assert zone.contains_many(grid_x, grid_y).tolist() == expected
+    assert any(expected) and not all(expected)
+
+
+def test_zoned_geofence_breach():
+    """Confirm inclusion zones, exclusion zones and their altitudes are checked."""
+    field = control.geofence.PolygonZone([(-100, -100), (100, -100), (100, 100), (-100, 100)],
+                                         max_altitude=40)
+    building = control.geofence.PolygonZone([(10, 10), (30, 10), (30, 30), (10, 30)],
+                                            max_altitude=20, exclusion=True, name='building')
+    fence = control.geofence.ZonedGeofence(HOME, [field, building], max_altitude=100)
+    for north, east, alt, expected in [(0, 0, 10, None), (20, 20, 25, None),
+                                       (20, 20, 15, 'building'), (0, 0, 45, 'altitude'),
+                                       (0, 150, 10, 'inclusion')]:
+        point = location(north, east, alt)
+        description = fence.breach(point.lat, point.lon, point.alt)
+        if expected is None:
+            assert description is None
+        else:
+            assert expected in description
+
+
+def test_zoned_geofence_path_breach():
+    """Confirm legs through an exclusion zone are caught, not just waypoints."""
+    building = control.geofence.PolygonZone([(10, -10), (30, -10), (30, 10), (10, 10)],
+                                            max_altitude=20, exclusion=True, name='building')
+    fence = control.geofence.ZonedGeofence(HOME, [building], max_distance=100)
+    path = [location(0, 0, 10), location(0, 50, 10), location(50, 50, 10)]
+    breach = fence.path_breach([p.lat for p in path], [p.lon for p in path],
+                               [p.alt for p in path])
+    assert breach[0] == 0 and 'building' in breach[1]
+    high = [location(0, 0, 30), location(0, 50, 30), location(50, 50, 30)]
+    assert fence.path_breach([p.lat for p in high], [p.lon for p in high],
+                             [p.alt for p in high]) is None
+    far = high + [location(0, 150, 30)]
+    breach = fence.path_breach([p.lat for p in far], [p.lon for p in far],
+                               [p.alt for p in far])
+    assert breach[0] == 3 and 'distance' in breach[1]
+
+
+def test_zoned_geofence_vertical_leg_crosses_rectangle():
+    """Confirm a leg crossing only the horizontal edges of a zone is caught."""
+    library = control.geofence.PolygonZone([(20, 20), (40, 20), (40, 35), (20, 35)],
+                                           max_altitude=25, exclusion=True, name='library')
+    assert library.crosses([30], [0], [30], [50]).tolist() == [True]
+    assert library.crosses([50], [0], [50], [50]).tolist() == [False]
+    fence = control.geofence.ZonedGeofence(HOME, [library], max_distance=100)
+    path = [location(0, 30, 10), location(50, 30, 10)]
+    breach = fence.path_breach([p.lat for p in path], [p.lon for p in path],
+                               [p.alt for p in path])
+    assert breach[0] == 0 and 'library' in breach[1]
@@ -1,4 +1,8 @@
 """Tests the gps module."""
+import functools
+import math
+import operator
+import time
 import unittest
 from mock import patch
 import pynmea2
@@ -95,3 +99,202 @@ def test_offset_and_locations_are_inverse_functions():
     tup = control.gps.get_relative_from_location(origin, offset)
     assert tup[0] + 15 < 1
     assert tup[1] + 7 < 1
+
+
+def test_get_distance_matches_offsets():
+    """Tests that distances are correct in every direction (longitude degrees
+    are shorter than latitude degrees away from the equator)."""
+    origin = control.gps.GpsReading(33.142220, -87.582491, 0, 0)
+    frame = control.gps.LocalFrame(origin)
+    for north, east in [(250, 0), (0, 250), (-150, 200), (1, -1)]:
+        reading = control.gps.get_location_offset(origin, north, east)
+        expected = math.hypot(north, east)
+        assert control.gps.get_distance(origin, reading) == pytest.approx(expected, abs=0.01)
+        assert control.gps.get_distance(reading, origin) == pytest.approx(expected, abs=0.01)
+        assert frame.distance(reading.latitude, reading.longitude) == pytest.approx(expected)
+        assert frame.distances([reading.latitude], [reading.longitude])[0] == pytest.approx(
+            expected)
+
+
+def test_batch_functions_match_scalar_functions():
+    """Tests that the batch geodesy functions return what the scalar
+    functions return for each point.
+    """
+    origin = control.gps.GpsReading(33.142220, -87.582491, 0, 0)
+    norths = [0, 10, -7, 150.5, -249]
+    easts = [0, 15, -15, -3.25, 100]
+    latitudes, longitudes = control.gps.get_location_offsets(origin, norths, easts)
+    xs, ys = control.gps.get_relatives_from_locations(origin, latitudes, longitudes)
+    distances = control.gps.get_distances(origin.latitude, origin.longitude,
+                                          latitudes, longitudes)
+    frame = control.gps.LocalFrame(origin)
+    frame_distances = frame.distances(latitudes, longitudes)
+    for index, (north, east) in enumerate(zip(norths, easts)):
+        reading = control.gps.get_location_offset(origin, north, east)
+        assert latitudes[index] == reading.latitude
+        assert longitudes[index] == reading.longitude
+        x, y = control.gps.get_relative_from_location(origin, reading)
+        assert xs[index] == x
+        assert ys[index] == y
+        assert distances[index] == control.gps.get_distance(origin, reading)
+        assert frame_distances[index] == frame.distance(reading.latitude, reading.longitude)
+
+
+def test_gps_reading_has_no_instance_dict():
+    """Tests that GpsReading uses slots instead of a per-instance dict."""
+    reading = control.gps.GpsReading(33.142220, -87.582491, 0, 0)
+    assert not hasattr(reading, '__dict__')
+
+
+def test_gps_track_append_and_index():
+    """Tests that a GpsTrack returns the readings appended."""
+    readings = [control.gps.GpsReading(33.0 + i, -87.0 - i, i * 2.0, i) for i in range(10)]
+    track = control.gps.GpsTrack(capacity=10)
+    track.extend(readings)
+    assert len(track) == 10
+    assert track[3] == control.gps.GpsReading(36.0, -90.0, 6.0, 3.0)
+    assert track[-1] == control.gps.GpsReading(42.0, -96.0, 18.0, 9.0)
+    assert list(track.altitudes) == [i * 2.0 for i in range(10)]
+    with pytest.raises(IndexError):
+        track[10]
+
+
+def test_gps_track_keeps_the_newest_readings():
+    """Tests that a full GpsTrack overwrites its oldest readings and its
+    views stay contiguous without growing the storage."""
+    track = control.gps.GpsTrack(capacity=4)
+    storage = track.latitudes.base
+    for i in range(11):
+        track.append(control.gps.GpsReading(float(i), -float(i), 0, i))
+        assert list(track.latitudes) == [float(j) for j in range(max(i - 3, 0), i + 1)]
+    assert len(track) == 4
+    assert track[0] == control.gps.GpsReading(7.0, -7.0, 0.0, 7.0)
+    assert list(track.times) == [7.0, 8.0, 9.0, 10.0]
+    assert track.latitudes.base is storage
+
+
+def test_gps_track_converts_nmea_timestamps():
+    """Tests that a GpsTrack stores a datetime.time as seconds since midnight."""
+    track = control.gps.GpsTrack.from_readings([expected_gps_reading(NMEA_MSG_GGA)])
+    assert track.times[0] == 18 * 3600 + 32 * 60 + 36
+
+
+def test_gps_track_slices_are_copies():
+    """Tests that appending to a slice leaves the original track alone."""
+    track = control.gps.GpsTrack.from_readings(
+        [control.gps.GpsReading(float(i), float(i), 0, 0) for i in range(6)])
+    view = track[2:5]
+    assert len(view) == 3
+    assert list(view.latitudes) == [2.0, 3.0, 4.0]
+    view.append(control.gps.GpsReading(100.0, 100.0, 0, 0))
+    assert list(track.latitudes) == [float(i) for i in range(6)]
+    origin = control.gps.GpsReading(0.0, 0.0, 0, 0)
+    xs, ys = view.relative_to(origin)
+    assert len(xs) == 4
+
+
+def test_nmea_framer_handles_split_chunks():
+    """Tests that sentences split across chunks are framed once complete."""
+    framer = control.gps.NmeaFramer()
+    data = (NMEA_MSG_GSV + '\r\n' + NMEA_MSG_GGA + '\r\n' + NMEA_MSG_RMC + '\r\n').encode('ascii')
+    sentences = framer.feed(data[:70])
+    sentences += framer.feed(data[70:100])
+    sentences += framer.feed(data[100:])
+    assert sentences == [NMEA_MSG_GGA, NMEA_MSG_RMC]
+
+
+def test_nmea_framer_drops_bad_checksums():
+    """Tests that sentences with a bad checksum and garbage are discarded."""
+    framer = control.gps.NmeaFramer(('GGA',))
+    bad = NMEA_MSG_GGA[:-2] + '00'
+    data = '\n'.join([NMEA_MSG_CORRUPT, bad, NMEA_MSG_GGA2, '']).encode('ascii')
+    assert framer.feed(data) == [NMEA_MSG_GGA2]
+
+
+def test_nmea_framer_drops_non_ascii_sentences():
+    """Tests that a sentence with a valid checksum but non ascii bytes is discarded."""
+    framer = control.gps.NmeaFramer(('GGA',))
+    body = NMEA_MSG_GGA[1:NMEA_MSG_GGA.index('*')].encode('ascii').replace(b'M', b'\xcd', 1)
+    checksum = functools.reduce(operator.xor, bytearray(body), 0)
+    bad = b'$' + body + '*{:02X}'.format(checksum).encode('ascii')
+    assert framer.feed(b'\n'.join([bad, NMEA_MSG_GGA2.encode('ascii'), b''])) == [NMEA_MSG_GGA2]
+
+
+class GPSStreamTest(unittest.TestCase):
+    """GPS streaming unit tests."""
+    def setUp(self):
+        self.patcher = patch('serial.Serial')
+        self.addCleanup(self.patcher.stop)
+        self.mock_serial_class = self.patcher.start()
+        self.mock_serial_connect = self.mock_serial_class.return_value
+        self.gps = control.gps.Gps("connection", 9600)
+
+    def test_gps_stream_yields_gga_readings(self):
+        """Test streaming readings out of bulk serial reads."""
+        data = '\r\n'.join([NMEA_MSG_RMC, NMEA_MSG_GGA, NMEA_MSG_GSV, NMEA_MSG_GGA2, ''])
+        data = data.encode('ascii')
+        self.mock_serial_connect.in_waiting = 40
+        self.mock_serial_connect.read.side_effect = [data[i:i + 40]
+                                                     for i in range(0, len(data), 40)]
+        stream = self.gps.stream()
+        self.assertEqual(next(stream), expected_gps_reading(NMEA_MSG_GGA))
+        self.assertEqual(next(stream), expected_gps_reading(NMEA_MSG_GGA2))
+
+    def test_gps_sentences_yields_rmc(self):
+        """Test that sentences parses the requested types only."""
+        data = '\n'.join([NMEA_MSG_GGA, NMEA_MSG_RMC, '']).encode('ascii')
+        self.mock_serial_connect.in_waiting = len(data)
+        self.mock_serial_connect.read.return_value = data
+        msg = next(self.gps.sentences(('RMC',)))
+        self.assertIsInstance(msg, pynmea2.RMC)
+
+    def test_gps_background_survives_errors(self):
+        """Test that the reader thread keeps going after an unexpected error."""
+        chunks = [('\n'.join([NMEA_MSG_GGA, '']).encode('ascii')), RuntimeError('boom')]
+
+        def read(size):
+            """Raises the error, returns the data, then acts like a serial timeout."""
+            if chunks:
+                chunk = chunks.pop()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                return chunk
+            time.sleep(0.01)
+            return b''
+        self.mock_serial_connect.in_waiting = 0
+        self.mock_serial_connect.read.side_effect = read
+        self.gps.start()
+        self.addCleanup(self.gps.stop)
+        for _ in range(300):  # The thread pauses for a second after the error
+            if self.gps.latest() is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.gps.latest(), expected_gps_reading(NMEA_MSG_GGA))
+
+    def test_gps_background_latest_fix(self):
+        """Test that the reader thread publishes the newest fix and history."""
+        chunks = ['\n'.join([NMEA_MSG_GGA2, NMEA_MSG_RMC, NMEA_MSG_GGA, '']).encode('ascii')]
+
+        def read(size):
+            """Returns the data once, then acts like a serial timeout."""
+            if chunks:
+                return chunks.pop()
+            time.sleep(0.01)
+            return b''
+        self.mock_serial_connect.in_waiting = 0
+        self.mock_serial_connect.read.side_effect = read
+        self.assertIsNone(self.gps.latest())
+        self.gps.start(history=5)
+        self.addCleanup(self.gps.stop)
+        for _ in range(100):
+            if len(self.gps.history()) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.gps.latest(), expected_gps_reading(NMEA_MSG_GGA))
+        history = self.gps.history()
+        self.assertEqual(list(history.latitudes),
+                         [expected_gps_reading(NMEA_MSG_GGA2).latitude,
+                          expected_gps_reading(NMEA_MSG_GGA).latitude])
+        self.assertEqual(history.times[-1], 18 * 3600 + 32 * 60 + 36)
+        self.assertLess(self.gps.fix_age(), 5)
+        self.assertIsNone(self.gps.latest(max_age=-1))
@@ -1,19 +1,95 @@
 """Tests the i2cdataclient module."""
+import struct
 import unittest
 from mock import patch
 import control.i2cdataclient
 
 
+def expected_sample(temperature, altitude, sample):
+    """Helper function returns the SensorSample expected (time is taken from
+    the actual sample since text data is stamped when received)."""
+    return control.i2cdataclient.SensorSample(temperature, altitude, sample.time)
+
+
 class I2cDataClientTest(unittest.TestCase):
-    @patch('zmq.Context')
-    def test_data_string_correct(self, mock_context_class):
+    def setUp(self):
+        # Jump some hoops to get at the socket the client creates
+        self.patcher = patch('zmq.Context')
+        self.addCleanup(self.patcher.stop)
+        mock_context_class = self.patcher.start()
+        self.context_mock = mock_context_class.return_value
+        self.socket_mock = self.context_mock.socket.return_value
+
+    def test_data_string_correct(self):
         """Confirms we're parsing strings correctly with re."""
-        # Jump some hoops to set the return data for recv()
-        context_mock = mock_context_class.return_value
-        socket_mock = context_mock.socket.return_value
-        socket_mock.recv.return_value = 'Temperature: 0 Altitude: 100'
+        self.socket_mock.poll.return_value = 1
+        self.socket_mock.recv_multipart.return_value = [b'', 'Temperature: 0 Altitude: 100']
 
         client = control.i2cdataclient.I2cDataClient('connection_string')
         data = client.read()
-        expected_data = {'temperature': '0', 'altitude': '100'}
-        self.assertEqual(data, expected_data)
+        self.assertEqual(data, expected_sample(0.0, 100.0, data))
+        self.assertIs(client.last, data)
+
+    def test_binary_payload_decoded(self):
+        """Confirms versioned binary payloads are decoded with struct."""
+        payload = struct.pack('<Bdff', 1, 1234.5, 21.5, 180.25)
+        self.assertEqual(control.i2cdataclient.parse_data(payload),
+                         control.i2cdataclient.SensorSample(21.5, 180.25, 1234.5))
+
+    def test_invalid_data_returns_none(self):
+        """Confirms unknown versions and bad text don't raise."""
+        self.assertIsNone(control.i2cdataclient.parse_data(b'\x07abc'))
+        self.assertIsNone(control.i2cdataclient.parse_data(b'Temperature: x'))
+
+    def test_requests_are_pipelined(self):
+        """Confirms several reads are in flight and answered in order."""
+        self.socket_mock.poll.return_value = 0
+        client = control.i2cdataclient.I2cDataClient('connection_string')
+        first = client.read_async()
+        second = client.read_async()
+        self.assertEqual(self.socket_mock.send_multipart.call_count, 2)
+        self.assertFalse(first.done())
+        self.socket_mock.poll.return_value = 1
+        self.socket_mock.recv_multipart.side_effect = [
+            [b'', 'Temperature: 1 Altitude: 10'], [b'', 'Temperature: 2 Altitude: 20']]
+        second_sample = second.result()
+        self.assertEqual(second_sample, expected_sample(2.0, 20.0, second_sample))
+        first_sample = first.result()
+        self.assertEqual(first_sample, expected_sample(1.0, 10.0, first_sample))
+
+    def test_lost_server_reconnects(self):
+        """Confirms an unanswered request fails and the socket is reopened."""
+        self.socket_mock.poll.return_value = 0
+        client = control.i2cdataclient.I2cDataClient('connection_string', timeout=0.01)
+        self.assertIsNone(client.read())
+        client.poll()
+        self.assertEqual(self.context_mock.socket.call_count, 2)
+        self.socket_mock.close.assert_called_once_with()
+
+    def test_read_latest_max_age(self):
+        """Confirms a sample older than max_age is not returned as the latest."""
+        self.socket_mock.poll.return_value = 1
+        self.socket_mock.recv_multipart.return_value = [b'', 'Temperature: 1 Altitude: 10']
+        client = control.i2cdataclient.I2cDataClient('connection_string')
+        self.assertIsNone(client.read_latest(max_age=1.0))  # Nothing read yet
+        client.read()
+        self.socket_mock.poll.return_value = 0
+        self.assertIsNotNone(client.read_latest(max_age=1.0))
+        client.last_time -= 5
+        self.assertIsNone(client.read_latest(max_age=1.0))
+        self.assertIs(client.read_latest(), client.last)
+
+    def test_subscriber_keeps_latest_and_history(self):
+        """Confirms published samples update the latest sample and history."""
+        self.socket_mock.poll.side_effect = [1, 1, 0]
+        self.socket_mock.recv.side_effect = ['Temperature: 1 Altitude: 10',
+                                             'Temperature: 2 Altitude: 20']
+        subscriber = control.i2cdataclient.I2cDataSubscriber('connection_string', history=5)
+        latest = subscriber.read_latest()
+        self.assertEqual(latest, expected_sample(2.0, 20.0, latest))
+        self.socket_mock.poll.side_effect = None
+        self.socket_mock.poll.return_value = 0
+        history = subscriber.history()
+        self.assertEqual([(sample.temperature, sample.altitude) for _, sample in history],
+                         [(1.0, 10.0), (2.0, 20.0)])
+        self.assertLess(subscriber.age(), 5)
@@ -0,0 +1,28 @@
+"""Tests the lazy module imports"""
+from mock import patch
+import control.lazy
+
+
+def test_module_imported_on_first_use():
+    json = control.lazy.LazyModule('json')
+    assert json.name == 'json'
+    assert json.dumps([1]) == '[1]'
+    assert json.loaded
+
+
+def test_attributes_can_be_patched():
+    os_path = control.lazy.LazyModule('os.path')
+    with patch('os.path.exists', return_value='patched'):
+        assert os_path.exists('/nowhere') == 'patched'
+    assert os_path.exists('/nowhere') is False
+
+
+def test_missing_module_raises_on_use():
+    missing = control.lazy.LazyModule('control.no_such_module')
+    assert not missing.loaded
+    try:
+        missing.anything
+    except ImportError:
+        pass
+    else:
+        assert False, 'ImportError not raised'
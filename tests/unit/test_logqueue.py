@@ -0,0 +1,133 @@
+"""Tests the queued logging pipeline."""
+import logging
+import Queue
+import control.logqueue
+
+
+class FakeClock(object):
+    """A clock that only moves when told to."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecordingHandler(logging.Handler):
+    """Keeps the formatted messages and counts the syncs."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.syncs = 0
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+    def sync(self):
+        self.syncs += 1
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    return logger
+
+
+def test_listener_writes_records_in_order():
+    """Confirm queued records are formatted and written by the listener, and synced on stop."""
+    queue = Queue.Queue()
+    recorder = RecordingHandler()
+    listener = control.logqueue.QueueListener(queue, [recorder], fsync_interval=60)
+    listener.start()
+    logger = make_logger('test_logqueue.order', control.logqueue.QueueHandler(queue))
+    for index in range(100):
+        logger.debug('Record %d', index)
+    listener.stop()
+    assert recorder.messages == ['Record {}'.format(index) for index in range(100)]
+    assert recorder.syncs == 1
+
+
+def test_full_queue_drops_records():
+    """Confirm records are dropped and counted instead of blocking when the queue is full."""
+    handler = control.logqueue.QueueHandler(Queue.Queue(2))
+    logger = make_logger('test_logqueue.full', handler)
+    for index in range(5):
+        logger.debug('Record %d', index)
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_records_formatted_before_queueing():
+    """Confirm the arguments and traceback are merged into the queued message."""
+    handler = control.logqueue.QueueHandler(Queue.Queue())
+    logger = make_logger('test_logqueue.prepare', handler)
+    velocity = [1, 2]
+    logger.debug('Velocity: %s', velocity)
+    velocity.append(3)
+    try:
+        raise ValueError('bad')
+    except ValueError:
+        logger.exception('Failed')
+    record = handler.queue.get()
+    assert record.msg == 'Velocity: [1, 2]' and record.args is None
+    record = handler.queue.get()
+    assert record.exc_info is None
+    assert record.getMessage().startswith('Failed\nTraceback')
+    assert record.getMessage().endswith('ValueError: bad')
+
+
+def test_rate_limit_per_key():
+    """Confirm messages logged with a key are limited per key and the suppressed
+    ones are counted, and the others all pass."""
+    clock = FakeClock()
+    handler = control.logqueue.QueueHandler(Queue.Queue())
+    handler.addFilter(control.logqueue.RateLimitFilter(1.0, clock=clock))
+    logger = make_logger('test_logqueue.rate', handler)
+    for index in range(5):
+        logger.debug('Velocity: %s', index, extra={'key': 'velocity'})
+        logger.debug('Destination %s', index)
+        logger.error('Error %s', index, extra={'key': 'error'})
+    clock.now = 1.0
+    logger.debug('Velocity: %s', 9, extra={'key': 'velocity'})
+    logger.info('Mode %s', 'AUTO', extra={'key': 'mode'})
+    logger.info('Mode %s', 'GUIDED', extra={'key': 'mode'})
+    messages = []
+    while not handler.queue.empty():
+        messages.append(handler.queue.get().getMessage())
+    expected = ['Velocity: 0']
+    for index in range(5):
+        expected += ['Destination {}'.format(index), 'Error {}'.format(index)]
+    assert messages == expected + ['Velocity: 9 (4 similar suppressed)', 'Mode AUTO']
+
+
+def test_stop_writes_suppressed_counts():
+    """Confirm the suppressed counts not reported yet are written when stopping."""
+    recorder = RecordingHandler()
+    queue_handler, listener = control.logqueue.start_logging(
+        make_logger('test_logqueue.stop', logging.NullHandler()), console=False,
+        rate_limit_interval=60)
+    listener.handlers.append(recorder)
+    logger = logging.getLogger('test_logqueue.stop')
+    for index in range(3):
+        logger.debug('Velocity: %s', index, extra={'key': 'velocity'})
+    logger.info('Mode %s', 'AUTO', extra={'key': 'mode'})
+    listener.stop()
+    logger.removeHandler(queue_handler)
+    assert recorder.messages == ['Velocity: 0', 'Mode AUTO',
+                                 'Velocity: 2 (last of 2 suppressed)']
+
+
+def test_syncing_file_handler(tmpdir):
+    """Confirm the file is only written out when synced."""
+    path = str(tmpdir.join('flight.log'))
+    handler = control.logqueue.SyncingFileHandler(path)
+    logger = make_logger('test_logqueue.file', handler)
+    logger.debug('Buffered')
+    with open(path) as log_file:
+        assert log_file.read() == ''
+    handler.sync()
+    with open(path) as log_file:
+        assert log_file.read() == 'Buffered\n'
+    handler.close()
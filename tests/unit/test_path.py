@@ -0,0 +1,43 @@
+"""Tests the path module."""
+import numpy
+import pytest
+import control.path
+
+
+def fly(follower, position, step=1.0, limit=1000):
+    """Helper function moves step meters towards the target until the path is
+    done and returns the positions flown through."""
+    positions = [numpy.array(position, dtype=float)]
+    for _ in range(limit):
+        target, _ = follower.update(*positions[-1])
+        if follower.done:
+            return positions
+        offset = target - positions[-1]
+        distance = numpy.sqrt((offset * offset).sum())
+        positions.append(positions[-1] + offset * min(step / distance, 1.0))
+    raise AssertionError('path not completed')
+
+
+def test_follower_blends_corners():
+    """Confirm the corner is cut within the acceptance radius, without stopping."""
+    follower = control.path.PathFollower([0, 20, 20], [0, 0, 20], [10, 10, 10],
+                                         acceptance_radius=2, lookahead=4)
+    positions = fly(follower, (0, 0, 10))
+    distances_to_corner = [numpy.hypot(x - 20, y) for x, y, _ in positions]
+    assert 0.5 < min(distances_to_corner) <= 3
+    assert numpy.hypot(*(positions[-1][:2] - (20, 20))) <= 2
+    assert len(positions) < 45  # 40 m of path at 1 m per step
+
+
+def test_follower_target_and_remaining():
+    """Confirm the target is lookahead ahead along the path (carried over to
+    the next segment) and remaining is the path length left."""
+    follower = control.path.PathFollower([0, 10, 10], [0, 0, 10], [5, 5, 5],
+                                         acceptance_radius=1, lookahead=4)
+    target, remaining = follower.update(8, 0.5, 5)
+    assert follower.segment == 0
+    assert target.tolist() == pytest.approx([10, 2, 5])
+    assert remaining == pytest.approx(12)
+    target, remaining = follower.update(10, 9.5, 5)
+    assert follower.done
+    assert target.tolist() == pytest.approx([10, 10, 5])
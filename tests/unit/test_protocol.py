@@ -0,0 +1,91 @@
+"""Tests the protocol module."""
+import json
+import pytest
+import control.protocol
+
+TELEMETRY = {u'x': 1.5, u'y': -2.25, u'z': 10.0, u'temp': 21.5,
+             u'lat': 33.142220123, u'lon': -87.582491456, u'time': 12.5}
+WAYPOINTS = [{u'x': 10, u'y': 5, u'z': 10}, {u'x': -3, u'y': 0, u'z': 15}]
+
+
+def decode_all(data):
+    """Helper function returns every message decoded from data."""
+    return control.protocol.FrameDecoder().feed(data)
+
+
+def test_telemetry_round_trip_is_compact():
+    """Confirm telemetry is decoded and much smaller than json."""
+    frame = control.protocol.encode_message(TELEMETRY)
+    assert len(frame) * 2 < len(json.dumps(TELEMETRY))
+    assert decode_all(frame) == [TELEMETRY]
+
+
+def test_waypoints_round_trip():
+    """Confirm waypoint lists use the fixed layout and decode correctly."""
+    frame = control.protocol.encode_message(WAYPOINTS)
+    assert frame[2:3] == bytes(bytearray([control.protocol.MSG_WAYPOINTS]))
+    assert decode_all(frame) == [WAYPOINTS]
+
+
+def test_strings_and_other_data_round_trip():
+    """Confirm status strings and arbitrary data still work."""
+    messages = [u'Reached target altitude', {u'command': u'abort'}, [1, 2, 3]]
+    data = b''.join(control.protocol.encode_message(msg) for msg in messages)
+    assert decode_all(data) == messages
+
+
+def test_decoder_handles_chunks_garbage_and_corruption():
+    """Confirm the decoder resyncs after garbage and skips bad frames."""
+    good = control.protocol.encode_message(TELEMETRY)
+    corrupt = bytearray(control.protocol.encode_message(u'corrupt'))
+    corrupt[6] ^= 0xff
+    data = b'\x00\xa5garbage' + bytes(corrupt) + good
+    decoder = control.protocol.FrameDecoder()
+    messages = []
+    for index in range(len(data)):
+        messages.extend(decoder.feed(data[index:index + 1]))
+    assert messages == [TELEMETRY]
+    assert decoder.errors == 1
+
+
+def test_decoder_does_not_wait_for_a_corrupted_length():
+    """Confirm a frame with a corrupted length is dropped at once."""
+    corrupt = bytearray(control.protocol.encode_message(u'corrupt'))
+    corrupt[4] ^= 0xff  # Length high byte
+    good = control.protocol.encode_message(TELEMETRY)
+    decoder = control.protocol.FrameDecoder()
+    assert decoder.feed(bytes(corrupt) + good) == [TELEMETRY]
+    assert decoder.errors == 1
+
+
+def test_decoder_json_lines():
+    """Confirm json lines between frames are decoded when asked for."""
+    frame = control.protocol.encode_message(TELEMETRY)
+    data = b'{"command": "abort"}\n' + frame + b'[1, 2]\n{"partial'
+    decoder = control.protocol.FrameDecoder(json_lines=True)
+    assert decoder.feed(data) == [{u'command': u'abort'}, TELEMETRY, [1, 2]]
+    assert decoder.feed(b'": 1}\n') == [{u'partial': 1}]
+    assert decode_all(data) == [TELEMETRY]
+
+
+def test_message_too_large_for_a_frame():
+    """Confirm data too large for a frame raises ValueError."""
+    with pytest.raises(ValueError):
+        control.protocol.encode_message(u'x' * (control.protocol.MAX_PAYLOAD + 1))
+
+
+def test_telemetry_batch_splits_on_large_changes():
+    """Confirm a batch starts a new frame when a delta does not fit."""
+    samples = [dict(TELEMETRY), dict(TELEMETRY, time=13.0), dict(TELEMETRY, time=500.0)]
+    data = control.protocol.encode_telemetry_batch(samples)
+    assert data.count(control.protocol.SYNC) == 2
+    decoded = decode_all(data)
+    assert [sample[u'time'] for sample in decoded] == [12.5, 13.0, 500.0]
+
+
+def test_telemetry_batch_without_temperature():
+    """Confirm a sample without a temperature is sent on its own in a batch."""
+    samples = [dict(TELEMETRY), dict(TELEMETRY, temp=None), dict(TELEMETRY, time=13.0)]
+    decoded = decode_all(control.protocol.encode_telemetry_batch(samples))
+    assert [sample[u'temp'] for sample in decoded] == [21.5, None, 21.5]
+    assert decoded[1] == samples[1]
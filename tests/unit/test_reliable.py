@@ -0,0 +1,86 @@
+"""Tests the reliable module."""
+import threading
+import unittest
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import control.reliable
+
+
+class FakeCom:
+    """In memory Communication end point that loses some of what it sends."""
+    def __init__(self, inbox, outbox, lose=None):
+        self.inbox = inbox
+        self.outbox = outbox
+        self.lose = lose or (lambda message: False)
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+        if not self.lose(data):
+            self.outbox.put(data)
+
+    def receive(self):
+        try:
+            return self.inbox.get(timeout=0.01)
+        except queue.Empty:
+            return None
+
+
+def is_chunk(message, seq):
+    """Returns True if message is the chunk with sequence number seq."""
+    return message.get(u'rel') == u'data' and message[u'seq'] == seq
+
+
+class ReliableLinkTest(unittest.TestCase):
+    """ReliableLink unit tests."""
+    def setUp(self):
+        self.to_receiver = queue.Queue()
+        self.to_sender = queue.Queue()
+
+    def transfer(self, data, lose):
+        """Sends data from one link to the other, returns (sent ok, received)."""
+        sender_com = FakeCom(self.to_sender, self.to_receiver, lose)
+        self.sender = control.reliable.ReliableLink(sender_com, chunk_size=16,
+                                                    retransmit_timeout=0.2)
+        receiver = control.reliable.ReliableLink(FakeCom(self.to_receiver, self.to_sender))
+        received = []
+        thread = threading.Thread(target=lambda: received.append(receiver.receive(timeout=5)))
+        thread.start()
+        sent = self.sender.send(data, timeout=5)
+        thread.join()
+        return sent, received[0]
+
+    def test_message_is_delivered(self):
+        """Confirm a multi chunk message arrives intact."""
+        waypoints = [{u'x': i, u'y': -i, u'z': 10} for i in range(20)]
+        sent, received = self.transfer(waypoints, None)
+        self.assertTrue(sent)
+        self.assertEqual(received, waypoints)
+        self.assertEqual(self.sender.retransmits, 0)
+
+    def test_only_lost_chunks_are_resent(self):
+        """Confirm a lost chunk is the only one retransmitted."""
+        waypoints = [{u'x': i, u'y': -i, u'z': 10} for i in range(20)]
+        lost = []
+
+        def lose(message):
+            """Loses the first transmission of chunk 3."""
+            if is_chunk(message, 3) and not lost:
+                lost.append(message)
+                return True
+            return False
+        sent, received = self.transfer(waypoints, lose)
+        self.assertTrue(sent)
+        self.assertEqual(received, waypoints)
+        self.assertEqual(self.sender.retransmits, 1)
+        resent = [message for message in self.sender.com.sent if is_chunk(message, 3)]
+        self.assertEqual(len(resent), 2)
+
+    def test_plain_messages_pass_through(self):
+        """Confirm messages sent without ReliableLink are returned as is."""
+        self.to_receiver.put([{u'x': 1, u'y': 2, u'z': 3}])
+        link = control.reliable.ReliableLink(FakeCom(self.to_receiver, self.to_sender))
+        self.assertEqual(link.receive(), [{u'x': 1, u'y': 2, u'z': 3}])
+        self.assertIsNone(link.receive())
@@ -0,0 +1,53 @@
+"""Tests the route module."""
+import itertools
+import time
+import numpy
+import control.route
+
+
+def test_optimize_route_finds_shortest_small_route():
+    """Confirm small routes are as short as the best of every order."""
+    rng = numpy.random.RandomState(204)
+    for count in range(1, 8):
+        xs = rng.uniform(-250, 250, count)
+        ys = rng.uniform(-250, 250, count)
+        order = control.route.optimize_route(xs, ys)
+        assert sorted(order) == list(range(count))
+        best = min(control.route.route_length(xs, ys, permutation)
+                   for permutation in itertools.permutations(range(count)))
+        assert control.route.route_length(xs, ys, order) <= best + 1e-6
+
+
+def test_optimize_route_untangles_circle():
+    """Confirm points on a circle given in a shuffled order are flown around it."""
+    angles = numpy.linspace(0, 2 * numpy.pi, 40, endpoint=False)
+    shuffled = numpy.random.RandomState(1).permutation(40)
+    xs = 100 * numpy.cos(angles[shuffled]) + 150
+    ys = 100 * numpy.sin(angles[shuffled])
+    order = control.route.optimize_route(xs, ys)
+    around = control.route.route_length(xs, ys, numpy.argsort(shuffled))
+    assert control.route.route_length(xs, ys, order) <= around + 1e-6
+
+
+def test_optimize_route_respects_time_budget():
+    """Confirm a few thousand points are ordered within the time budget."""
+    rng = numpy.random.RandomState(3)
+    xs = rng.uniform(-250, 250, 2000)
+    ys = rng.uniform(-250, 250, 2000)
+    start = time.time()
+    order = control.route.optimize_route(xs, ys, time_budget=0.2)
+    assert time.time() - start < 1
+    assert sorted(order) == list(range(2000))
+    assert (control.route.route_length(xs, ys, order) <
+            control.route.route_length(xs, ys, range(2000)) / 5)
+
+
+def test_nearest_neighbour_respects_time_budget():
+    """Confirm the nearest neighbour route stops at the deadline and keeps every point."""
+    rng = numpy.random.RandomState(5)
+    xs = rng.uniform(-250, 250, 20000)
+    ys = rng.uniform(-250, 250, 20000)
+    start = time.time()
+    order = control.route.optimize_route(xs, ys, time_budget=0.05)
+    assert time.time() - start < 1
+    assert sorted(order) == list(range(20000))
@@ -0,0 +1,79 @@
+"""Tests the scheduler module with a simulated clock."""
+import pytest
+import control.scheduler
+
+
+class FakeClock(object):
+    """A clock that only moves when waiting or when a task takes time."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def wait(self, seconds):
+        self.now += seconds
+
+    def task(self, duration, runs):
+        """Returns a callback recording its start times and taking duration."""
+        def _callback():
+            runs.append(self.now)
+            self.now += duration
+        return _callback
+
+
+def test_tasks_run_at_independent_rates():
+    """Confirm each task runs at its own rate, in the order added when due together."""
+    clock = FakeClock()
+    scheduler = control.scheduler.Scheduler(clock, clock.wait)
+    fast, slow, order = [], [], []
+    scheduler.add_task('fast', 10, lambda: (fast.append(clock.now), order.append('fast')))
+    scheduler.add_task('slow', 2, lambda: (slow.append(clock.now), order.append('slow')))
+    assert not scheduler.run(timeout=1.0)
+    assert fast == pytest.approx([i / 10.0 for i in range(10)])
+    assert slow == pytest.approx([0.0, 0.5])
+    assert order[:2] == ['fast', 'slow']
+
+
+def test_no_drift_from_task_duration():
+    """Confirm releases stay on the grid when the tasks take time."""
+    clock = FakeClock()
+    scheduler = control.scheduler.Scheduler(clock, clock.wait)
+    runs = []
+    scheduler.add_task('work', 10, clock.task(0.03, runs))
+    scheduler.run(timeout=10.0)
+    assert len(runs) == 100
+    assert runs[-1] == pytest.approx(9.9)
+    assert scheduler.stats()['work']['misses'] == 0
+    assert scheduler.stats()['work']['mean_time'] == pytest.approx(0.03)
+
+
+def test_deadline_misses_counted():
+    """Confirm overrunning tasks skip releases and count deadline misses."""
+    clock = FakeClock()
+    scheduler = control.scheduler.Scheduler(clock, clock.wait)
+    runs = []
+    scheduler.add_task('slow', 10, clock.task(0.25, runs))
+    scheduler.run(timeout=1.0)
+    stats = scheduler.stats()['slow']
+    assert runs == pytest.approx([0.0, 0.25, 0.5, 0.75])
+    assert stats['runs'] == 4
+    assert stats['skipped'] == 4  # Releases at 0.1, 0.3, 0.4 and 0.6
+    assert stats['misses'] == 8  # Plus every run overran its period
+    assert stats['max_lateness'] == pytest.approx(0.05)
+    assert 'slow: 10 Hz, 4 runs, 8 deadline misses (4 skipped)' in scheduler.report()[0]
+
+
+def test_stop_and_errors():
+    """Confirm stop() ends the run and a failing task does not stop the others."""
+    clock = FakeClock()
+    scheduler = control.scheduler.Scheduler(clock, clock.wait)
+    runs = []
+
+    def _fail():
+        raise RuntimeError('sensor unplugged')
+    scheduler.add_task('fail', 5, _fail)
+    scheduler.add_task('count', 5, lambda: runs.append(clock.now))
+    assert scheduler.run(stop=lambda: len(runs) == 3, timeout=10.0)
+    assert len(runs) == 3
+    assert scheduler.stats()['fail']['runs'] == 3
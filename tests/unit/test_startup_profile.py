@@ -0,0 +1,46 @@
+"""Tests the startup profile and that heavy dependencies are imported lazily"""
+import os
+import subprocess
+import sys
+import control.startup_profile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_gps_does_not_import_device_libraries():
+    seconds, modules = control.startup_profile.import_time('control.gps')
+    assert seconds > 0
+    assert 'pynmea2' not in modules
+    assert 'serial' not in modules
+    assert 'dronekit' not in modules
+
+
+def test_main_does_not_import_device_libraries():
+    _, modules = control.startup_profile.import_time('control.main')
+    assert 'dronekit' not in modules
+    assert 'pymavlink' not in modules
+    assert 'serial' not in modules
+    assert 'zmq' not in modules
+
+
+def test_i2cdataclient_does_not_import_zmq():
+    _, modules = control.startup_profile.import_time('control.i2cdataclient')
+    assert 'zmq' not in modules
+
+
+def test_controller_imports_pymavlink_on_first_use():
+    script = ('import sys, control.controller\n'
+              'before = "pymavlink" in sys.modules\n'
+              'control.controller.mavutil.mavlink\n'
+              'print("%s %s" % (before, "pymavlink" in sys.modules))\n')
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT)
+    assert output.decode('ascii').split() == ['False', 'True']
+
+
+def test_import_report_lists_dependencies():
+    lines = control.startup_profile.import_report(['dronekit', 'control.no_such_module'])
+    assert lines[0].startswith('dronekit ')
+    dependencies = lines[0].rpartition('(')[2].rstrip(')').split(', ')
+    assert 'pymavlink' in dependencies
+    assert lines[1].endswith('failed')
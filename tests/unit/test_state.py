@@ -0,0 +1,50 @@
+"""Tests the state module."""
+import pytest
+from mock import Mock, patch
+import control.gps
+import control.state
+
+HOME = control.gps.GpsReading(33.142220, -87.582491, 0, 0)
+
+
+def snapshot(north, east, target=None):
+    """Helper function returns a VehicleState at an offset from HOME."""
+    reading = control.gps.get_location_offset(HOME, north, east)
+    location = Mock(lat=reading.latitude, lon=reading.longitude, alt=12.0)
+    return control.state.VehicleState(7, location, 'GUIDED', True,
+                                      home_frame=control.gps.LocalFrame(HOME),
+                                      target_frame=target and control.gps.LocalFrame(target))
+
+
+def test_state_is_immutable():
+    """Confirm a snapshot can not be changed."""
+    state = snapshot(0, 0)
+    with pytest.raises(AttributeError):
+        state.mode = 'LAND'
+    with pytest.raises(AttributeError):
+        state.other = 1
+    assert not hasattr(state, '__dict__')
+
+
+def test_state_derived_values():
+    """Confirm the derived values are computed from the snapshot."""
+    state = snapshot(30, 40, target=control.gps.get_location_offset(HOME, 30, 50))
+    assert state.seq == 7 and state.altitude == 12.0
+    assert state.xy == pytest.approx((40, 30))
+    assert state.distance_to_home == pytest.approx(50)
+    assert state.distance_to_target == pytest.approx(10, abs=0.01)
+    assert snapshot(0, 0).distance_to_target is None
+    unarmed = control.state.VehicleState(7, state.location, 'GUIDED', False,
+                                         target_frame=state.target_frame)
+    assert unarmed.xy is None
+    assert unarmed.distance_to_target == pytest.approx(10, abs=0.01)
+
+
+def test_state_derived_values_computed_once():
+    """Confirm derived values are cached in the snapshot."""
+    state = snapshot(30, 40)
+    with patch.object(control.gps.LocalFrame, 'to_xy', return_value=(40.0, 30.0)) as to_xy:
+        for _ in range(3):
+            assert state.xy == (40.0, 30.0)
+            assert state.distance_to_home == 50.0
+    assert to_xy.call_count == 1